@@ -0,0 +1,112 @@
+"""多进程批量渲染：把大量生成任务分发到进程池，结果边完成边写盘"""
+import itertools
+import multiprocessing
+import os
+import random
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from audio_render import SAMPLE_RATE
+from composer_engine import CompositionEngine
+from corpus_index import CorpusIndex, fingerprint
+
+# 单个渲染任务：序号、生成模式、音阶、小节数、速度、种子、输出文件、是否按乐器分轨、流式分块小节数、
+# 音频预览文件（不需要时为None）、音频采样率、语料模型文件（不需要时为None）、
+# 去重索引文件（不需要时为None）及去重方式（exact 或 shape）
+RenderJob = namedtuple('RenderJob', 'index mode scale bars tempo seed filename multitrack chunk_bars '
+                                    'wav_filename sample_rate model_file index_file dedup')
+# 渲染结果：序号、输出文件、音符数、是否因与已有乐曲重复而跳过（此时不写出任何文件）
+RenderResult = namedtuple('RenderResult', 'index filename note_count duplicate')
+
+# 工作进程中复用的引擎（按速度缓存）、语料模型和去重索引连接（按文件缓存）
+_worker_engines = {}
+_worker_models = {}
+_worker_indexes = {}
+
+
+def derive_seed(master_seed, index):
+    """由主种子和任务序号派生出互不相关且可复现的子种子"""
+    sequence = np.random.SeedSequence(master_seed, spawn_key=(index,))
+    low, high = sequence.generate_state(2).tolist()
+    return (high << 32) | low
+
+
+def new_master_seed():
+    """在未指定主种子时随机挑选一个，便于事后复现"""
+    return random.SystemRandom().getrandbits(63)
+
+
+def iter_jobs(output_dir, modes, scales, count, bars, tempo, master_seed, prefix="piece",
+              multitrack=False, chunk_bars=None, wav=False, sample_rate=SAMPLE_RATE, model_file=None,
+              index_file=None, dedup='exact'):
+    """按 模式 × 音阶 × 数量 展开渲染任务，wav 为真时每首同时渲染同名的 .wav 预览
+
+    model_file 为语料模式使用的模型文件；指定 index_file 时按 dedup 方式跳过与索引中重复的乐曲
+    （不支持流式分块）。
+    """
+    total = len(modes) * len(scales) * count
+    width = len(str(max(total - 1, 0)))
+    combos = itertools.product(modes, scales, range(count))
+    for index, (mode, scale, _) in enumerate(combos):
+        stem = os.path.join(output_dir, f"{prefix}_{index:0{width}d}")
+        yield RenderJob(index, mode, scale, bars, tempo, derive_seed(master_seed, index), stem + ".mid",
+                        multitrack, chunk_bars, stem + ".wav" if wav else None, sample_rate, model_file,
+                        index_file, dedup)
+
+
+def render_job(job):
+    """渲染单个任务并写入文件（在工作进程中执行）"""
+    engine = _worker_engines.get(job.tempo)
+    if engine is None:
+        engine = _worker_engines[job.tempo] = CompositionEngine(tempo=job.tempo)
+    if job.model_file:
+        model = _worker_models.get(job.model_file)
+        if model is None:
+            model = _worker_models[job.model_file] = engine.load_corpus_model(job.model_file)
+        engine.corpus_model = model
+    if job.index_file is None:
+        note_count = engine.render_to_file(job.filename, job.mode, job.bars, job.scale, job.seed,
+                                           job.multitrack, job.chunk_bars, job.wav_filename, job.sample_rate)
+        return RenderResult(job.index, job.filename, note_count, False)
+
+    # 先在索引中登记指纹，重复的乐曲不写出任何文件（也不渲染音频）
+    notes = engine.generate(job.mode, job.bars, job.scale, np.random.default_rng(job.seed))
+    index = _worker_indexes.get(job.index_file)
+    if index is None:
+        index = _worker_indexes[job.index_file] = CorpusIndex(job.index_file)
+    if not index.add(fingerprint(notes), job.filename, len(notes), job.dedup):
+        return RenderResult(job.index, None, len(notes), True)
+    engine.save_notes(job.filename, notes, job.multitrack, job.wav_filename, job.sample_rate)
+    return RenderResult(job.index, job.filename, len(notes), False)
+
+
+def render_batch(jobs, total, workers=None, progress=None):
+    """并行执行渲染任务，按完成顺序逐个产出结果
+
+    progress 为可选回调 progress(已完成数, 总数, 已用秒数)。
+    """
+    workers = workers or os.cpu_count() or 1
+    started = time.perf_counter()
+    done = 0
+
+    if workers == 1:
+        results = map(render_job, jobs)
+        pool = None
+    else:
+        # 每块任务足够大以摊薄进程间通信，又足够小以保持负载均衡
+        chunksize = max(1, min(64, total // (workers * 8)))
+        pool = multiprocessing.Pool(workers)
+        results = pool.imap_unordered(render_job, jobs, chunksize)
+
+    try:
+        for result in results:
+            done += 1
+            if progress is not None:
+                progress(done, total, time.perf_counter() - started)
+            yield result
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
@@ -0,0 +1,324 @@
+"""性能基准：对生成、导出、演奏编译和钢琴卷帘绘制计时，结果以JSON输出便于跨版本比较
+
+    python benchmark.py --sizes 16,256,4096,100000 -o bench.json
+    python benchmark.py --baseline bench.json   # 与上次结果比较，变慢超过容差时返回1
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+
+from composer_engine import CompositionEngine, SCALE_MAP, TICKS_PER_BEAT
+from performance import compile_performance
+from piano_roll import PianoRoll
+from playback_scheduler import PlaybackScheduler
+
+SCHEMA_VERSION = 1
+DEFAULT_SIZES = (16, 256, 4096, 100000)
+BENCHMARKS = ("generate_rachmaninoff", "generate_random", "create_midi_file", "compile_performance",
+              "draw_notes")
+MIN_REGRESSION_SECONDS = 0.001  # 比较时忽略小于该值的耗时差（计时噪声）
+NOTE_NAMES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+
+
+def note_name(midi_note):
+    return f"{NOTE_NAMES[midi_note % 12]}{midi_note // 12 - 1}"
+
+
+class OffscreenCanvas:
+    """没有显示器时代替 tk.Canvas：只在内存中记录图元，保留钢琴卷帘的全部调用路径"""
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.items = {}
+        self.next_id = 1
+        self.offset = 0.0
+        self.region = (0, 0, width, height)
+
+    def winfo_width(self):
+        return self.width
+
+    def winfo_height(self):
+        return self.height
+
+    def _create(self, *coords, tags=(), **options):
+        item = self.next_id
+        self.next_id += 1
+        self.items[item] = (coords, tags, options)
+        return item
+
+    create_rectangle = create_text = create_line = create_image = _create
+
+    def _select(self, tag):
+        if isinstance(tag, int):
+            return [tag] if tag in self.items else []
+        if tag == "all":
+            return list(self.items)
+        return [item for item, (_, tags, _) in self.items.items() if tag in tags]
+
+    def delete(self, tag):
+        for item in self._select(tag):
+            del self.items[item]
+
+    def itemconfigure(self, tag, **options):
+        for item in self._select(tag):
+            self.items[item][2].update(options)
+
+    def coords(self, item, *coords):
+        if coords:
+            _, tags, options = self.items[item]
+            self.items[item] = (coords, tags, options)
+        return self.items[item][0]
+
+    def scale(self, tag, x0, y0, sx, sy):
+        pass
+
+    def tag_lower(self, tag):
+        pass
+
+    def tag_raise(self, tag):
+        pass
+
+    def canvasx(self, x):
+        return self.offset + x
+
+    def configure(self, scrollregion=None, **options):
+        if scrollregion is not None:
+            self.region = scrollregion
+
+    def xview_moveto(self, fraction):
+        self.offset = fraction * (self.region[2] - self.region[0])
+
+    def after_idle(self, func):
+        return None
+
+    def after_cancel(self, job):
+        pass
+
+    def update_idletasks(self):
+        pass
+
+
+class OffscreenPianoRoll(PianoRoll):
+    """使用 OffscreenCanvas 的钢琴卷帘（不创建任何Tk组件）"""
+
+    def __init__(self, ticks_per_bar, octave_range, note_name, width=1200, height=500):
+        self.canvas = OffscreenCanvas(width, height)
+        self._init_state(ticks_per_bar, octave_range, note_name)
+
+
+def make_piano_roll(engine, width=1200, height=500):
+    """优先使用隐藏的Tk窗口；没有显示器时改用内存中的替身画布
+
+    返回 (钢琴卷帘, 等待绘制完成的函数, 画布类型)。
+    """
+    ticks_per_bar = TICKS_PER_BEAT * engine.time_signature[0]
+    try:
+        import tkinter as tk
+        root = tk.Tk()
+    except Exception:
+        roll = OffscreenPianoRoll(ticks_per_bar, engine.octave_range, note_name, width, height)
+        return roll, roll.canvas.update_idletasks, "offscreen"
+    root.withdraw()
+    root.geometry(f"{width}x{height}")
+    roll = PianoRoll(root, ticks_per_bar, engine.octave_range, note_name)
+    roll.canvas.configure(width=width, height=height)
+    root.update_idletasks()
+    return roll, root.update_idletasks, "tk"
+
+
+def measure(func, repeat):
+    """计时 func：先重复 repeat 次取耗时，再单独运行一次统计Python堆（含NumPy数组）的峰值"""
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - started)
+    del result
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return times, peak
+
+
+def record(name, bars, notes, times, peak):
+    """一条基准结果：中位耗时和吞吐量（音符/秒、小节/秒）"""
+    median = statistics.median(times)
+    return {
+        'name': name,
+        'bars': bars,
+        'notes': notes,
+        'seconds': median,
+        'min_seconds': min(times),
+        'repeat': len(times),
+        'notes_per_second': notes / median if median > 0 else None,
+        'bars_per_second': bars / median if median > 0 else None,
+        'peak_memory_bytes': peak,
+    }
+
+
+def run_size(engine, bars, scale, seed, repeat, selected, piano_roll=None, flush=None):
+    """在一个乐曲长度下运行所选的基准"""
+    results = []
+    notes = engine.generate_rachmaninoff_style(bars, scale, np.random.default_rng(seed))
+    count = len(notes)
+
+    if "generate_rachmaninoff" in selected:
+        times, peak = measure(
+            lambda: engine.generate_rachmaninoff_style(bars, scale, np.random.default_rng(seed)), repeat)
+        results.append(record("generate_rachmaninoff", bars, count, times, peak))
+    if "generate_random" in selected:
+        random_count = len(engine.generate_random(bars, scale, np.random.default_rng(seed)))
+        times, peak = measure(lambda: engine.generate_random(bars, scale, np.random.default_rng(seed)), repeat)
+        results.append(record("generate_random", bars, random_count, times, peak))
+    if "create_midi_file" in selected:
+        times, peak = measure(lambda: engine.create_midi_file(notes), repeat)
+        results.append(record("create_midi_file", bars, count, times, peak))
+    if "compile_performance" in selected:
+        times, peak = measure(lambda: compile_performance(notes, engine.tempo, TICKS_PER_BEAT), repeat)
+        results.append(record("compile_performance", bars, count, times, peak))
+    if "draw_notes" in selected and piano_roll is not None:
+        def draw():
+            piano_roll.set_notes(notes)
+            flush()
+        times, peak = measure(draw, repeat)
+        results.append(record("draw_notes", bars, count, times, peak))
+    return results
+
+
+def measure_jitter(engine, scale, seed, seconds):
+    """按真实时间调度一段演奏（不发送MIDI），统计调度延迟和抖动"""
+    # 拉赫玛尼诺夫风格按整段变奏生成，过短时没有音符
+    bars = max(16, int(np.ceil(seconds * engine.tempo / 60 / engine.time_signature[0])))
+    notes = engine.generate_rachmaninoff_style(bars, scale, np.random.default_rng(seed))
+    performance = compile_performance(notes, engine.tempo, TICKS_PER_BEAT)
+    end = int(np.searchsorted(performance.times, seconds, side='right'))
+    sink = []
+
+    def dispatch(lo, hi):
+        # 与实际播放一样取出本组消息，只是不发送
+        sink.extend(performance.messages(lo, hi))
+        sink.clear()
+
+    scheduler = PlaybackScheduler()
+    scheduler.run(performance.times[:end], dispatch)
+    stats = scheduler.stats()._asdict()
+    stats['seconds'] = seconds
+    return stats
+
+
+def environment():
+    """记录运行环境，便于比较不同机器或版本的结果"""
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def run_benchmarks(sizes, repeat=3, scale="C大调", seed=1, jitter_seconds=5.0, selected=BENCHMARKS,
+                   progress=None):
+    """运行全部基准，返回可直接序列化为JSON的结果"""
+    engine = CompositionEngine()
+    piano_roll, flush, canvas = None, None, None
+    if "draw_notes" in selected:
+        piano_roll, flush, canvas = make_piano_roll(engine)
+    results = []
+    for bars in sizes:
+        if progress is not None:
+            progress(f"{bars} 小节")
+        results.extend(run_size(engine, bars, scale, seed, repeat, selected, piano_roll, flush))
+    jitter = None
+    if jitter_seconds > 0:
+        if progress is not None:
+            progress(f"调度抖动（{jitter_seconds} 秒）")
+        jitter = measure_jitter(engine, scale, seed, jitter_seconds)
+    return {
+        'schema': SCHEMA_VERSION,
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'environment': environment(),
+        'settings': {'sizes': list(sizes), 'repeat': repeat, 'scale': scale, 'seed': seed,
+                     'tempo': engine.tempo, 'canvas': canvas},
+        'results': results,
+        'scheduler': jitter,
+    }
+
+
+def compare(report, baseline, tolerance):
+    """与基准结果逐项比较中位耗时，返回变慢超过容差的条目 (名称, 小节数, 旧耗时, 新耗时)"""
+    previous = {(item['name'], item['bars']): item['seconds'] for item in baseline.get('results', [])}
+    regressions = []
+    for item in report['results']:
+        old = previous.get((item['name'], item['bars']))
+        if old and item['seconds'] > old * (1 + tolerance) and item['seconds'] - old > MIN_REGRESSION_SECONDS:
+            regressions.append((item['name'], item['bars'], old, item['seconds']))
+    return regressions
+
+
+def build_parser():
+    """创建命令行参数解析器"""
+    parser = argparse.ArgumentParser(description="生成、导出、演奏编译和绘制的性能基准")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                        help="逗号分隔的小节数列表")
+    parser.add_argument("--repeat", type=int, default=3, help="每项重复次数（取中位数）")
+    parser.add_argument("--scale", default="C大调", choices=list(SCALE_MAP.keys()), help="音阶")
+    parser.add_argument("--seed", type=int, default=1, help="随机种子")
+    parser.add_argument("--only", action="append", choices=BENCHMARKS,
+                        help="只运行指定的基准（可重复）")
+    parser.add_argument("--jitter-seconds", type=float, default=5.0,
+                        help="实时调度抖动测量的时长（秒），0 表示跳过")
+    parser.add_argument("-o", "--output", default=None, help="JSON结果文件，省略则输出到标准输出")
+    parser.add_argument("--baseline", default=None, help="与之比较的历史JSON结果")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="比较时允许的变慢比例，超过则视为退化")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    except ValueError:
+        sizes = []
+    if not sizes or min(sizes) < 1 or args.repeat < 1:
+        print("小节数必须为正整数列表，重复次数必须为正整数", file=sys.stderr)
+        return 2
+
+    def progress(message):
+        print(f"正在测量: {message}", file=sys.stderr, flush=True)
+
+    report = run_benchmarks(sizes, args.repeat, args.scale, args.seed, args.jitter_seconds,
+                            tuple(args.only or BENCHMARKS), progress)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for name, bars, old, new in regressions:
+            print(f"性能退化: {name} @ {bars} 小节 {old * 1000:.2f} ms -> {new * 1000:.2f} ms",
+                  file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,323 @@
+import os
+
+import numpy as np
+
+from midi_events import MidiStreamWriter, allocate_channels, serialize_notes
+from music_theory import scale_tables
+from note_table import NO_INSTRUMENT, NoteTable
+
+TICKS_PER_BEAT = 480  # 标准MIDI分辨率
+
+# 各音阶包含的音级
+SCALE_MAP = {
+    "C大调": [0, 2, 4, 5, 7, 9, 11],  # C D E F G A B
+    "A小调": [9, 11, 0, 2, 4, 5, 7],  # A B C D E F G
+    "G大调": [7, 9, 11, 0, 2, 4, 6],  # G A B C D E F#
+    "E小调": [4, 6, 7, 9, 11, 0, 2],  # E F# G A B C D
+    "F大调": [5, 7, 9, 10, 0, 2, 4],  # F G A Bb C D E
+    "D小调": [2, 4, 5, 7, 9, 10, 0],  # D E F G A Bb C
+}
+DEFAULT_SCALE = SCALE_MAP["C大调"]
+
+# 生成模式
+MODE_RACHMANINOFF = "拉赫玛尼诺夫风格"
+MODE_RANDOM = "完全随机"
+MODE_CORPUS = "语料模型"  # 需要先训练或载入 markov_model 模型
+MODES = [MODE_RACHMANINOFF, MODE_RANDOM, MODE_CORPUS]
+
+MELODY_RANGE = (48, 84)  # 主旋律音域：C3 到 C6
+CHORD_RANGE = (36, 72)  # 伴奏和弦音域，超出的和弦音省略
+
+# 乐器设置
+INSTRUMENTS = {
+    "钢琴": 0,
+    "小提琴": 40,
+    "大提琴": 42,
+    "定音鼓": 47,
+    "三角铁": 80,
+    "弦乐合奏": 48
+}
+
+# 拉赫玛尼诺夫第二主题的音符序列（简化版）
+RACHMANINOFF_THEME = [
+    # 第一句
+    {'note': 60, 'duration': 1.0},  # C4
+    {'note': 64, 'duration': 0.5},  # E4
+    {'note': 67, 'duration': 0.5},  # G4
+    {'note': 72, 'duration': 1.0},  # C5
+    {'note': 67, 'duration': 0.5},  # G4
+    {'note': 64, 'duration': 0.5},  # E4
+    # 第二句
+    {'note': 60, 'duration': 1.0},  # C4
+    {'note': 64, 'duration': 0.5},  # E4
+    {'note': 67, 'duration': 0.5},  # G4
+    {'note': 72, 'duration': 1.0},  # C5
+    {'note': 67, 'duration': 0.5},  # G4
+    {'note': 64, 'duration': 0.5},  # E4
+]
+
+
+def get_scale_notes(scale_name):
+    """根据音阶名称返回对应的音符"""
+    return SCALE_MAP.get(scale_name, DEFAULT_SCALE)
+
+
+def get_scale_tables(scale_name):
+    """根据音阶名称返回该音阶的乐理查找表（每种音阶只构建一次）"""
+    return scale_tables(get_scale_notes(scale_name))
+
+
+class CompositionEngine:
+    """不依赖界面的作曲引擎：生成音符并导出MIDI文件"""
+
+    def __init__(self, tempo=120, time_signature=(4, 4), octave_range=(3, 6)):
+        self.tempo = tempo  # BPM
+        self.time_signature = time_signature
+        self.octave_range = octave_range  # 音符范围: C3 到 B6
+        self.instruments = dict(INSTRUMENTS)
+        # 每种乐器使用独立的MIDI通道，合成器可以并行渲染各声部且无需反复切换音色
+        self.channels = allocate_channels(self.instruments.values())
+        self.rachmaninoff_theme = list(RACHMANINOFF_THEME)
+        self.corpus_model = None  # 语料模型（markov_model.MarkovModel）
+
+    def load_corpus_model(self, filename):
+        """载入训练好的语料模型文件"""
+        from markov_model import MarkovModel
+        self.corpus_model = MarkovModel.load(filename)
+        return self.corpus_model
+
+    def generate(self, mode, num_bars, scale_name, rng=None):
+        """按指定模式生成音符，rng 为 numpy.random.Generator（用于可复现的生成）"""
+        if rng is None:
+            rng = np.random.default_rng()
+        if mode == MODE_RACHMANINOFF:
+            return self.generate_rachmaninoff_style(num_bars, scale_name, rng)
+        if mode == MODE_CORPUS:
+            return self._corpus_block(0, num_bars, scale_name, rng)
+        return self.generate_random(num_bars, scale_name, rng)
+
+    def generate_rachmaninoff_style(self, num_bars, scale_name, rng):
+        """生成拉赫玛尼诺夫风格的旋律，包括打击乐器和弦乐伴奏
+
+        所有变奏的随机量一次性批量抽取，开始时间由时值累加得到。
+        """
+        num_variations = num_bars // 2  # 每两小节一个变奏
+        notes, _ = self._rachmaninoff_block(num_variations, scale_name, rng, 0)
+        return notes
+
+    def _rachmaninoff_block(self, num_variations, scale_name, rng, start_tick):
+        """从 start_tick 开始批量生成若干个变奏，返回 (音符表, 结束tick)"""
+        ticks_per_beat = TICKS_PER_BEAT
+        theme = self.rachmaninoff_theme
+        theme_notes = np.array([n['note'] for n in theme])
+        theme_durations = np.array([n['duration'] for n in theme])
+        shape = (num_variations, len(theme))
+        if num_variations == 0:
+            return NoteTable(), start_tick
+
+        # 相对于C大调的偏移（音阶的根音）
+        tables = get_scale_tables(scale_name)
+        scale_offset = tables.pitch_classes[0]
+
+        # 一次性抽取所有随机量
+        note_offsets = rng.integers(-2, 3, shape)  # 随机音高变化
+        duration_factors = rng.uniform(0.8, 1.2, shape)  # 随机节奏变化
+        melody_velocity = rng.integers(70, 101, shape)  # 随机力度
+        chord_mask = rng.random(shape) < 0.7  # 70%的概率添加和弦
+        chord_velocity = rng.integers(50, 71, shape + (3,))  # 较弱的力度
+        timpani_velocity = rng.integers(60, 81, shape)
+        triangle_velocity = rng.integers(40, 61, shape)
+        grace_mask = rng.random(num_variations) < 0.3  # 30%的概率添加装饰音
+        grace_step = rng.choice([-1, 1], num_variations)  # 上或下方相邻音阶音的装饰音
+
+        # 主旋律（钢琴）：移到所选音阶的主音上，对齐到C3到C6之间的音阶音
+        melody = np.take(tables.clamp(*MELODY_RANGE), theme_notes + scale_offset + note_offsets, mode='clip').ravel()
+        durations = (theme_durations * duration_factors * ticks_per_beat).astype(np.int64).ravel()
+        ends = start_tick + np.cumsum(durations)
+        starts = ends - durations
+
+        # 弦乐伴奏（和弦）：以旋律音为五音的音阶内三和弦（低八度、根音、三音），并确保在合理范围内
+        chords = np.take(tables.voicing, melody, axis=0)
+        chord_keep = chord_mask.ravel()[:, None] & (chords >= CHORD_RANGE[0]) & (chords <= CHORD_RANGE[1])
+        chord_rows = np.nonzero(chord_keep)[0]
+
+        # 打击乐器：每两拍添加一次定音鼓和三角铁
+        on_beat = np.flatnonzero(starts % (ticks_per_beat * 2) == 0)
+
+        # 装饰音：紧贴每个变奏结尾
+        variation_ends = ends[len(theme) - 1::len(theme)]
+        grace = np.flatnonzero(grace_mask)
+        grace_note = tables.transpose(melody[len(theme) - 1::len(theme)][grace], grace_step[grace])
+
+        piano = self.instruments["钢琴"]
+        strings = self.instruments["弦乐合奏"]
+        timpani = self.instruments["定音鼓"]
+        triangle = self.instruments["三角铁"]
+        parts = [
+            (melody, melody_velocity.ravel(), starts, ends, piano),
+            (chords[chord_keep], chord_velocity.reshape(-1, 3)[chord_keep],
+             starts[chord_rows], ends[chord_rows], strings),
+            (np.full(on_beat.size, 36), timpani_velocity.ravel()[on_beat],  # C2
+             starts[on_beat], starts[on_beat] + int(0.5 * ticks_per_beat), timpani),
+            (np.full(on_beat.size, 76), triangle_velocity.ravel()[on_beat],  # E5
+             starts[on_beat], starts[on_beat] + int(0.1 * ticks_per_beat), triangle),
+            (grace_note, np.full(grace.size, 80), variation_ends[grace] - int(0.1 * ticks_per_beat),
+             variation_ends[grace], piano),
+        ]
+        notes = self._notes_from_parts(parts)
+        return notes, int(ends[-1])
+
+    def generate_random(self, num_bars, scale_name, rng):
+        """完全随机地生成旋律（所有小节的随机量一次性批量抽取）"""
+        return self._random_block(0, num_bars, scale_name, rng)
+
+    def _random_block(self, first_bar, num_bars, scale_name, rng):
+        """批量生成从 first_bar 开始的 num_bars 个小节的随机旋律"""
+        beats_per_bar = self.time_signature[0]
+        ticks_per_beat = TICKS_PER_BEAT
+        shape = (num_bars * beats_per_bar,)
+
+        # 获取当前选择的音阶
+        scale = get_scale_tables(scale_name).pitch_classes
+
+        has_note = rng.random(shape) > 0.2  # 80%几率有音符
+        scale_note = rng.choice(scale, shape)  # 随机选择音阶中的音符
+        octave = rng.integers(self.octave_range[0], self.octave_range[1] + 1, shape)  # 随机八度
+        # 音符长度 (1/4, 1/2, 1 拍)
+        duration = rng.choice(np.array([0.25, 0.5, 1.0]) * ticks_per_beat, shape).astype(np.int64)
+        velocity = rng.integers(60, 101, shape)  # 音符力度 (音量)
+
+        beats = np.flatnonzero(has_note)
+        start = (first_bar * beats_per_bar + beats) * ticks_per_beat
+        # 计算MIDI音符值 (C3 = 60)
+        note = 60 + scale_note[beats] + (octave[beats] - 3) * 12
+        return NoteTable.from_columns(note=note, velocity=velocity[beats], start=start,
+                                      end=start + duration[beats])
+
+    def _corpus_block(self, first_bar, num_bars, scale_name, rng):
+        """用语料模型批量采样从 first_bar 开始的 num_bars 个小节的旋律（钢琴）"""
+        if self.corpus_model is None:
+            raise ValueError("尚未训练或载入语料模型")
+        beats_per_bar = self.time_signature[0]
+        tables = get_scale_tables(scale_name)
+        note, start, end = self.corpus_model.sample(num_bars, beats_per_bar, tables.clamp(*MELODY_RANGE), rng,
+                                                    TICKS_PER_BEAT, tonic=60 + tables.pitch_classes[0])
+        offset = first_bar * beats_per_bar * TICKS_PER_BEAT
+        velocity = rng.integers(70, 101, note.size)
+        return self._notes_from_parts([(note, velocity, start + offset, end + offset, self.instruments["钢琴"])])
+
+    def _bar_block(self, mode, first_bar, num_bars, scale_name, rng):
+        """按小节生成的模式（完全随机、语料模型）共用的分块入口"""
+        if mode == MODE_CORPUS:
+            return self._corpus_block(first_bar, num_bars, scale_name, rng)
+        return self._random_block(first_bar, num_bars, scale_name, rng)
+
+    def iter_chunks(self, mode, scale_name, rng, num_bars=None, chunk_bars=16):
+        """按小节分块生成乐曲，逐块产出 (音符表, 边界tick)
+
+        之后分块中的音符开始时间都不早于边界tick；num_bars 为 None 时无限生成。
+        """
+        ticks_per_bar = TICKS_PER_BEAT * self.time_signature[0]
+        done = 0
+        tick = 0
+        while num_bars is None or done < num_bars:
+            bars = chunk_bars if num_bars is None else min(chunk_bars, num_bars - done)
+            if mode == MODE_RACHMANINOFF:
+                # 每两小节一个变奏，分块按变奏对齐
+                variations = max(1, bars // 2) if num_bars is None else (done + bars) // 2 - done // 2
+                notes, tick = self._rachmaninoff_block(variations, scale_name, rng, tick)
+            else:
+                notes = self._bar_block(mode, done, bars, scale_name, rng)
+                tick = (done + bars) * ticks_per_bar
+            done += bars
+            yield notes, tick
+
+    def generate_segment(self, mode, scale_name, rng, start_tick, num_bars=1):
+        """从 start_tick 起生成一小段，返回 (音符表, 结束tick)
+
+        按小节生成的模式从 start_tick 之后的第一条小节线开始；拉赫玛尼诺夫风格每两小节一个变奏，至少一个。
+        """
+        if mode == MODE_RACHMANINOFF:
+            return self._rachmaninoff_block(max(1, num_bars // 2), scale_name, rng, start_tick)
+        ticks_per_bar = TICKS_PER_BEAT * self.time_signature[0]
+        first_bar = -(-start_tick // ticks_per_bar)
+        notes = self._bar_block(mode, first_bar, num_bars, scale_name, rng)
+        return notes, (first_bar + num_bars) * ticks_per_bar
+
+    def set_lead_instrument(self, notes, name):
+        """把主旋律（未指定音色或钢琴的音符）改由指定乐器演奏"""
+        program = self.instruments[name]
+        instrument = notes.instrument
+        lead = (instrument == NO_INSTRUMENT) | (instrument == self.instruments["钢琴"])
+        notes.set_column('instrument', np.where(lead, program, instrument))
+        notes.set_column('channel', np.where(lead, self.channels[program], notes.channel))
+
+    def stream_to_file(self, filename, mode, num_bars, scale_name, rng, chunk_bars=16, tempo=None,
+                       progress=None):
+        """分块生成并增量写出MIDI文件，内存占用只与分块大小有关，返回音符数
+
+        progress 为可选回调 progress(已完成比例)，每写完一块调用一次；它抛出的异常会中止写出。
+        中止或出错时删除写了一半的文件。
+        """
+        if tempo is None:
+            tempo = self.tempo
+        total_ticks = num_bars * TICKS_PER_BEAT * self.time_signature[0]
+        count = 0
+        writer = MidiStreamWriter(filename, tempo, self.time_signature, TICKS_PER_BEAT)
+        try:
+            with writer:
+                for notes, frontier in self.iter_chunks(mode, scale_name, rng, num_bars, chunk_bars):
+                    writer.write_chunk(notes, frontier)
+                    count += len(notes)
+                    if progress is not None:
+                        progress(min(1.0, frontier / total_ticks))
+        except BaseException:
+            # 关闭时已回填音轨长度，留下的残缺文件看起来是有效的MIDI文件
+            os.remove(filename)
+            raise
+        return count
+
+    def _notes_from_parts(self, parts):
+        """把 (音高, 力度, 开始, 结束, 音色) 各声部合并为一张音符表并分配通道"""
+        columns = {name: [] for name in ('note', 'velocity', 'start', 'end', 'instrument', 'channel')}
+        for note, velocity, start, end, program in parts:
+            count = len(start)
+            columns['note'].append(note)
+            columns['velocity'].append(velocity)
+            columns['start'].append(start)
+            columns['end'].append(end)
+            columns['instrument'].append(np.full(count, program))
+            columns['channel'].append(np.full(count, self.channels[program]))
+        return NoteTable.from_columns(**{name: np.concatenate(values) for name, values in columns.items()})
+
+    def create_midi_file(self, notes, tempo=None, multitrack=False):
+        """从音符表创建MIDI文件（合并排序的开/关事件流，批量写出字节）
+
+        multitrack 为真时写出每种乐器一轨的类型1文件。
+        """
+        if tempo is None:
+            tempo = self.tempo
+        track_names = {program: name for name, program in self.instruments.items()}
+        return serialize_notes(notes, tempo, self.time_signature, TICKS_PER_BEAT,
+                               multitrack, track_names)
+
+    def render_to_file(self, filename, mode, num_bars, scale_name, seed=None, multitrack=False,
+                       chunk_bars=None, wav_filename=None, sample_rate=None):
+        """生成一首乐曲并直接保存为MIDI文件，返回音符数
+
+        指定 chunk_bars 时按分块流式生成和写出（不支持分轨和音频）；
+        指定 wav_filename 时同时渲染一份WAV音频预览（sample_rate 省略时使用默认采样率）。
+        """
+        rng = np.random.default_rng(seed)
+        if chunk_bars:
+            return self.stream_to_file(filename, mode, num_bars, scale_name, rng, chunk_bars)
+        notes = self.generate(mode, num_bars, scale_name, rng)
+        self.save_notes(filename, notes, multitrack, wav_filename, sample_rate)
+        return len(notes)
+
+    def save_notes(self, filename, notes, multitrack=False, wav_filename=None, sample_rate=None):
+        """把已生成的音符表保存为MIDI文件，指定 wav_filename 时同时渲染WAV音频预览"""
+        self.create_midi_file(notes, multitrack=multitrack).save(filename)
+        if wav_filename:
+            from audio_render import SAMPLE_RATE, render_wav  # 只有需要音频时才加载合成器
+            render_wav(wav_filename, notes, self.tempo, TICKS_PER_BEAT, sample_rate or SAMPLE_RATE)
@@ -0,0 +1,252 @@
+"""语料去重索引：为音符表计算指纹并存入SQLite，批量生成时跳过重复乐曲，也可查找相似的乐曲
+
+    python corpus_index.py corpus.sqlite add corpus/          # 索引目录中的MIDI文件（跳过重复）
+    python corpus_index.py corpus.sqlite similar piece.mid    # 列出相似的乐曲
+
+每首乐曲有三种指纹：
+- exact：全部音符（音高、力度、时间、音色、通道）的哈希，内容完全相同时相等；
+- shape：旋律轮廓的哈希，由相邻音符的音程和起音间隔比例构成，与移调和整体快慢无关；
+- minhash：轮廓片段集合的MinHash签名，按LSH分段建索引，用于估计相似度和快速查找相似乐曲。
+"""
+import argparse
+import hashlib
+import os
+import sqlite3
+import sys
+from collections import Counter, namedtuple
+
+import numpy as np
+
+from markov_model import find_midi_files
+from midi_import import MidiImportError, load_midi
+from note_table import COLUMN_NAMES
+
+TICKS_PER_BEAT = 480
+MAX_INTERVAL = 36  # 轮廓中的音程按三个八度截断
+RHYTHM_LEVELS = 19  # 起音间隔比例的量化级数（0 表示与前一音同时）
+SHINGLE = 4  # 每个轮廓片段包含的符号数
+NUM_HASHES = 64
+BANDS = 16  # LSH分段数（每段 NUM_HASHES // BANDS 个哈希），相似度约0.5以上的乐曲大概率成为候选
+ROWS = NUM_HASHES // BANDS
+EMPTY_HASH = np.iinfo(np.uint32).max
+DEDUP_KEYS = ('exact', 'shape')
+MAX_CANDIDATES = 1000  # 相似查询最多比较的候选数（按相同分段数优先）
+QUERY_BATCH = 500  # 每条 IN (...) 查询的参数个数，低于SQLite的参数上限
+
+# MinHash 使用的乘移哈希参数（固定种子，不同进程和不同次运行得到相同的签名）
+_HASH_RNG = np.random.default_rng(0x5EED)
+_HASH_A = _HASH_RNG.integers(0, 2 ** 63, NUM_HASHES, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+_HASH_B = _HASH_RNG.integers(0, 2 ** 63, NUM_HASHES, dtype=np.uint64)
+_FNV_PRIME = np.uint64(0x100000001B3)
+
+# 乐曲指纹：exact、shape 为64位整数，minhash 为 NUM_HASHES 个 uint32
+Fingerprint = namedtuple('Fingerprint', 'exact shape minhash')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pieces (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    exact INTEGER NOT NULL,
+    shape INTEGER NOT NULL,
+    notes INTEGER NOT NULL,
+    minhash BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pieces_exact ON pieces(exact);
+CREATE INDEX IF NOT EXISTS pieces_shape ON pieces(shape);
+CREATE TABLE IF NOT EXISTS bands (
+    key INTEGER NOT NULL,
+    piece INTEGER NOT NULL,
+    PRIMARY KEY (key, piece)
+) WITHOUT ROWID;
+"""
+
+
+def _hash64(*buffers):
+    """若干字节串的64位哈希（有符号，便于存入SQLite）"""
+    digest = hashlib.blake2b(digest_size=8)
+    for buffer in buffers:
+        digest.update(buffer)
+    return int.from_bytes(digest.digest(), 'little', signed=True)
+
+
+def contour(notes):
+    """旋律轮廓符号序列：按 (开始, 音高) 排序后，每个音符记为 与前一音的音程 × 起音间隔相对典型间隔的比例
+
+    间隔比例按对数每半个八度量化，整体加快或放慢、移调后的乐曲得到相同的序列。
+    """
+    if len(notes) < 2:
+        return np.empty(0, dtype=np.int64)
+    start = notes.start
+    pitch = notes.note.astype(np.int64)
+    order = np.lexsort((pitch, start))
+    start, pitch = start[order], pitch[order]
+    interval = np.clip(np.diff(pitch), -MAX_INTERVAL, MAX_INTERVAL) + MAX_INTERVAL
+    gap = np.diff(start)
+    rhythm = np.zeros(gap.size, dtype=np.int64)
+    moving = gap > 0
+    if moving.any():
+        ratio = np.log2(gap[moving] / np.median(gap[moving]))
+        rhythm[moving] = np.clip(np.round(ratio * 2).astype(np.int64) + RHYTHM_LEVELS // 2 + 1, 1, RHYTHM_LEVELS - 1)
+    return interval * RHYTHM_LEVELS + rhythm
+
+
+def minhash(tokens):
+    """轮廓片段（每 SHINGLE 个相邻符号）集合的MinHash签名"""
+    if tokens.size == 0:
+        return np.full(NUM_HASHES, EMPTY_HASH, dtype=np.uint32)
+    base = (2 * MAX_INTERVAL + 1) * RHYTHM_LEVELS
+    count = max(tokens.size - SHINGLE + 1, 1)
+    codes = tokens[:count].astype(np.uint64)
+    for j in range(1, min(SHINGLE, tokens.size)):
+        codes = codes * np.uint64(base) + tokens[j:j + count].astype(np.uint64)
+    codes = np.unique(codes)
+    hashed = np.multiply.outer(_HASH_A, codes) + _HASH_B[:, None]  # 按 2^64 回绕
+    return (hashed.min(axis=1) >> np.uint64(32)).astype(np.uint32)
+
+
+def band_keys(signature):
+    """MinHash签名各分段的LSH键（段号参与哈希，不同段的键互不相同）"""
+    rows = signature.reshape(BANDS, ROWS).astype(np.uint64)
+    key = np.arange(BANDS, dtype=np.uint64)
+    for j in range(ROWS):
+        key = (key ^ rows[:, j]) * _FNV_PRIME
+    return key.view(np.int64)
+
+
+def fingerprint(notes):
+    """计算音符表的指纹"""
+    tokens = contour(notes)
+    exact = _hash64(*(np.ascontiguousarray(notes.column(name)).tobytes() for name in COLUMN_NAMES))
+    return Fingerprint(exact, _hash64(tokens.astype('<i4').tobytes()), minhash(tokens))
+
+
+class CorpusIndex:
+    """保存在SQLite文件中的指纹索引（WAL模式，多个进程可以同时读写）"""
+
+    def __init__(self, filename, timeout=60.0):
+        self.filename = filename
+        self.db = sqlite3.connect(filename, timeout=timeout, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(_SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM pieces").fetchone()[0]
+
+    def contains(self, fp, key='exact'):
+        """是否已有 key（exact 或 shape）指纹相同的乐曲（索引查找）"""
+        return self._find(fp, key) is not None
+
+    def _find(self, fp, key):
+        if key not in DEDUP_KEYS:
+            raise ValueError(f"未知的去重方式: {key}")
+        row = self.db.execute(f"SELECT name FROM pieces WHERE {key} = ? LIMIT 1", (getattr(fp, key),)).fetchone()
+        return row[0] if row else None
+
+    def add(self, fp, name, notes=0, key='exact'):
+        """若尚无 key 指纹相同的乐曲则加入索引并返回 True，否则返回 False
+
+        查重和写入在同一个写事务中完成，多个进程并发加入同一首乐曲时只有一个成功。
+        """
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            if self._find(fp, key) is not None:
+                self.db.execute("ROLLBACK")
+                return False
+            cursor = self.db.execute("INSERT INTO pieces (name, exact, shape, notes, minhash) VALUES (?, ?, ?, ?, ?)",
+                                     (name, fp.exact, fp.shape, notes, fp.minhash.astype('<u4').tobytes()))
+            self.db.executemany("INSERT OR IGNORE INTO bands (key, piece) VALUES (?, ?)",
+                                ((band, cursor.lastrowid) for band in band_keys(fp.minhash).tolist()))
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        return True
+
+    def similar(self, fp, limit=10, min_similarity=0.5):
+        """查找相似的乐曲，返回按估计相似度（轮廓片段集合的Jaccard系数）降序的 [(名称, 相似度)]
+
+        只比较至少有一个LSH分段相同的候选（最多 MAX_CANDIDATES 个），与索引大小基本无关。
+        """
+        keys = band_keys(fp.minhash).tolist()
+        hits = Counter(piece for piece, in self.db.execute(
+            f"SELECT piece FROM bands WHERE key IN ({','.join('?' * len(keys))})", keys))
+        if not hits:
+            return []
+        ids = [piece for piece, _ in hits.most_common(MAX_CANDIDATES)]
+        names, signatures = [], []
+        for i in range(0, len(ids), QUERY_BATCH):
+            batch = ids[i:i + QUERY_BATCH]
+            for name, blob in self.db.execute(
+                    f"SELECT name, minhash FROM pieces WHERE id IN ({','.join('?' * len(batch))})", batch):
+                names.append(name)
+                signatures.append(np.frombuffer(blob, dtype='<u4'))
+        similarity = (np.array(signatures) == fp.minhash).mean(axis=1)
+        order = np.argsort(-similarity, kind='stable')[:limit]
+        return [(names[i], float(similarity[i])) for i in order if similarity[i] >= min_similarity]
+
+
+def build_parser():
+    """创建命令行参数解析器"""
+    parser = argparse.ArgumentParser(description="MIDI语料去重索引")
+    parser.add_argument("index", help="索引文件（SQLite）")
+    commands = parser.add_subparsers(dest="command", required=True)
+    add = commands.add_parser("add", help="索引MIDI文件，跳过重复的乐曲")
+    add.add_argument("paths", nargs="+", help="MIDI文件或目录（递归查找）")
+    add.add_argument("--dedup", default="exact", choices=DEDUP_KEYS,
+                     help="exact：内容完全相同才算重复；shape：移调或整体快慢不同也算重复")
+    similar = commands.add_parser("similar", help="查找与MIDI文件相似的乐曲")
+    similar.add_argument("file", help="MIDI文件")
+    similar.add_argument("-n", "--limit", type=int, default=10, help="最多列出的数量")
+    similar.add_argument("--min-similarity", type=float, default=0.5, help="最低相似度（0~1）")
+    return parser
+
+
+def _iter_midi_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            yield from find_midi_files(path)
+        else:
+            yield path
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    with CorpusIndex(args.index) as index:
+        if args.command == "similar":
+            try:
+                notes = load_midi(args.file, TICKS_PER_BEAT).notes
+            except (OSError, MidiImportError) as e:
+                print(f"无法读取 {args.file}: {e}", file=sys.stderr)
+                return 2
+            for name, similarity in index.similar(fingerprint(notes), args.limit, args.min_similarity):
+                print(f"{similarity:.2f}\t{name}")
+            return 0
+
+        added = duplicates = failed = 0
+        for path in _iter_midi_files(args.paths):
+            try:
+                notes = load_midi(path, TICKS_PER_BEAT).notes
+            except (OSError, MidiImportError):
+                failed += 1
+                continue
+            if index.add(fingerprint(notes), path, len(notes), args.dedup):
+                added += 1
+            else:
+                duplicates += 1
+        print(f"新增 {added} 首，重复 {duplicates} 首，无法读取 {failed} 个文件；索引中共 {len(index)} 首",
+              file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
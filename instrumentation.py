@@ -0,0 +1,180 @@
+"""性能监测：把耗时、延迟等样本按名称记录到定长环形缓冲区，可在界面上显示或导出为JSON
+
+关闭时 metric() 返回 None、timer() 返回共享的空计时器，热点路径上只剩一次判断。
+"""
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+
+import numpy as np
+
+SAMPLE_CAPACITY = 4096  # 每个指标保留的最近样本数
+# 直方图分桶：0 以及 1 微秒到 10 秒之间按对数均分（单位与样本相同，耗时类为秒）
+HISTOGRAM_EDGES = np.concatenate([[0.0], np.logspace(-6, 1, 29)])
+
+# 指标名称
+LATENESS = "播放延迟"  # 每组事件实际发送时刻晚于目标时刻的秒数
+SEND = "发送耗时"  # 每组事件调用 send_message 的总耗时
+DRAW = "绘制耗时"  # 每次 draw_notes 的耗时
+TK_LAG = "Tk滞后"  # 界面线程定时回调比预期晚的秒数
+TK_QUEUE = "Tk队列"  # 界面线程中待执行的 after 回调数
+GENERATE = "生成耗时"
+EXPORT = "导出耗时"
+# 计数器名称
+MESSAGES = "已发送消息"
+
+# 指标摘要：样本总数、最近样本的平均值/中位数/99分位/最大值、最后一个样本
+MetricSummary = namedtuple('MetricSummary', 'count mean p50 p99 max last')
+
+
+class Metric:
+    """一个指标最近的样本（连同记录时刻）保存在环形缓冲区中"""
+
+    def __init__(self, capacity=SAMPLE_CAPACITY, clock=time.perf_counter):
+        self.values = np.zeros(capacity)
+        self.times = np.zeros(capacity)
+        self.count = 0
+        self._capacity = capacity
+        self._clock = clock
+
+    def add(self, value):
+        index = self.count % self._capacity
+        self.values[index] = value
+        self.times[index] = self._clock()
+        self.count += 1
+
+    def recent(self):
+        """按时间顺序返回最近的 (记录时刻, 样本)"""
+        count = min(self.count, self._capacity)
+        order = (np.arange(count) + self.count - count) % self._capacity
+        return self.times[order], self.values[order]
+
+    def summary(self):
+        count = min(self.count, self._capacity)
+        if count == 0:
+            return MetricSummary(0, 0.0, 0.0, 0.0, 0.0, 0.0)
+        values = self.values[:count]
+        p50, p99 = np.percentile(values, (50, 99)).tolist()
+        last = self.values[(self.count - 1) % self._capacity]
+        return MetricSummary(self.count, float(values.mean()), p50, p99, float(values.max()), float(last))
+
+    def histogram(self):
+        counts, _ = np.histogram(self.values[:min(self.count, self._capacity)], HISTOGRAM_EDGES)
+        return counts
+
+
+class _Timer:
+    """把 with 代码块的耗时记入指标"""
+
+    __slots__ = ('metric', 'clock', 'started')
+
+    def __init__(self, metric, clock):
+        self.metric = metric
+        self.clock = clock
+
+    def __enter__(self):
+        self.started = self.clock()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metric.add(self.clock() - self.started)
+        return False
+
+
+class _NullTimer:
+    """关闭监测时使用的空计时器"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Instruments:
+    """按名称管理指标和计数器；enabled 为假时不记录任何数据"""
+
+    def __init__(self, enabled=False, capacity=SAMPLE_CAPACITY, clock=time.perf_counter):
+        self.enabled = enabled
+        self.capacity = capacity
+        self.clock = clock
+        self.metrics = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def metric(self, name):
+        """取得指标（不存在时创建）；关闭时返回 None"""
+        if not self.enabled:
+            return None
+        metric = self.metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self.metrics.setdefault(name, Metric(self.capacity, self.clock))
+        return metric
+
+    def timer(self, name):
+        """用于 with 语句的计时器"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self.metric(name), self.clock)
+
+    def record(self, name, value):
+        if self.enabled:
+            self.metric(name).add(value)
+
+    def increment(self, name, amount=1):
+        if self.enabled:
+            with self._lock:
+                self.counters[name] = self.counters.get(name, 0) + amount
+
+    def reset(self):
+        with self._lock:
+            self.metrics = {}
+            self.counters = {}
+
+    def summaries(self):
+        return {name: metric.summary() for name, metric in list(self.metrics.items())}
+
+    def hud_text(self, names):
+        """状态栏上的一行摘要：耗时类显示99分位（毫秒），Tk队列显示当前长度"""
+        parts = []
+        for name in names:
+            metric = self.metrics.get(name)
+            if metric is None or metric.count == 0:
+                continue
+            summary = metric.summary()
+            if name == TK_QUEUE:
+                parts.append(f"{name} {summary.last:.0f}")
+            else:
+                parts.append(f"{name} {summary.p99 * 1000:.2f}ms")
+        return " | ".join(parts)
+
+    def dump(self, filename):
+        """把全部指标的摘要、直方图和最近样本写成JSON文件"""
+        metrics = {}
+        for name, metric in list(self.metrics.items()):
+            times, values = metric.recent()
+            metrics[name] = {
+                'summary': metric.summary()._asdict(),
+                'histogram': {'edges': HISTOGRAM_EDGES.tolist(), 'counts': metric.histogram().tolist()},
+                'recent': {'time': times.tolist(), 'value': values.tolist()},
+            }
+        report = {
+            'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'counters': dict(self.counters),
+            'metrics': metrics,
+        }
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+# 进程内共享的实例；设置环境变量 MIDI_COMPOSER_INSTRUMENTS=1 时启动即开启
+instruments = Instruments(enabled=os.environ.get("MIDI_COMPOSER_INSTRUMENTS") == "1")
@@ -0,0 +1,106 @@
+"""实时生成演奏：生产线程按段生成音乐，经有界队列交给播放调度器"""
+import queue
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+from composer_engine import TICKS_PER_BEAT
+from midi_events import ChunkedEventStream
+from performance import compile_events
+from streaming import End, put_until_stopped
+
+# 实时演奏参数：速度、生成模式、音阶、主旋律乐器
+LiveSettings = namedtuple('LiveSettings', 'tempo mode scale instrument')
+
+
+class LiveGenerator:
+    """一段一段地（随机模式每段一小节，拉赫玛尼诺夫风格每段一个变奏）生成并编译演奏缓冲区
+
+    生产线程只在播放时钟接近下一段开头（提前 lookahead 秒）时才生成该段，
+    因此参数修改会在下一条小节线（段边界）生效；队列最多缓存 depth 段，
+    延迟与内存占用都保持恒定。
+    """
+
+    def __init__(self, engine, settings, scheduler, lookahead=0.25, depth=2, rng=None):
+        self.engine = engine
+        self.scheduler = scheduler
+        self.lookahead = lookahead
+        self._settings = settings
+        self._lock = threading.Lock()
+        self._rng = np.random.default_rng() if rng is None else rng
+        self._queue = queue.Queue(maxsize=max(1, depth))
+        self._stop = threading.Event()
+        self._thread = None
+        self.segments = 0  # 已生成的段数
+
+    @property
+    def settings(self):
+        with self._lock:
+            return self._settings
+
+    def update(self, **changes):
+        """修改演奏参数（可在任意线程调用），从下一段开始生效"""
+        with self._lock:
+            self._settings = self._settings._replace(**changes)
+
+    def start(self):
+        """启动生产线程"""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._produce, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止生产线程并丢弃尚未播放的段"""
+        self._stop.set()
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+    def _wait_for(self, start_time):
+        """等到播放时钟距该段开头不足 lookahead 秒，返回是否未被停止"""
+        while not self._stop.is_set():
+            remaining = start_time - self.lookahead - self.scheduler.elapsed()
+            if remaining <= 0:
+                return True
+            self._stop.wait(min(remaining, 0.05))
+        return False
+
+    def _put(self, item):
+        return put_until_stopped(self._queue, item, self._stop)
+
+    def _produce(self):
+        try:
+            self._generate()
+        except BaseException as error:  # 交给播放线程处理
+            self._put(End(error))
+
+    def _generate(self):
+        events = ChunkedEventStream()
+        tick = 0
+        seconds = 0.0
+        while self._wait_for(seconds):
+            settings = self.settings
+            notes, end_tick = self.engine.generate_segment(settings.mode, settings.scale, self._rng, tick)
+            self.engine.set_lead_instrument(notes, settings.instrument)
+            # 本段按当前速度换算时间；跨段的音符结束事件按下一段的速度换算
+            performance = compile_events(events.feed(notes, end_tick), settings.tempo, TICKS_PER_BEAT,
+                                         tick, seconds)
+            seconds += (end_tick - tick) * 60.0 / (settings.tempo * TICKS_PER_BEAT)
+            tick = end_tick
+            self.segments += 1
+            if not self._put(performance):
+                return
+
+    def __iter__(self):
+        """依次取出编译好的段（供播放线程使用），停止后结束；生成时出错则在此重新抛出"""
+        while not self._stop.is_set():
+            try:
+                item = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if isinstance(item, End):
+                raise item.error
+            yield item
@@ -0,0 +1,352 @@
+"""语料训练的N元（马尔可夫）旋律模型：从MIDI文件目录统计音程与节奏的转移，成批采样整小节旋律
+
+    python markov_model.py 语料目录 -o model.npz --order 3 -j 0
+
+每个旋律音记为一个符号：进入该音的音程（-12..12半音）× 到下一个音的间隔（1..16个十六分音符）。
+一阶转移用稠密计数矩阵，更高阶的上下文按键排序后以CSR形式稀疏存放；采样时从最高阶逐级回退。
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+import zipfile
+from collections import namedtuple
+
+import numpy as np
+
+from midi_import import MidiImportError, load_midi
+
+MODEL_VERSION = 1
+MAX_INTERVAL = 12  # 更大的跳进按八度截断
+INTERVAL_COUNT = 2 * MAX_INTERVAL + 1
+STEPS_PER_BEAT = 4  # 节奏单位：十六分音符
+MAX_STEPS = 16  # 最长间隔（4拍），更长的休止按此截断
+VOCABULARY = INTERVAL_COUNT * MAX_STEPS
+MAX_ORDER = 6  # 上下文编码须放得进 int64
+DRUM_CHANNEL = 9
+PHRASE_BARS = 4  # 采样时每个乐句的小节数，各乐句并行推进
+MIDI_EXTENSIONS = ('.mid', '.midi')
+FILES_PER_CHUNK = 16  # 每个训练任务处理的文件数
+MERGE_ENTRIES = 1 << 22  # 待合并的计数超过此数时先合并一次，限制内存
+
+# 采样用的一阶表：keys 为有序的上下文编码（为 None 时行号即上一个符号），offsets 为各行在 symbols/cum 中的范围，
+# cum 为带前导0的全局累计计数（采样时在其中二分查找）
+_Level = namedtuple('_Level', 'keys offsets symbols cum')
+
+
+class ModelFormatError(ValueError):
+    """文件不是有效的模型文件"""
+
+
+def find_midi_files(directory):
+    """递归列出目录中的MIDI文件（按路径排序，训练结果与遍历顺序无关）"""
+    found = []
+    for root, _, files in os.walk(directory):
+        found.extend(os.path.join(root, name) for name in files if name.lower().endswith(MIDI_EXTENSIONS))
+    return sorted(found)
+
+
+def melody_tokens(notes, ticks_per_beat):
+    """从音符表提取主旋律（每个十六分音符格上取最高音，跳过打击乐通道）并编码为符号序列"""
+    keep = notes.channel != DRUM_CHANNEL
+    step = ticks_per_beat // STEPS_PER_BEAT
+    onset = (notes.start[keep] + step // 2) // step
+    pitch = notes.note[keep].astype(np.int64)
+    order = np.lexsort((-pitch, onset))
+    onset, pitch = onset[order], pitch[order]
+    first = np.ones(onset.size, dtype=bool)
+    first[1:] = onset[1:] != onset[:-1]
+    onset, pitch = onset[first], pitch[first]
+    if onset.size < 3:
+        return np.empty(0, dtype=np.int64)
+    interval = np.clip(np.diff(pitch), -MAX_INTERVAL, MAX_INTERVAL)
+    steps = np.clip(np.diff(onset), 1, MAX_STEPS)
+    # 第 i 个符号对应第 i+1 个音：进入它的音程和它之后的间隔
+    return (interval[:-1] + MAX_INTERVAL) * MAX_STEPS + (steps[1:] - 1)
+
+
+def count_ngrams(tokens, order):
+    """统计各阶（上下文长度 0..order）的N元组，返回 [(编码, 次数)]
+
+    编码为上下文和下一个符号按 VOCABULARY 进制拼成的整数。
+    """
+    counts = []
+    for k in range(order + 1):
+        if tokens.size <= k:
+            counts.append((np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)))
+            continue
+        code = tokens[:tokens.size - k].astype(np.int64)
+        for j in range(1, k + 1):
+            code = code * VOCABULARY + tokens[j:tokens.size - k + j]
+        counts.append(np.unique(code, return_counts=True))
+    return counts
+
+
+def _merge(parts):
+    """合并若干 (编码, 次数) 为一组（编码唯一且有序）"""
+    if not parts:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    codes = np.concatenate([code for code, _ in parts])
+    unique, inverse = np.unique(codes, return_inverse=True)
+    totals = np.bincount(inverse, weights=np.concatenate([count for _, count in parts]), minlength=unique.size)
+    return unique, totals.astype(np.int64)
+
+
+def _count_files(job):
+    """统计一组文件（在工作进程中执行），返回 (各阶计数, 成功读取的文件数, 符号数, 处理的文件数)
+
+    无法读取的文件直接跳过。
+    """
+    paths, order, ticks_per_beat = job
+    parts = [[] for _ in range(order + 1)]
+    files = tokens_seen = 0
+    for path in paths:
+        try:
+            imported = load_midi(path, ticks_per_beat)
+        except (OSError, MidiImportError):
+            continue
+        tokens = melody_tokens(imported.notes, ticks_per_beat)
+        files += 1
+        tokens_seen += tokens.size
+        for k, counted in enumerate(count_ngrams(tokens, order)):
+            parts[k].append(counted)
+    return [_merge(part) for part in parts], files, tokens_seen, len(paths)
+
+
+def train_model(paths, order=3, workers=None, min_count=1, ticks_per_beat=480, progress=None):
+    """从MIDI文件训练模型；order 为最长上下文的符号数，高阶（二阶及以上）出现少于 min_count 次的转移被剪掉
+
+    文件分组后由进程池并行统计；progress 为可选回调 progress(已处理文件数, 总数, 已用秒数)，
+    它抛出的异常会中止训练。
+    """
+    if not 1 <= order <= MAX_ORDER:
+        raise ValueError(f"阶数必须在 1 到 {MAX_ORDER} 之间")
+    paths = list(paths)
+    jobs = [(paths[i:i + FILES_PER_CHUNK], order, ticks_per_beat) for i in range(0, len(paths), FILES_PER_CHUNK)]
+    workers = workers or os.cpu_count() or 1
+    started = time.perf_counter()
+    parts = [[] for _ in range(order + 1)]
+    pending = [0] * (order + 1)
+    files = tokens_seen = done = 0
+
+    if workers == 1 or len(jobs) <= 1:
+        results = map(_count_files, jobs)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(min(workers, len(jobs)))
+        results = pool.imap_unordered(_count_files, jobs)
+
+    try:
+        for counted, job_files, job_tokens, attempted in results:
+            files += job_files
+            tokens_seen += job_tokens
+            for k, part in enumerate(counted):
+                parts[k].append(part)
+                pending[k] += part[0].size
+                if pending[k] > MERGE_ENTRIES:
+                    parts[k] = [_merge(parts[k])]
+                    pending[k] = parts[k][0][0].size
+            done += attempted
+            if progress is not None:
+                progress(done, len(paths), time.perf_counter() - started)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    if tokens_seen == 0:
+        raise ValueError("语料中没有可用的旋律")
+    counts = [_merge(part) for part in parts]
+    for k in range(2, order + 1):
+        code, count = counts[k]
+        keep = count >= min_count
+        counts[k] = code[keep], count[keep]
+    return MarkovModel.from_counts(counts, files, tokens_seen)
+
+
+class MarkovModel:
+    """N元转移表：tables[k] 为上下文长度 k 的计数（0阶为向量，1阶为稠密矩阵，更高阶为CSR）"""
+
+    def __init__(self, tables, files=0, tokens=0):
+        self.tables = tables
+        self.order = len(tables) - 1
+        self.files = files  # 训练用的文件数
+        self.tokens = tokens  # 训练用的符号数
+        self._levels = [self._level(k, table) for k, table in enumerate(tables)]
+
+    @classmethod
+    def from_counts(cls, counts, files=0, tokens=0):
+        """由 count_ngrams 格式的各阶计数构建"""
+        unigram = np.bincount(counts[0][0], weights=counts[0][1], minlength=VOCABULARY).astype(np.uint32)
+        bigram = np.bincount(counts[1][0], weights=counts[1][1], minlength=VOCABULARY * VOCABULARY)
+        tables = [unigram, bigram.astype(np.uint32).reshape(VOCABULARY, VOCABULARY)]
+        for code, count in counts[2:]:
+            # 编码已有序，按上下文分行即为CSR
+            keys, starts = np.unique(code // VOCABULARY, return_index=True)
+            offsets = np.append(starts, code.size).astype(np.int64)
+            tables.append((keys, offsets, (code % VOCABULARY).astype(np.uint16), count.astype(np.uint32)))
+        return cls(tables, files, tokens)
+
+    @staticmethod
+    def _level(k, table):
+        """把计数表整理为采样用的累计形式"""
+        if k == 0:
+            return _Level(None, np.array([0, VOCABULARY]), np.arange(VOCABULARY), _cumulative(table))
+        if k == 1:
+            return _Level(None, np.arange(VOCABULARY + 1) * VOCABULARY, np.tile(np.arange(VOCABULARY), VOCABULARY),
+                          _cumulative(table.ravel()))
+        keys, offsets, symbols, counts = table
+        return _Level(keys, offsets, symbols, _cumulative(counts))
+
+    def save(self, filename):
+        """保存为 .npz 模型文件（计数按原样保存，载入时再累计）"""
+        arrays = {'meta': np.array([MODEL_VERSION, self.order, VOCABULARY, self.files, self.tokens]),
+                  'unigram': self.tables[0], 'bigram': self.tables[1]}
+        for k, (keys, offsets, symbols, counts) in enumerate(self.tables[2:], start=2):
+            arrays.update({f'keys{k}': keys, f'offsets{k}': offsets, f'symbols{k}': symbols, f'counts{k}': counts})
+        with open(filename, 'wb') as f:
+            np.savez(f, **arrays)
+
+    @classmethod
+    def load(cls, filename):
+        """载入 save 保存的模型文件"""
+        try:
+            with np.load(filename) as data:
+                version, order, vocabulary, files, tokens = data['meta'].tolist()
+                if version != MODEL_VERSION or vocabulary != VOCABULARY:
+                    raise ModelFormatError(f"不支持的模型版本: {version}")
+                tables = [data['unigram'], data['bigram']]
+                tables += [tuple(data[f'{name}{k}'] for name in ('keys', 'offsets', 'symbols', 'counts'))
+                           for k in range(2, order + 1)]
+        except (KeyError, ValueError, zipfile.BadZipFile) as e:
+            if isinstance(e, ModelFormatError):
+                raise
+            raise ModelFormatError(f"无效的模型文件: {e}") from e
+        return cls(tables, files, tokens)
+
+    def _draw(self, history, depth, u):
+        """为每一行按上下文抽取下一个符号：从最高阶开始查找上下文，找不到（或计数为0）时回退到低一阶
+
+        history 的最后一列是最近的符号，depth 为已有的符号数，u 为 [0,1) 均匀随机数。
+        """
+        count = len(u)
+        symbol = np.full(count, -1, dtype=np.int64)
+        pending = np.arange(count)
+        for k in range(min(self.order, depth), -1, -1):
+            level = self._levels[k]
+            if k == 0:
+                rows = np.zeros(pending.size, dtype=np.int64)
+                found = np.ones(pending.size, dtype=bool)
+            elif level.keys is None:
+                rows = history[pending, -1]
+                found = np.ones(pending.size, dtype=bool)
+            elif level.keys.size == 0:
+                continue
+            else:
+                context = history[pending, -k]
+                for j in range(k - 1, 0, -1):
+                    context = context * VOCABULARY + history[pending, -j]
+                rows = np.minimum(np.searchsorted(level.keys, context), level.keys.size - 1)
+                found = level.keys[rows] == context
+            low = level.cum[level.offsets[rows]]
+            total = level.cum[level.offsets[rows + 1]] - low
+            found &= total > 0
+            hit = pending[found]
+            target = low[found] + (u[hit] * total[found]).astype(np.int64)
+            symbol[hit] = level.symbols[np.searchsorted(level.cum, target, side='right') - 1]
+            pending = pending[~found]
+            if pending.size == 0:
+                break
+        return symbol
+
+    def sample(self, num_bars, beats_per_bar, snap, rng, ticks_per_beat, tonic=60, phrase_bars=PHRASE_BARS):
+        """采样 num_bars 小节的旋律，返回按开始时间排序的 (音高, 开始tick, 结束tick)
+
+        乐曲分成若干乐句，所有乐句同时推进，每一步为每个乐句各抽一个符号，步数只与乐句长度有关。
+        每个乐句从主音 tonic 开始；snap 为128项查找表，把音高映射到音阶内且在音域内的音。
+        """
+        step_ticks = ticks_per_beat // STEPS_PER_BEAT
+        phrase_steps = phrase_bars * beats_per_bar * STEPS_PER_BEAT
+        phrases = -(-num_bars // phrase_bars)
+        if phrases == 0:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, empty
+        length = np.full(phrases, phrase_steps)
+        length[-1] = (num_bars - (phrases - 1) * phrase_bars) * beats_per_bar * STEPS_PER_BEAT
+        origin = np.arange(phrases) * phrase_steps
+
+        history = np.zeros((phrases, self.order), dtype=np.int64)
+        pitch = np.full(phrases, snap[tonic], dtype=np.int64)
+        position = np.zeros(phrases, dtype=np.int64)
+        active = np.arange(phrases)
+        pitches, starts, ends = [], [], []
+        depth = 0
+        while active.size:
+            symbol = self._draw(history[active], depth, rng.random(active.size))
+            interval = symbol // MAX_STEPS - MAX_INTERVAL
+            steps = symbol % MAX_STEPS + 1
+            if depth:
+                # 超出音域时折回一个八度，再对齐到音阶
+                moved = pitch[active] + interval
+                moved = np.where(moved > 127, moved - 12, np.where(moved < 0, moved + 12, moved))
+                pitch[active] = snap[moved]
+            start = position[active]
+            end = np.minimum(start + steps, length[active])
+            pitches.append(pitch[active])
+            starts.append(origin[active] + start)
+            ends.append(origin[active] + end)
+            position[active] = end
+            history[active] = np.roll(history[active], -1, axis=1)
+            history[active, -1] = symbol
+            depth += 1
+            active = active[end < length[active]]
+
+        pitch = np.concatenate(pitches)
+        start = np.concatenate(starts)
+        order = np.argsort(start, kind='stable')
+        return pitch[order], start[order] * step_ticks, np.concatenate(ends)[order] * step_ticks
+
+
+def _cumulative(counts):
+    """带前导0的累计计数"""
+    cum = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=cum[1:])
+    return cum
+
+
+def build_parser():
+    """创建命令行参数解析器"""
+    parser = argparse.ArgumentParser(description="从MIDI文件目录训练N元旋律模型")
+    parser.add_argument("corpus", help="包含 .mid 文件的目录（递归查找）")
+    parser.add_argument("-o", "--output", default="model.npz", help="模型文件")
+    parser.add_argument("--order", type=int, default=3, help=f"最长上下文的符号数（1..{MAX_ORDER}）")
+    parser.add_argument("--min-count", type=int, default=1, help="二阶及以上转移的最少出现次数，更少的被剪掉")
+    parser.add_argument("-j", "--jobs", type=int, default=0, help="并行进程数，0 表示使用全部CPU核心")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    paths = find_midi_files(args.corpus)
+    if not paths:
+        print(f"目录中没有MIDI文件: {args.corpus}", file=sys.stderr)
+        return 2
+
+    def progress(done, total, elapsed):
+        print(f"\r已处理 {done}/{total} 个文件，{elapsed:.1f} 秒", end="", file=sys.stderr, flush=True)
+
+    try:
+        model = train_model(paths, args.order, args.jobs or None, args.min_count, progress=progress)
+    except ValueError as e:
+        print(f"\n{e}", file=sys.stderr)
+        return 2
+    model.save(args.output)
+    entries = sum(table[0].size for table in model.tables[2:])
+    print(f"\n已保存 {args.output}：{model.files} 个文件，{model.tokens} 个符号，高阶转移 {entries} 条",
+          file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
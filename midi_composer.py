@@ -1,15 +1,36 @@
-import mido
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import numpy as np
 import threading
 import time
-import random
 import os
-from PIL import Image, ImageTk
-import rtmidi
+from note_table import NoteTable
+from composer_engine import CompositionEngine, SCALE_MAP, MODES, MODE_CORPUS, TICKS_PER_BEAT
+from performance import PerformanceCache, PlaybackPlan, compile_chunks, compile_performance
+from piano_roll import PianoRoll
+from playback_scheduler import PlaybackScheduler
+from streaming import prefetch
+from live import LiveGenerator, LiveSettings
+from midi_import import load_midi
+from midi_output import CHANNEL_COUNT
+from project_file import ProjectFormatError, open_project, save_project
+from midi_ports import (PortDiscovery, list_output_ports, load_cached_port, load_port_routes, save_cached_port,
+                        save_port_routes)
+from tasks import TaskRunner
+from instrumentation import instruments, DRAW, EXPORT, GENERATE, LATENESS, SEND, TK_LAG, TK_QUEUE
+
+PROJECT_EXTENSION = ".mprj"  # 工程文件扩展名
 
 class MidiComposer:
+    PLAYHEAD_INTERVAL = 33  # 播放指示器刷新间隔（毫秒），约30帧/秒
+    STREAM_CHUNK_BARS = 16  # 流式生成时每块的小节数
+    STREAM_PREFETCH = 4  # 流式播放时最多提前生成的分块数
+    STREAM_PLAYBACK_NOTES = 100000  # 超过该音符数的乐曲分块编译播放，无需读入全部音符
+    STREAM_CHUNK_NOTES = 20000  # 分块播放已有音符表时每块的音符数
+    HUD_INTERVAL = 500  # 性能监视刷新间隔（毫秒）
+    HUD_METRICS = (LATENESS, SEND, DRAW, TK_LAG, TK_QUEUE, GENERATE, EXPORT)  # 状态栏上显示的指标
+    DEFAULT_ROUTE = "（默认端口）"  # 端口设置中表示不单独路由的选项
+    
     def __init__(self, root):
         self.root = root
         self.root.title("MIDI 作曲工具")
@@ -21,41 +42,29 @@ class MidiComposer:
         self.time_signature = (4, 4)  # 4/4拍
         self.scale = [0, 2, 4, 5, 7, 9, 11]  # C大调音阶
         self.octave_range = (3, 6)  # 音符范围: C3 到 B6
-        self.track_notes = []  # 存储生成的音符
+        self.track_notes = NoteTable()  # 存储生成的音符（按列存储）
+        self.seed = None  # 生成当前乐曲所用的随机种子（保存到工程文件中）
         self.playing = False
-        self.current_position = 0
+        self.scheduler = None  # 当前播放使用的调度器
+        self.timing_stats = None  # 最近一次播放的定时统计
+        self.performance_cache = PerformanceCache(TICKS_PER_BEAT)  # 预编译的演奏缓冲区
+        self.live = None  # 实时演奏时的生成器
+        self.cursor_tick = None  # 暂停或点击定位后下一次播放的起点
+        self.playback_position = None  # 播放中返回当前tick的函数
+        
+        # 不依赖界面的作曲引擎（生成与导出）
+        self.engine = CompositionEngine(self.tempo, self.time_signature, self.octave_range)
         
         # 乐器设置
-        self.instruments = {
-            "钢琴": 0,
-            "小提琴": 40,
-            "大提琴": 42,
-            "定音鼓": 47,
-            "三角铁": 80,
-            "弦乐合奏": 48
-        }
-        
-        # 拉赫玛尼诺夫第二主题的音符序列（简化版）
-        self.rachmaninoff_theme = [
-            # 第一句
-            {'note': 60, 'duration': 1.0},  # C4
-            {'note': 64, 'duration': 0.5},  # E4
-            {'note': 67, 'duration': 0.5},  # G4
-            {'note': 72, 'duration': 1.0},  # C5
-            {'note': 67, 'duration': 0.5},  # G4
-            {'note': 64, 'duration': 0.5},  # E4
-            # 第二句
-            {'note': 60, 'duration': 1.0},  # C4
-            {'note': 64, 'duration': 0.5},  # E4
-            {'note': 67, 'duration': 0.5},  # G4
-            {'note': 72, 'duration': 1.0},  # C5
-            {'note': 67, 'duration': 0.5},  # G4
-            {'note': 64, 'duration': 0.5},  # E4
-        ]
-        
-        # MIDI输出
-        self.midi_out = None
-        self.try_initialize_midi()
+        self.instruments = self.engine.instruments
+        
+        # 后台任务：结果经队列交回界面线程
+        self.tasks = TaskRunner(self.root)
+        self.task = None  # 当前可取消的前台任务
+        
+        # MIDI输出：端口在后台线程中查找和打开（优先使用上次的端口和路由），窗口无需等待
+        self.midi_out = None  # OutputManager：按通道路由到一个或多个端口
+        self.port_discovery = PortDiscovery(load_cached_port(), self.channel_routes())
         
         # 创建界面
         self.create_widgets()
@@ -64,24 +73,71 @@ class MidiComposer:
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
         
     def try_initialize_midi(self):
-        """尝试初始化MIDI输出设备"""
+        """取得MIDI输出设备：启动时已在后台打开，这里只取结果；失败后再次调用会重新尝试"""
+        discovery = self.port_discovery
+        if discovery is None:
+            discovery = PortDiscovery(load_cached_port(), self.channel_routes())
+        self.midi_out = discovery.result()
+        self.port_discovery = None
+    
+    def channel_routes(self, routes=None):
+        """把 {乐器名称: 端口名称} 的路由（省略时读取已保存的设置）换算为 {通道: 端口名称}"""
+        if routes is None:
+            routes = load_port_routes()
+        return {self.engine.channels[self.instruments[name]]: port
+                for name, port in routes.items() if name in self.instruments and port}
+    
+    def configure_ports(self):
+        """选择默认输出端口，并可把各乐器分别路由到其他端口（可同时驱动多台音源）"""
         try:
-            self.midi_out = rtmidi.MidiOut()
-            available_ports = self.midi_out.get_ports()
-            
-            # 如果有可用的MIDI设备，连接到第一个
-            if available_ports:
-                self.midi_out.open_port(0)
-                print(f"已连接到MIDI输出设备: {available_ports[0]}")
-            else:
-                # 如果没有可用的MIDI设备，打开虚拟端口
-                self.midi_out.open_virtual_port("MIDI作曲工具输出")
-                print("已创建虚拟MIDI输出端口")
-                
+            ports = list_output_ports()
         except Exception as e:
-            print(f"MIDI初始化错误: {e}")
-            self.midi_out = None
+            messagebox.showerror("MIDI端口", f"无法枚举MIDI端口: {str(e)}")
+            return
+        if not ports:
+            messagebox.showinfo("MIDI端口", "没有可用的MIDI输出端口，将使用虚拟端口。")
+            return
         
+        dialog = tk.Toplevel(self.root)
+        dialog.title("MIDI端口与路由")
+        dialog.transient(self.root)
+        cached = load_cached_port()
+        default_var = tk.StringVar(value=cached if cached in ports else ports[0])
+        tk.Label(dialog, text="默认端口:").grid(row=0, column=0, sticky=tk.W, padx=5, pady=5)
+        ttk.Combobox(dialog, textvariable=default_var, values=ports, state="readonly",
+                     width=40).grid(row=0, column=1, padx=5, pady=5)
+        
+        # 每种乐器一行：选择单独的端口，或沿用默认端口
+        routes = load_port_routes()
+        route_vars = {}
+        for row, name in enumerate(self.instruments, start=1):
+            port = routes.get(name)
+            var = tk.StringVar(value=port if port in ports else self.DEFAULT_ROUTE)
+            tk.Label(dialog, text=f"{name}:").grid(row=row, column=0, sticky=tk.W, padx=5, pady=2)
+            ttk.Combobox(dialog, textvariable=var, values=[self.DEFAULT_ROUTE] + ports, state="readonly",
+                         width=40).grid(row=row, column=1, padx=5, pady=2)
+            route_vars[name] = var
+        
+        def apply():
+            new_routes = {name: var.get() for name, var in route_vars.items() if var.get() != self.DEFAULT_ROUTE}
+            save_cached_port(default_var.get())
+            save_port_routes(new_routes)
+            dialog.destroy()
+            self.reopen_outputs(default_var.get(), new_routes)
+        
+        buttons = tk.Frame(dialog)
+        buttons.grid(row=len(self.instruments) + 1, column=0, columnspan=2, pady=10)
+        tk.Button(buttons, text="确定", command=apply, padx=10).pack(side=tk.LEFT, padx=5)
+        tk.Button(buttons, text="取消", command=dialog.destroy, padx=10).pack(side=tk.LEFT, padx=5)
+    
+    def reopen_outputs(self, preferred, routes):
+        """关闭当前输出，按新的端口设置在后台重新打开（旧端口仍在查找中时也不阻塞界面）"""
+        self.stop_music()
+        previous = self.midi_out if self.midi_out is not None else self.port_discovery
+        self.midi_out = None
+        self.port_discovery = PortDiscovery(preferred, self.channel_routes(routes), previous=previous)
+        self.status_var.set("正在打开MIDI端口...")
+
     def create_widgets(self):
         # 顶部控制区
         control_frame = tk.Frame(self.root, bg="#e0e0e0", padx=10, pady=10)
@@ -96,20 +152,20 @@ class MidiComposer:
         # 小节数控制
         tk.Label(control_frame, text="小节数:", bg="#e0e0e0").grid(row=0, column=2, padx=5, pady=5)
         self.bars_var = tk.IntVar(value=4)
-        bars_spinner = tk.Spinbox(control_frame, from_=1, to=16, textvariable=self.bars_var, width=5)
+        bars_spinner = tk.Spinbox(control_frame, from_=1, to=100000, textvariable=self.bars_var, width=6)
         bars_spinner.grid(row=0, column=3, padx=5, pady=5)
         
         # 音阶选择
         tk.Label(control_frame, text="音阶:", bg="#e0e0e0").grid(row=0, column=4, padx=5, pady=5)
         self.scale_var = tk.StringVar(value="C大调")
-        scales = ["C大调", "A小调", "G大调", "E小调", "F大调", "D小调"]
+        scales = list(SCALE_MAP.keys())
         scale_menu = ttk.Combobox(control_frame, textvariable=self.scale_var, values=scales, width=10)
         scale_menu.grid(row=0, column=5, padx=5, pady=5)
         
         # 生成模式选择
         tk.Label(control_frame, text="生成模式:", bg="#e0e0e0").grid(row=0, column=6, padx=5, pady=5)
         self.mode_var = tk.StringVar(value="拉赫玛尼诺夫风格")
-        modes = ["拉赫玛尼诺夫风格", "完全随机"]
+        modes = list(MODES)
         mode_menu = ttk.Combobox(control_frame, textvariable=self.mode_var, values=modes, width=15)
         mode_menu.grid(row=0, column=7, padx=5, pady=5)
         
@@ -120,9 +176,36 @@ class MidiComposer:
                                      values=list(self.instruments.keys()), width=10)
         instrument_menu.grid(row=0, column=9, padx=5, pady=5)
         
+        # 保存时是否按乐器分轨（类型1 MIDI文件）
+        self.multitrack_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(control_frame, text="按乐器分轨", variable=self.multitrack_var,
+                       bg="#e0e0e0").grid(row=0, column=10, padx=5, pady=5)
+        
+        # 流式模式：播放和保存时按分块边生成边消费，适合很长的乐曲
+        self.stream_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(control_frame, text="流式", variable=self.stream_var,
+                       bg="#e0e0e0").grid(row=0, column=11, padx=5, pady=5)
+        
+        # 播放范围：起始小节与 A–B 循环（小节编号从1开始，B 小节包含在内）
+        tk.Label(control_frame, text="起始小节:", bg="#e0e0e0").grid(row=1, column=0, padx=5, pady=5)
+        self.start_bar_var = tk.IntVar(value=1)
+        tk.Spinbox(control_frame, from_=1, to=100000, textvariable=self.start_bar_var,
+                   width=6).grid(row=1, column=1, padx=5, pady=5)
+        self.loop_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(control_frame, text="A–B循环", variable=self.loop_var,
+                       bg="#e0e0e0").grid(row=1, column=2, padx=5, pady=5)
+        tk.Label(control_frame, text="A:", bg="#e0e0e0").grid(row=1, column=3, padx=5, pady=5)
+        self.loop_a_var = tk.IntVar(value=1)
+        tk.Spinbox(control_frame, from_=1, to=100000, textvariable=self.loop_a_var,
+                   width=6).grid(row=1, column=4, padx=5, pady=5)
+        tk.Label(control_frame, text="B:", bg="#e0e0e0").grid(row=1, column=5, padx=5, pady=5)
+        self.loop_b_var = tk.IntVar(value=4)
+        tk.Spinbox(control_frame, from_=1, to=100000, textvariable=self.loop_b_var,
+                   width=6).grid(row=1, column=6, padx=5, pady=5)
+        
         # 按钮区
         button_frame = tk.Frame(control_frame, bg="#e0e0e0")
-        button_frame.grid(row=0, column=10, padx=20, pady=5, columnspan=3)
+        button_frame.grid(row=0, column=12, padx=20, pady=5, columnspan=3)
         
         generate_btn = tk.Button(button_frame, text="生成音乐", command=self.generate_music, 
                                  bg="#4CAF50", fg="white", padx=10)
@@ -132,6 +215,14 @@ class MidiComposer:
                              bg="#2196F3", fg="white", padx=10)
         play_btn.pack(side=tk.LEFT, padx=5)
         
+        live_btn = tk.Button(button_frame, text="实时演奏", command=self.play_live, 
+                             bg="#FF9800", fg="white", padx=10)
+        live_btn.pack(side=tk.LEFT, padx=5)
+        
+        pause_btn = tk.Button(button_frame, text="暂停/继续", command=self.pause_music, 
+                              bg="#03A9F4", fg="white", padx=10)
+        pause_btn.pack(side=tk.LEFT, padx=5)
+        
         stop_btn = tk.Button(button_frame, text="停止", command=self.stop_music, 
                             bg="#f44336", fg="white", padx=10)
         stop_btn.pack(side=tk.LEFT, padx=5)
@@ -140,237 +231,105 @@ class MidiComposer:
                              bg="#9C27B0", fg="white", padx=10)
         save_btn.pack(side=tk.LEFT, padx=5)
         
+        open_btn = tk.Button(button_frame, text="打开MIDI", command=self.open_midi, 
+                             bg="#607D8B", fg="white", padx=10)
+        open_btn.pack(side=tk.LEFT, padx=5)
+        
+        save_project_btn = tk.Button(button_frame, text="保存工程", command=self.save_project, 
+                                     bg="#795548", fg="white", padx=10)
+        save_project_btn.pack(side=tk.LEFT, padx=5)
+        
+        open_project_btn = tk.Button(button_frame, text="打开工程", command=self.open_project, 
+                                     bg="#795548", fg="white", padx=10)
+        open_project_btn.pack(side=tk.LEFT, padx=5)
+        
+        export_wav_btn = tk.Button(button_frame, text="导出WAV", command=self.export_wav,
+                                   bg="#009688", fg="white", padx=10)
+        export_wav_btn.pack(side=tk.LEFT, padx=5)
+        
+        ports_btn = tk.Button(button_frame, text="MIDI端口", command=self.configure_ports,
+                              bg="#607D8B", fg="white", padx=10)
+        ports_btn.pack(side=tk.LEFT, padx=5)
+        
+        train_btn = tk.Button(button_frame, text="训练模型", command=self.train_corpus_model,
+                              bg="#3F51B5", fg="white", padx=10)
+        train_btn.pack(side=tk.LEFT, padx=5)
+        
+        load_model_btn = tk.Button(button_frame, text="载入模型", command=self.load_corpus_model,
+                                   bg="#3F51B5", fg="white", padx=10)
+        load_model_btn.pack(side=tk.LEFT, padx=5)
+        
         # 音符显示区域
         self.canvas_frame = tk.Frame(self.root, bg="white")
         self.canvas_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
         
-        self.canvas = tk.Canvas(self.canvas_frame, bg="white", highlightthickness=1, 
-                               highlightbackground="#cccccc")
-        self.canvas.pack(fill=tk.BOTH, expand=True)
+        # 钢琴卷帘：可水平滚动（滚轮）和缩放（Ctrl+滚轮），只绘制可见区域
+        self.piano_roll = PianoRoll(self.canvas_frame, TICKS_PER_BEAT * self.time_signature[0],
+                                    self.octave_range, self.get_note_name)
+        self.canvas = self.piano_roll.canvas
+        # 点击钢琴卷帘定位播放位置
+        self.canvas.bind('<Button-1>', self.on_canvas_click)
         
-        # 播放指示器
-        self.position_line = None
+        # 播放指示器（由界面线程按固定帧率刷新）
+        self.playhead_job = None
         
-        # 状态栏
+        # 实时演奏时监听控制区参数变化
+        self.live_traces = []
+        
+        # 状态栏（右侧为性能监视）
+        status_frame = tk.Frame(self.root)
+        status_frame.pack(side=tk.BOTTOM, fill=tk.X)
         self.status_var = tk.StringVar(value="准备就绪")
-        status_bar = tk.Label(self.root, textvariable=self.status_var, bd=1, relief=tk.SUNKEN, anchor=tk.W)
-        status_bar.pack(side=tk.BOTTOM, fill=tk.X)
-    
-    def get_scale_notes(self):
-        """根据选择的音阶返回对应的音符"""
-        scale_map = {
-            "C大调": [0, 2, 4, 5, 7, 9, 11],  # C D E F G A B
-            "A小调": [9, 11, 0, 2, 4, 5, 7],  # A B C D E F G
-            "G大调": [7, 9, 11, 0, 2, 4, 6],  # G A B C D E F#
-            "E小调": [4, 6, 7, 9, 11, 0, 2],  # E F# G A B C D
-            "F大调": [5, 7, 9, 10, 0, 2, 4],  # F G A Bb C D E
-            "D小调": [2, 4, 5, 7, 9, 10, 0],  # D E F G A Bb C
-        }
-        return scale_map.get(self.scale_var.get(), [0, 2, 4, 5, 7, 9, 11])
-    
-    def generate_rachmaninoff_style(self):
-        """生成拉赫玛尼诺夫风格的旋律，包括打击乐器和弦乐伴奏"""
-        self.track_notes = []
-        ticks_per_beat = 480  # 标准MIDI分辨率
-        current_time = 0
-        
-        # 获取当前选择的音阶
-        scale = self.get_scale_notes()
-        scale_root = scale[0]  # 音阶的根音
-        
-        # 计算音阶偏移量
-        scale_offset = scale_root - 0  # 相对于C大调的偏移
-        
-        # 生成多个变奏
-        num_variations = self.bars_var.get() // 2  # 每两小节一个变奏
-        
-        for variation in range(num_variations):
-            # 主旋律（钢琴）
-            for theme_note in self.rachmaninoff_theme:
-                # 添加一些随机变化
-                note_offset = random.randint(-2, 2)  # 随机音高变化
-                duration_factor = random.uniform(0.8, 1.2)  # 随机节奏变化
-                
-                # 计算新的音符
-                new_note = theme_note['note'] + scale_offset + note_offset
-                new_duration = theme_note['duration'] * duration_factor
-                
-                # 确保音符在合理范围内
-                new_note = max(48, min(84, new_note))  # 限制在C3到C6之间
-                
-                # 添加主旋律音符
-                self.track_notes.append({
-                    'note': new_note,
-                    'velocity': random.randint(70, 100),  # 随机力度
-                    'start': current_time,
-                    'end': current_time + int(new_duration * ticks_per_beat),
-                    'instrument': self.instruments["钢琴"]
-                })
-                
-                # 添加弦乐伴奏（和弦）
-                if random.random() < 0.7:  # 70%的概率添加和弦
-                    chord_notes = [
-                        new_note - 12,  # 低八度
-                        new_note - 7,   # 纯五度
-                        new_note - 4    # 大三度
-                    ]
-                    for chord_note in chord_notes:
-                        if 36 <= chord_note <= 72:  # 确保和弦音符在合理范围内
-                            self.track_notes.append({
-                                'note': chord_note,
-                                'velocity': random.randint(50, 70),  # 较弱的力度
-                                'start': current_time,
-                                'end': current_time + int(new_duration * ticks_per_beat),
-                                'instrument': self.instruments["弦乐合奏"]
-                            })
-                
-                # 添加打击乐器
-                if current_time % (ticks_per_beat * 2) == 0:  # 每两拍添加一次
-                    # 定音鼓
-                    self.track_notes.append({
-                        'note': 36,  # C2
-                        'velocity': random.randint(60, 80),
-                        'start': current_time,
-                        'end': current_time + int(0.5 * ticks_per_beat),
-                        'instrument': self.instruments["定音鼓"]
-                    })
-                    # 三角铁
-                    self.track_notes.append({
-                        'note': 76,  # E5
-                        'velocity': random.randint(40, 60),
-                        'start': current_time,
-                        'end': current_time + int(0.1 * ticks_per_beat),
-                        'instrument': self.instruments["三角铁"]
-                    })
-                
-                current_time += int(new_duration * ticks_per_beat)
-            
-            # 添加一些装饰音
-            if random.random() < 0.3:  # 30%的概率添加装饰音
-                grace_note = {
-                    'note': new_note + random.choice([-2, 2]),  # 上或下装饰音
-                    'velocity': 80,
-                    'start': current_time - int(0.1 * ticks_per_beat),
-                    'end': current_time,
-                    'instrument': self.instruments["钢琴"]
-                }
-                self.track_notes.append(grace_note)
+        status_bar = tk.Label(status_frame, textvariable=self.status_var, bd=1, relief=tk.SUNKEN, anchor=tk.W)
+        status_bar.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        tk.Button(status_frame, text="导出统计", command=self.dump_instruments).pack(side=tk.RIGHT)
+        self.cancel_btn = tk.Button(status_frame, text="取消", command=self.cancel_task, state=tk.DISABLED)
+        self.cancel_btn.pack(side=tk.RIGHT)
+        self.progress_var = tk.DoubleVar(value=0.0)
+        ttk.Progressbar(status_frame, variable=self.progress_var, maximum=1.0,
+                        length=120).pack(side=tk.RIGHT, padx=5)
+        self.hud_var = tk.BooleanVar(value=instruments.enabled)
+        tk.Checkbutton(status_frame, text="性能监视", variable=self.hud_var,
+                       command=self.toggle_instruments).pack(side=tk.RIGHT)
+        self.hud_text = tk.StringVar(value="")
+        tk.Label(status_frame, textvariable=self.hud_text, bd=1, relief=tk.SUNKEN, anchor=tk.E,
+                 font=("Courier", 9)).pack(side=tk.RIGHT)
+        self.hud_job = None
+        if instruments.enabled:
+            self.start_hud()
     
     def generate_music(self):
-        """生成MIDI音乐"""
-        self.status_var.set("正在生成音乐...")
-        self.root.update()
-        
-        # 清空之前的音符
-        self.track_notes = []
+        """在后台生成MIDI音乐，完成后在界面线程中绘制"""
         self.tempo = self.tempo_var.get()
-        
-        # 根据选择的模式生成音乐
-        if self.mode_var.get() == "拉赫玛尼诺夫风格":
-            self.generate_rachmaninoff_style()
-        else:
-            # 原有的随机生成逻辑
-            num_bars = self.bars_var.get()
-            beats_per_bar = self.time_signature[0]
-            ticks_per_beat = 480  # 标准MIDI分辨率
-            
-            # 获取当前选择的音阶
-            scale = self.get_scale_notes()
-            
-            # 生成旋律
-            for bar in range(num_bars):
-                # 每小节的节拍数
-                for beat in range(beats_per_bar):
-                    # 随机决定此拍是否有音符
-                    if random.random() > 0.2:  # 80%几率有音符
-                        # 随机选择音阶中的音符
-                        scale_note = random.choice(scale)
-                        # 在选定的八度范围内随机选择一个八度
-                        octave = random.randint(self.octave_range[0], self.octave_range[1])
-                        # 计算MIDI音符值 (C3 = 60)
-                        note = 60 + scale_note + (octave - 3) * 12
-                        
-                        # 随机决定音符长度 (1/4, 1/8, 1/16拍等)
-                        duration_options = [0.25, 0.5, 1.0]  # 以拍为单位
-                        duration = random.choice(duration_options)
-                        
-                        # 随机决定音符力度 (音量)
-                        velocity = random.randint(60, 100)
-                        
-                        # 计算音符开始时间 (以tick为单位)
-                        start_time = (bar * beats_per_bar + beat) * ticks_per_beat
-                        # 计算音符持续时间 (以tick为单位)
-                        note_duration = int(duration * ticks_per_beat)
-                        
-                        # 存储音符信息
-                        self.track_notes.append({
-                            'note': note,
-                            'velocity': velocity,
-                            'start': start_time,
-                            'end': start_time + note_duration
-                        })
-        
-        # 绘制音符
-        self.draw_notes()
-        self.status_var.set(f"已生成 {len(self.track_notes)} 个音符")
-    
+        self.engine.tempo = self.tempo
+        mode, bars, scale = self.mode_var.get(), self.bars_var.get(), self.scale_var.get()
+        
+        # 根据选择的模式生成音乐（记录种子以便在工程文件中复现）
+        from batch_render import new_master_seed  # 批量渲染模块依赖多进程库，用到时才加载
+        seed = new_master_seed()
+        
+        def work(task):
+            with instruments.timer(GENERATE):
+                notes = self.engine.generate(mode, bars, scale, np.random.default_rng(seed))
+            task.progress(0.7, "正在建立索引...")
+            # 绘制所需的索引在后台建好，界面线程只需取缓存
+            notes.build_indexes()
+            task.progress(1.0)
+            return notes
+        
+        def done(notes):
+            self.seed = seed
+            self.piano_roll.ticks_per_bar = TICKS_PER_BEAT * self.time_signature[0]
+            self.track_notes = notes
+            self.draw_notes()
+            self.status_var.set(f"已生成 {len(notes)} 个音符")
+        
+        self.run_task("生成", work, done, "正在生成音乐...")
+
     def draw_notes(self):
-        """在画布上绘制音符"""
-        self.canvas.delete("all")
-        
-        if not self.track_notes:
-            return
-        
-        # 计算时间范围
-        max_time = max(note['end'] for note in self.track_notes)
-        min_note = min(note['note'] for note in self.track_notes)
-        max_note = max(note['note'] for note in self.track_notes)
-        note_range = max_note - min_note + 1
-        
-        # 设置画布大小和缩放
-        canvas_width = self.canvas.winfo_width()
-        canvas_height = self.canvas.winfo_height()
-        
-        # 留出边距
-        margin_x = 50
-        margin_y = 20
-        
-        # 绘制时间刻度
-        ticks_per_beat = 480
-        beats_per_bar = self.time_signature[0]
-        bar_width = (canvas_width - 2 * margin_x) / (max_time / (ticks_per_beat * beats_per_bar)) 
-        
-        # 绘制小节线和标记
-        for bar in range(int(max_time / (ticks_per_beat * beats_per_bar)) + 1):
-            x = margin_x + bar * bar_width
-            self.canvas.create_line(x, margin_y, x, canvas_height - margin_y, fill="#dddddd")
-            self.canvas.create_text(x, canvas_height - margin_y + 10, text=f"{bar+1}", fill="#666666")
-        
-        # 绘制音高刻度（每个八度）
-        for octave in range(self.octave_range[0], self.octave_range[1] + 1):
-            y = margin_y + (max_note - (60 + (octave - 3) * 12)) * (canvas_height - 2 * margin_y) / note_range
-            self.canvas.create_text(margin_x - 20, y, text=f"C{octave}", fill="#666666")
-            
-        # 绘制音符
-        for note in self.track_notes:
-            x1 = margin_x + note['start'] * (canvas_width - 2 * margin_x) / max_time
-            x2 = margin_x + note['end'] * (canvas_width - 2 * margin_x) / max_time
-            y = margin_y + (max_note - note['note']) * (canvas_height - 2 * margin_y) / note_range
-            
-            # 音符高度
-            note_height = 10
-            
-            # 根据音符力度调整颜色
-            intensity = int(155 * (note['velocity'] / 127)) + 100
-            color = f"#{intensity:02x}{intensity//2:02x}ff"
-            
-            # 绘制音符矩形
-            self.canvas.create_rectangle(x1, y - note_height/2, x2, y + note_height/2, 
-                                        fill=color, outline="#000000")
-            
-            # 添加音符名称显示
-            note_name = self.get_note_name(note['note'])
-            self.canvas.create_text((x1 + x2) / 2, y, text=note_name, fill="#000000", font=("Arial", 8))
+        """在画布上绘制音符（增量渲染，窗口尺寸变化时复用已有图元）"""
+        with instruments.timer(DRAW):
+            self.piano_roll.set_notes(self.track_notes)
     
     def get_note_name(self, midi_note):
         """根据MIDI音符值返回音符名称"""
@@ -381,221 +340,339 @@ class MidiComposer:
     
     def create_midi_file(self):
         """从生成的音符创建MIDI文件"""
-        midi_file = mido.MidiFile()
-        track = mido.MidiTrack()
-        midi_file.tracks.append(track)
-        
-        # 设置速度
-        tempo_in_microseconds = mido.bpm2tempo(self.tempo)
-        track.append(mido.MetaMessage('set_tempo', tempo=tempo_in_microseconds))
-        
-        # 设置拍号
-        track.append(mido.MetaMessage('time_signature', numerator=self.time_signature[0],
-                                     denominator=self.time_signature[1]))
-        
-        # 按开始时间排序音符
-        sorted_notes = sorted(self.track_notes, key=lambda x: x['start'])
-        
-        # 添加音符
-        current_time = 0
-        current_instrument = None
-        
-        for note in sorted_notes:
-            # 计算与上一个事件的时间差（以tick为单位）
-            delta_time = note['start'] - current_time
-            
-            # 如果乐器改变，添加乐器变更消息
-            if 'instrument' in note and note['instrument'] != current_instrument:
-                track.append(mido.Message('program_change', program=note['instrument'], time=delta_time))
-                current_instrument = note['instrument']
-                delta_time = 0  # 重置时间差
-            
-            # 添加音符开始事件
-            track.append(mido.Message('note_on', note=note['note'], 
-                                     velocity=note['velocity'], time=delta_time))
-            
-            # 更新当前时间
-            current_time = note['start']
-            
-            # 计算音符持续时间
-            note_duration = note['end'] - note['start']
-            
-            # 添加音符结束事件
-            track.append(mido.Message('note_off', note=note['note'], 
-                                     velocity=0, time=note_duration))
-            
-            # 更新当前时间
-            current_time = note['end']
-        
-        return midi_file
+        return self.engine.create_midi_file(self.track_notes, self.tempo, self.multitrack_var.get())
+    
+    def iter_stream_chunks(self):
+        """按当前界面设置逐块生成 (音符表, 边界tick)"""
+        self.tempo = self.tempo_var.get()
+        self.engine.tempo = self.tempo
+        return self.engine.iter_chunks(self.mode_var.get(), self.scale_var.get(), np.random.default_rng(),
+                                       self.bars_var.get(), self.STREAM_CHUNK_BARS)
     
     def play_music(self):
         """实时播放生成的MIDI音乐"""
-        if not self.track_notes or self.playing:
+        if self.playing:
             return
-            
+        if self.stream_var.get():
+            self.play_stream()
+            return
+        if not self.track_notes:
+            return
+        
+        # 起点：暂停或点击定位的位置，否则为起始小节
+        ticks_per_bar = self.piano_roll.ticks_per_bar
+        start_tick = self.cursor_tick
+        if start_tick is None:
+            start_tick = (max(1, self.start_bar_var.get()) - 1) * ticks_per_bar
+        self.cursor_tick = None
+        loop = None
+        if self.loop_var.get():
+            loop = ((max(1, self.loop_a_var.get()) - 1) * ticks_per_bar, self.loop_b_var.get() * ticks_per_bar)
+        
+        notes = self.track_notes
+        if loop is None and len(notes) > self.STREAM_PLAYBACK_NOTES:
+            # 很长的乐曲（如映射打开的工程）边编译边播放，只读取即将播放的部分
+            self.play_stream(notes.iter_chunks(self.STREAM_CHUNK_NOTES, start_tick), follow=True,
+                             start_tick=start_tick)
+            return
+        
         if self.midi_out is None:
             self.try_initialize_midi()
             if self.midi_out is None:
                 messagebox.showerror("播放错误", "无法初始化MIDI输出。请检查MIDI设备连接。")
                 return
         
+        if loop is not None and len(notes) > self.STREAM_PLAYBACK_NOTES:
+            # 很长的乐曲循环时只编译循环区间内的音符
+            performance = compile_performance(notes.take(notes.query_range(*loop)), self.tempo, TICKS_PER_BEAT)
+        else:
+            # 取出预编译的演奏缓冲区（仅在音符或速度变化后重新编译）
+            performance = self.performance_cache.get(notes, self.tempo)
+        # 二分查找起点并恢复该处的音色和仍在发声的音符，无需从头重放
+        plan = PlaybackPlan(performance, start_tick, loop)
+        
         self.playing = True
-        self.status_var.set("正在播放...")
+        self.status_var.set("正在循环播放..." if plan.loop else "正在播放...")
+        scheduler = self.scheduler = PlaybackScheduler(probe=instruments.metric(LATENESS))
+        self.start_playhead(lambda: plan.tick_at(scheduler.elapsed()))
         
         # 在新线程中播放MIDI，避免阻塞GUI
         def playback_thread():
             try:
-                # 按开始时间排序音符
-                sorted_notes = sorted(self.track_notes, key=lambda x: x['start'])
-                
-                # 当前活跃的音符，用于跟踪哪些音符需要关闭
-                active_notes = {}
-                
-                # 计算播放开始时间
-                start_time = time.time()
-                
-                # 转换tick为秒
-                ticks_per_beat = 480
-                seconds_per_tick = 60.0 / (self.tempo * ticks_per_beat)
+                # 一次唤醒发送同一tick的全部事件（播放指示器由界面线程自行刷新）
+                def timed_segments():
+                    for segment in plan.segments():
+                        yield segment.times, self.dispatcher(segment.messages)
                 
-                # 创建音符开始和结束事件的列表
-                events = []
-                
-                for note in sorted_notes:
-                    # 添加乐器变更事件
-                    if 'instrument' in note:
-                        events.append({
-                            'time': note['start'],
-                            'type': 'program_change',
-                            'program': note['instrument']
-                        })
-                    
-                    # 添加音符开始事件
-                    events.append({
-                        'time': note['start'],
-                        'type': 'note_on',
-                        'note': note['note'],
-                        'velocity': note['velocity']
-                    })
-                    
-                    # 添加音符结束事件
-                    events.append({
-                        'time': note['end'],
-                        'type': 'note_off',
-                        'note': note['note'],
-                        'velocity': 0
-                    })
-                
-                # 按时间排序所有事件
-                events.sort(key=lambda x: x['time'])
-                
-                # 记录上一个事件的时间
-                last_event_time = 0
-                
-                # 依次处理每个事件
-                for event in events:
-                    if not self.playing:
-                        break
-                    
-                    # 计算需要等待的时间
-                    wait_time = (event['time'] - last_event_time) * seconds_per_tick
-                    
-                    if wait_time > 0:
-                        time.sleep(wait_time)
-                    
-                    # 更新播放指示器位置
-                    self.update_position_indicator(event['time'])
-                    
-                    # 处理事件
-                    if event['type'] == 'program_change':
-                        # 发送MIDI乐器变更消息
-                        self.midi_out.send_message([0xC0, event['program']])
-                    elif event['type'] == 'note_on':
-                        # 发送MIDI音符开始消息
-                        self.midi_out.send_message([0x90, event['note'], event['velocity']])
-                    else:  # note_off
-                        # 发送MIDI音符结束消息
-                        self.midi_out.send_message([0x80, event['note'], 0])
-                    
-                    # 更新上一个事件时间
-                    last_event_time = event['time']
-                
-                # 关闭所有可能仍在播放的音符
-                for note in range(128):
-                    self.midi_out.send_message([0x80, note, 0])
+                # 以绝对时钟为基准调度，避免逐个相对休眠带来的累积漂移；循环的各遍首尾相接
+                scheduler.run_stream(timed_segments())
+                if self.scheduler is not scheduler:
+                    # 点击定位时新的播放可能已经开始：发声的音符和播放状态都属于新的播放
+                    return
+                self.timing_stats = scheduler.stats()
                 
                 # 播放完成
                 if self.playing:
                     self.playing = False
-                    self.status_var.set("播放完成")
-                    
-                    # 清除播放指示器
-                    if self.position_line:
-                        self.canvas.delete(self.position_line)
-                        self.position_line = None
-                
+                    stats = self.timing_stats
+                    self.post_status(f"播放完成（平均延迟 {stats.mean_lateness * 1000:.2f} ms，"
+                                        f"最大延迟 {stats.max_lateness * 1000:.2f} ms，"
+                                        f"抖动 {stats.jitter * 1000:.2f} ms）")
+            
             except Exception as e:
-                messagebox.showerror("播放错误", f"播放时出错: {str(e)}")
-                self.playing = False
-                self.status_var.set("播放错误")
+                if self.scheduler is scheduler:
+                    self.post_error("播放错误", f"播放时出错: {str(e)}")
+                    self.playing = False
+                    self.post_status("播放错误")
+            finally:
+                # 关闭所有可能仍在播放的音符（出错时也要让仍正常的端口静音）
+                if self.scheduler is scheduler:
+                    self.all_notes_off()
         
         # 启动播放线程
         threading.Thread(target=playback_thread, daemon=True).start()
     
-    def update_position_indicator(self, current_tick):
-        """更新画布上的播放位置指示器"""
-        if not self.track_notes:
+    def pause_music(self):
+        """暂停时记住当前位置，再次点击从该处继续"""
+        if self.playing:
+            if self.playback_position is None:
+                # 实时演奏和流式生成没有可恢复的位置，等同于停止
+                self.stop_music()
+                return
+            tick = int(self.playback_position())
+            self.stop_music()
+            self.cursor_tick = tick
+            self.piano_roll.show_playhead(tick, follow=False)
+            self.status_var.set(f"已暂停于第 {int(tick // self.piano_roll.ticks_per_bar) + 1} 小节")
+        elif self.cursor_tick is not None:
+            self.play_music()
+    
+    def on_canvas_click(self, event):
+        """点击钢琴卷帘：把播放位置定位到点击处（播放中立即跳转）"""
+        if not self.track_notes or self.live is not None:
             return
+        tick = max(0, int(self.piano_roll.x_to_tick(self.canvas.canvasx(event.x))))
+        playing = self.playing and self.playback_position is not None
+        if playing:
+            self.stop_music()
+        self.cursor_tick = tick
+        if playing:
+            self.play_music()
+        else:
+            self.piano_roll.show_playhead(tick, follow=False)
+    
+    def play_stream(self, chunks=None, follow=False, start_tick=0):
+        """流式播放：后台线程逐块生成并编译，调度器边到达边播放
+
+        chunks 为 (音符表, 边界tick) 的迭代器，省略时按当前设置生成；
+        start_tick 为播放起点，follow 为真时显示播放指示器。
+        """
+        if self.midi_out is None:
+            self.try_initialize_midi()
+            if self.midi_out is None:
+                messagebox.showerror("播放错误", "无法初始化MIDI输出。请检查MIDI设备连接。")
+                return
+        
+        self.playing = True
+        self.status_var.set("正在流式播放...")
+        scheduler = self.scheduler = PlaybackScheduler(probe=instruments.metric(LATENESS))
+        if chunks is None:
+            chunks = self.iter_stream_chunks()
+            channels = self.engine.channels.values()
+        else:
+            channels = None
+        tempo = self.tempo
+        if follow:
+            seconds_per_tick = 60.0 / (tempo * TICKS_PER_BEAT)
+            self.start_playhead(lambda: start_tick + scheduler.elapsed() / seconds_per_tick)
+        
+        def playback_thread():
+            # 生成和编译在预取线程中提前进行，播放线程只负责按时发送
+            performances = prefetch(compile_chunks(chunks, tempo, TICKS_PER_BEAT, start_tick),
+                                    self.STREAM_PREFETCH)
             
-        # 在主线程中更新UI
-        def update_ui():
-            # 删除旧的位置指示器
-            if self.position_line:
-                self.canvas.delete(self.position_line)
-            
-            # 计算位置
-            max_time = max(note['end'] for note in self.track_notes)
-            canvas_width = self.canvas.winfo_width()
-            canvas_height = self.canvas.winfo_height()
-            margin_x = 50
-            margin_y = 20
+            def timed_chunks():
+                for performance in performances:
+                    yield performance.times, self.dispatcher(performance.messages)
             
-            x = margin_x + current_tick * (canvas_width - 2 * margin_x) / max_time
+            try:
+                scheduler.run_stream(timed_chunks())
+                if self.scheduler is not scheduler:
+                    return  # 已被新的播放取代
+                self.timing_stats = scheduler.stats()
+                if self.playing:
+                    self.playing = False
+                    self.post_status("流式播放完成")
+            except Exception as e:
+                if self.scheduler is scheduler:
+                    self.post_error("播放错误", f"播放时出错: {str(e)}")
+                    self.playing = False
+                    self.post_status("播放错误")
+            finally:
+                performances.close()
+                if self.scheduler is scheduler:
+                    self.all_notes_off(channels)
+        
+        threading.Thread(target=playback_thread, daemon=True).start()
+    
+    def current_live_settings(self):
+        """读取控制区中的实时演奏参数（输入不完整时沿用上一次的速度）"""
+        try:
+            tempo = min(240, max(40, self.tempo_var.get()))
+        except tk.TclError:
+            tempo = self.live.settings.tempo if self.live else self.tempo
+        return LiveSettings(tempo, self.mode_var.get(), self.scale_var.get(), self.instrument_var.get())
+    
+    def on_live_control_changed(self, *args):
+        """实时演奏时修改控制区参数，从下一条小节线开始生效"""
+        if self.live is not None:
+            settings = self.current_live_settings()
+            if not self.corpus_model_ready(settings.mode):
+                self.mode_var.set(self.live.settings.mode)  # 保持正在演奏的模式
+                return
+            self.live.update(**settings._asdict())
+    
+    def corpus_model_ready(self, mode):
+        """mode 需要语料模型而尚未训练或载入时提示用户并返回 False"""
+        if mode == MODE_CORPUS and self.engine.corpus_model is None:
+            messagebox.showwarning("语料模型", "尚未训练或载入语料模型。请先点击“训练模型”或“载入模型”。")
+            return False
+        return True
+    
+    def play_live(self):
+        """实时演奏：生产线程不断生成后续小节，调度器边生成边播放，直到停止"""
+        if self.playing or not self.corpus_model_ready(self.mode_var.get()):
+            return
+        if self.midi_out is None:
+            self.try_initialize_midi()
+            if self.midi_out is None:
+                messagebox.showerror("播放错误", "无法初始化MIDI输出。请检查MIDI设备连接。")
+                return
+        
+        self.playing = True
+        self.status_var.set("正在实时演奏（修改参数将在下一小节生效）...")
+        scheduler = self.scheduler = PlaybackScheduler(probe=instruments.metric(LATENESS))
+        live = self.live = LiveGenerator(self.engine, self.current_live_settings(), scheduler)
+        if not self.live_traces:
+            for var in (self.tempo_var, self.mode_var, self.scale_var, self.instrument_var):
+                self.live_traces.append((var, var.trace_add("write", self.on_live_control_changed)))
+        
+        def playback_thread():
+            def timed_chunks():
+                for performance in live:
+                    yield performance.times, self.dispatcher(performance.messages)
             
-            # 绘制新的位置指示器
-            self.position_line = self.canvas.create_line(
-                x, margin_y, x, canvas_height - margin_y, 
-                fill="#ff0000", width=2, dash=(4, 4)
-            )
+            try:
+                scheduler.run_stream(timed_chunks())
+                if self.scheduler is scheduler:
+                    self.timing_stats = scheduler.stats()
+            except Exception as e:
+                if self.scheduler is scheduler:
+                    self.post_error("播放错误", f"播放时出错: {str(e)}")
+                    self.playing = False
+                    self.post_status("播放错误")
+            finally:
+                # 停止后本线程最多还要约0.1秒才退出，期间可能已开始新的播放：只清理属于自己的部分
+                live.stop()
+                if self.scheduler is scheduler:
+                    self.all_notes_off(self.engine.channels.values())
+                # 出错结束时 stop_music 不会再清理，监听回调属于界面线程，交给它移除（已被取代时不做任何事）
+                self.tasks.post(self.end_live, live)
+        
+        live.start()
+        threading.Thread(target=playback_thread, daemon=True).start()
+    
+    def end_live(self, live):
+        """结束实时演奏 live：清除 self.live 并移除控制区参数的监听（需在界面线程中调用）
+
+        live 已不是当前的实时演奏时（已被清理或已开始新的演奏）不做任何事。
+        """
+        if self.live is not live:
+            return
+        self.live = None
+        for var, name in self.live_traces:
+            var.trace_remove("write", name)
+        self.live_traces = []
+    
+    def dispatcher(self, messages):
+        """返回调度器使用的派发函数：把 messages(lo, hi) 给出的同一时刻的消息整批交给输出管理器
+        
+        消息按通道分到各端口，每个端口入队一次，由端口的发送线程连续发出。
+        """
+        dispatch_batch = self.midi_out.dispatch
+        
+        def dispatch(lo, hi):
+            dispatch_batch(messages(lo, hi))
+        return dispatch
+
+    def start_playhead(self, position):
+        """按固定帧率根据调度器的时钟刷新播放指示器，直到播放结束
+
+        position() 返回当前播放到的tick。
+        """
+        if self.playhead_job is not None:
+            self.root.after_cancel(self.playhead_job)
+        self.playback_position = position
+        
+        def frame():
+            if not self.playing:
+                # 播放结束或已停止：隐藏播放指示器（暂停时停在暂停处）
+                self.playhead_job = None
+                self.playback_position = None
+                if self.cursor_tick is None:
+                    self.piano_roll.hide_playhead()
+                return
+            self.update_position_indicator(position())
+            self.playhead_job = self.root.after(self.PLAYHEAD_INTERVAL, frame)
         
-        # 在主线程中执行UI更新
-        self.root.after(0, update_ui)
+        frame()
+    
+    def update_position_indicator(self, current_tick):
+        """更新画布上的播放位置指示器（需在界面线程中调用）"""
+        if not self.track_notes:
+            return
+        # 乐曲长度已在音符表中缓存，超出部分停在末尾
+        self.piano_roll.show_playhead(min(current_tick, self.track_notes.end_tick))
     
     def stop_music(self):
         """停止播放音乐"""
         if self.playing:
             self.playing = False
+            if self.scheduler:
+                self.scheduler.stop()
+            live = self.live
+            if live is not None:
+                live.stop()
+                self.end_live(live)
+            self.playback_position = None
             self.status_var.set("播放已停止")
             
             # 关闭所有可能仍在播放的音符
             if self.midi_out:
-                for note in range(128):
-                    self.midi_out.send_message([0x80, note, 0])
+                streamed = live is not None or self.stream_var.get()
+                self.all_notes_off(self.engine.channels.values() if streamed else None)
             
             # 清除播放指示器
-            if self.position_line:
-                self.canvas.delete(self.position_line)
-                self.position_line = None
+            self.piano_roll.hide_playhead()
+        self.cursor_tick = None
+    
+    def all_notes_off(self, channels=None):
+        """在全部16个通道（或指定通道）上发送“全部音符关闭”和“全部声音关闭”
+
+        不扫描音符表的通道列，映射打开的大工程停止时无需读入整列。
+        """
+        if channels is None:
+            channels = range(CHANNEL_COUNT)
+        self.midi_out.panic(channels)
     
     def save_midi(self):
-        """保存MIDI文件"""
+        """保存MIDI文件：先选择文件，再在后台序列化并写入"""
+        if self.stream_var.get():
+            self.save_stream()
+            return
         if not self.track_notes:
             messagebox.showwarning("保存错误", "没有可保存的音符。请先生成音乐。")
             return
-            
-        # 创建MIDI文件
-        midi_file = self.create_midi_file()
         
         # 打开文件选择对话框
         filename = filedialog.asksaveasfilename(
@@ -603,23 +680,324 @@ class MidiComposer:
             filetypes=[("MIDI文件", "*.mid"), ("所有文件", "*.*")],
             title="保存MIDI文件"
         )
+        if not filename:
+            return
         
-        if filename:
-            try:
-                midi_file.save(filename)
-                self.status_var.set(f"MIDI文件已保存: {filename}")
-            except Exception as e:
-                messagebox.showerror("保存错误", f"无法保存MIDI文件: {str(e)}")
-                self.status_var.set("保存失败")
+        notes, tempo, multitrack = self.track_notes, self.tempo, self.multitrack_var.get()
+        
+        def work(task):
+            # 创建MIDI文件
+            with instruments.timer(EXPORT):
+                midi_file = self.engine.create_midi_file(notes, tempo, multitrack)
+            task.check()
+            midi_file.save(filename)
+        
+        self.run_task("保存", work, lambda result: self.status_var.set(f"MIDI文件已保存: {filename}"),
+                      "正在保存MIDI文件...")
+
+    def open_midi(self):
+        """打开MIDI文件，载入音符表以便查看和重新播放"""
+        if self.playing:
+            self.stop_music()
+        filename = filedialog.askopenfilename(
+            filetypes=[("MIDI文件", "*.mid *.midi"), ("所有文件", "*.*")],
+            title="打开MIDI文件"
+        )
+        if not filename:
+            return
+        
+        started = time.perf_counter()
+        
+        def done(imported):
+            # 采用文件开头的速度和拍号
+            self.tempo = min(240, max(40, imported.tempo))
+            self.tempo_var.set(self.tempo)
+            self.engine.tempo = self.tempo
+            numerator, denominator = imported.time_signature
+            self.piano_roll.ticks_per_bar = TICKS_PER_BEAT * numerator * 4 // denominator
+            
+            self.track_notes = imported.notes
+            self.seed = None  # 导入的乐曲不是由本程序生成的，没有可复现的种子
+            self.draw_notes()
+            self.status_var.set(f"已载入 {os.path.basename(filename)}：{imported.track_count} 轨，"
+                                f"{len(self.track_notes)} 个音符（用时 {time.perf_counter() - started:.2f} 秒）")
+        
+        def work(task):
+            imported = load_midi(filename, TICKS_PER_BEAT, lambda fraction: task.progress(0.9 * fraction))
+            imported.notes.build_indexes()
+            task.progress(1.0)
+            return imported
+        
+        self.run_task("载入", work, done, "正在载入MIDI文件...")
+    
+    def train_corpus_model(self):
+        """从MIDI文件目录训练语料模型（在后台多进程统计），保存后切换到语料模式"""
+        directory = filedialog.askdirectory(title="选择MIDI语料目录")
+        if not directory:
+            return
+        filename = filedialog.asksaveasfilename(
+            defaultextension=".npz",
+            filetypes=[("语料模型", "*.npz"), ("所有文件", "*.*")],
+            title="保存语料模型"
+        )
+        if not filename:
+            return
+        
+        def work(task):
+            from markov_model import find_midi_files, train_model
+            paths = find_midi_files(directory)
+            if not paths:
+                raise ValueError("目录中没有MIDI文件")
+            model = train_model(paths, workers=os.cpu_count(),
+                                progress=lambda done, total, elapsed: task.progress(
+                                    done / total, f"正在训练模型 {done}/{total}"))
+            task.check()
+            model.save(filename)
+            return model
+        
+        def done(model):
+            self.engine.corpus_model = model
+            self.mode_var.set(MODE_CORPUS)
+            self.status_var.set(f"语料模型已保存: {filename}（{model.files} 个文件，{model.tokens} 个音符）")
+        
+        self.run_task("训练", work, done, "正在训练语料模型...")
+    
+    def load_corpus_model(self):
+        """载入训练好的语料模型并切换到语料模式"""
+        filename = filedialog.askopenfilename(
+            filetypes=[("语料模型", "*.npz"), ("所有文件", "*.*")],
+            title="载入语料模型"
+        )
+        if not filename:
+            return
+        
+        def done(model):
+            self.mode_var.set(MODE_CORPUS)
+            self.status_var.set(f"已载入语料模型 {os.path.basename(filename)}（{model.files} 个文件）")
+        
+        self.run_task("载入", lambda task: self.engine.load_corpus_model(filename), done, "正在载入语料模型...")
+
+    def save_project(self):
+        """保存为工程文件（保留音色、力度、通道和乐曲参数，可被映射快速打开）"""
+        if not self.track_notes:
+            messagebox.showwarning("保存错误", "没有可保存的音符。请先生成音乐。")
+            return
+        filename = filedialog.asksaveasfilename(
+            defaultextension=PROJECT_EXTENSION,
+            filetypes=[("工程文件", "*" + PROJECT_EXTENSION), ("所有文件", "*.*")],
+            title="保存工程"
+        )
+        if not filename:
+            return
+        # 音阶和模式只对生成的乐曲有意义（导入的乐曲没有种子）
+        generated = self.seed is not None
+        notes, tempo, seed = self.track_notes, self.tempo, self.seed
+        scale = self.scale_var.get() if generated else None
+        mode = self.mode_var.get() if generated else None
+        
+        def work(task):
+            # 大工程要写出数百MB，在后台写入；取消时保留原有文件
+            save_project(filename, notes, tempo, self.engine.time_signature, TICKS_PER_BEAT, scale, mode, seed,
+                         progress=task.progress)
+        
+        self.run_task("保存工程", work, lambda result: self.status_var.set(f"工程已保存: {filename}"),
+                      "正在保存工程...")
+    
+    def open_project(self):
+        """打开工程文件：音符列按需从磁盘映射，大工程也能立即打开"""
+        if self.playing:
+            self.stop_music()
+        filename = filedialog.askopenfilename(
+            filetypes=[("工程文件", "*" + PROJECT_EXTENSION), ("所有文件", "*.*")],
+            title="打开工程"
+        )
+        if not filename:
+            return
+        try:
+            project = open_project(filename)
+        except (OSError, ProjectFormatError) as e:
+            messagebox.showerror("打开错误", f"无法打开工程: {str(e)}")
+            self.status_var.set("打开失败")
+            return
+        
+        self.tempo = project.tempo
+        self.tempo_var.set(self.tempo)
+        self.engine.tempo = self.tempo
+        if project.scale in SCALE_MAP:
+            self.scale_var.set(project.scale)
+        if project.mode in MODES:
+            self.mode_var.set(project.mode)
+        self.seed = project.seed
+        numerator, denominator = project.time_signature
+        self.piano_roll.ticks_per_bar = project.ticks_per_beat * numerator * 4 // denominator
+        
+        self.track_notes = project.notes
+        self.draw_notes()
+        self.status_var.set(f"已打开工程 {os.path.basename(filename)}：{len(self.track_notes)} 个音符")
+    
+    def export_wav(self):
+        """用内置合成器离线渲染为WAV音频（后台线程，无需MIDI设备）"""
+        if not self.track_notes:
+            messagebox.showwarning("导出错误", "没有可导出的音符。请先生成音乐。")
+            return
+        filename = filedialog.asksaveasfilename(
+            defaultextension=".wav",
+            filetypes=[("WAV音频", "*.wav"), ("所有文件", "*.*")],
+            title="导出WAV"
+        )
+        if not filename:
+            return
+        
+        notes, tempo = self.track_notes, self.tempo
+        
+        def work(task):
+            from audio_render import SAMPLE_RATE, render_audio, write_wav
+            started = time.perf_counter()
+            samples = render_audio(notes, tempo, TICKS_PER_BEAT, workers=os.cpu_count())
+            task.check()
+            write_wav(filename, samples)
+            return samples.size / SAMPLE_RATE, time.perf_counter() - started
+        
+        def done(result):
+            seconds, elapsed = result
+            self.status_var.set(f"WAV已导出: {filename}（{seconds:.1f} 秒音频，用时 {elapsed:.1f} 秒）")
+        
+        self.run_task("导出", work, done, "正在渲染音频...")
+
+    def save_stream(self):
+        """流式保存：先选择文件，再在后台逐块生成并增量写入"""
+        filename = filedialog.asksaveasfilename(
+            defaultextension=".mid",
+            filetypes=[("MIDI文件", "*.mid"), ("所有文件", "*.*")],
+            title="保存MIDI文件"
+        )
+        if not filename:
+            return
+        
+        self.tempo = self.tempo_var.get()
+        self.engine.tempo = self.tempo
+        mode, bars, scale = self.mode_var.get(), self.bars_var.get(), self.scale_var.get()
+        
+        def work(task):
+            # 取消或出错时 stream_to_file 会删除写了一半的文件
+            with instruments.timer(EXPORT):
+                return self.engine.stream_to_file(filename, mode, bars, scale, np.random.default_rng(),
+                                                  self.STREAM_CHUNK_BARS, progress=task.progress)
+        
+        self.run_task("保存", work,
+                      lambda count: self.status_var.set(f"MIDI文件已保存: {filename}（{count} 个音符）"),
+                      "正在流式生成并写入...")
+    
+    def run_task(self, name, work, on_done, message):
+        """在后台执行 work(task)，状态栏显示进度，结果交给 on_done（在界面线程中调用）
+        
+        同一时间只保留一个前台任务：开始新任务会取消尚未完成的旧任务。
+        """
+        if self.task is not None:
+            self.task.cancel()
+        self.status_var.set(message)
+        self.progress_var.set(0.0)
+        self.cancel_btn.config(state=tk.NORMAL)
+        
+        def finished(callback):
+            def handler(*args):
+                if self.task is task:
+                    self.task = None
+                    self.progress_var.set(0.0)
+                    self.cancel_btn.config(state=tk.DISABLED)
+                callback(*args)
+            return handler
+        
+        def progress(fraction, text=None):
+            if self.task is not task:
+                return
+            self.progress_var.set(fraction)
+            self.status_var.set(f"{text or message} {fraction:.0%}")
+        
+        def failed(error):
+            messagebox.showerror(f"{name}错误", f"{name}失败: {str(error)}")
+            self.status_var.set(f"{name}失败")
+        
+        def cancelled():
+            # 被新任务取代而取消时，状态栏和进度条已属于新任务
+            if self.task is task:
+                finished(lambda: self.status_var.set(f"已取消{name}"))()
+        
+        task = self.task = self.tasks.submit(name, work, finished(on_done), finished(failed), progress, cancelled)
+        return task
+    
+    def cancel_task(self):
+        """取消当前的前台任务"""
+        if self.task is not None:
+            self.task.cancel()
+    
+    def post_status(self, text):
+        """从工作线程更新状态栏（交给界面线程执行）"""
+        self.tasks.post(self.status_var.set, text)
+    
+    def post_error(self, title, text):
+        """从工作线程显示错误对话框（交给界面线程执行）"""
+        self.tasks.post(messagebox.showerror, title, text)
+
+    def toggle_instruments(self):
+        """开启或关闭性能监测（开启时清空旧数据并开始刷新状态栏）"""
+        if self.hud_var.get():
+            instruments.reset()
+            instruments.enabled = True
+            self.start_hud()
+        else:
+            instruments.enabled = False
+            if self.hud_job is not None:
+                self.root.after_cancel(self.hud_job)
+                self.hud_job = None
+            self.hud_text.set("")
+    
+    def start_hud(self):
+        """定时采样界面线程的滞后和 after 队列长度，并刷新状态栏上的指标摘要"""
+        interval = self.HUD_INTERVAL / 1000
+        expected = time.perf_counter() + interval
+        
+        def frame():
+            nonlocal expected
+            now = time.perf_counter()
+            instruments.record(TK_LAG, max(0.0, now - expected))
+            instruments.record(TK_QUEUE, len(self.root.tk.splitlist(self.root.tk.call('after', 'info'))))
+            self.hud_text.set(instruments.hud_text(self.HUD_METRICS))
+            expected = now + interval
+            self.hud_job = self.root.after(self.HUD_INTERVAL, frame)
+        
+        self.hud_job = self.root.after(self.HUD_INTERVAL, frame)
+    
+    def dump_instruments(self):
+        """把性能监测数据（摘要、直方图、最近样本）导出为JSON文件"""
+        if not instruments.metrics:
+            messagebox.showinfo("导出统计", "尚无性能数据。请先勾选“性能监视”，再进行播放或生成。")
+            return
+        filename = filedialog.asksaveasfilename(
+            defaultextension=".json",
+            filetypes=[("JSON文件", "*.json"), ("所有文件", "*.*")],
+            title="导出性能统计"
+        )
+        if not filename:
+            return
+        try:
+            instruments.dump(filename)
+            self.status_var.set(f"性能统计已导出: {filename}")
+        except OSError as e:
+            messagebox.showerror("导出错误", f"无法导出性能统计: {str(e)}")
     
     def on_closing(self):
         """窗口关闭时清理资源"""
-        # 停止播放
+        # 停止播放并取消后台任务
         self.stop_music()
+        self.cancel_task()
+        self.tasks.close()
         
-        # 关闭MIDI输出
+        # 关闭MIDI输出（包括后台已打开但尚未使用的端口）
+        if self.midi_out is None and self.port_discovery is not None and self.port_discovery.ready:
+            self.midi_out = self.port_discovery.result()
         if self.midi_out:
-            self.midi_out.close_port()
+            self.midi_out.close()
         
         # 销毁窗口
         self.root.destroy()
@@ -627,15 +1005,9 @@ class MidiComposer:
 def main():
     # 创建主窗口
     root = tk.Tk()
-    app = MidiComposer(root)
-    
-    # 窗口大小变化时重绘音符
-    def on_resize(event):
-        if hasattr(app, 'track_notes') and app.track_notes:
-            app.draw_notes()
-    
-    app.canvas.bind('<Configure>', on_resize)
+    MidiComposer(root)
     
+    # 窗口大小变化时由钢琴卷帘自行缩放已有图元
     root.mainloop()
 
 if __name__ == "__main__":
@@ -0,0 +1,346 @@
+"""把音符表转换为按时间排序的MIDI事件流，并批量序列化为标准MIDI文件"""
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+from note_table import NO_INSTRUMENT
+
+NOTE_OFF = 0x80
+NOTE_ON = 0x90
+PROGRAM_CHANGE = 0xC0
+DRUM_CHANNEL = 9  # GM标准中第10通道为打击乐通道
+
+# 同一tick内的事件顺序：先关闭其他音符，再发出时长为0（结束不晚于开始）的音符，最后切换音色、开始新音符。
+# 时长为0的音符在开始后紧接着关闭，既不会因关闭先于开始而一直发声，
+# 也不会在同一tick开始的同音高音符之后关闭而把那个音符截断
+_RANK_OFF = 0
+_RANK_ZERO = 1
+_RANK_ON = 2
+
+# 事件流：各字段均为等长数组，length 为每条消息的字节数（2 或 3）
+EventStream = namedtuple('EventStream', 'tick status data1 data2 length')
+
+
+def allocate_channels(programs):
+    """为每个音色分配独立的MIDI通道（跳过打击乐通道），音色超过15个时循环复用"""
+    usable = [channel for channel in range(16) if channel != DRUM_CHANNEL]
+    channels = {}
+    for program in programs:
+        if program not in channels:
+            channels[program] = usable[len(channels) % len(usable)]
+    return channels
+
+
+def channel_lookup(channels):
+    """把 音色→通道 映射转换为按音色下标的查找数组（未分配的音色为 -1）"""
+    lookup = np.full(128, -1, dtype=np.int16)
+    for program, channel in channels.items():
+        lookup[program] = channel
+    return lookup
+
+
+def assign_channels(notes, channels):
+    """按 音色→通道 映射批量设置音符表的通道列（没有音色的音符保持原通道）"""
+    instrument = notes.instrument
+    mapped = channel_lookup(channels)[np.clip(instrument, 0, 127)]
+    keep = (instrument == NO_INSTRUMENT) | (mapped < 0)
+    notes.set_column('channel', np.where(keep, notes.channel, mapped))
+
+
+def program_change_mask(notes, channel_programs=None):
+    """标记需要在音符前发送音色切换的音符（同一通道音色未变化时省略）
+
+    channel_programs 为可选的长度16数组，记录各通道当前的音色（-1 表示未知），
+    用于跨分块延续状态；调用后会被更新为各通道最后使用的音色。
+    """
+    instrument = notes.instrument
+    channel = notes.channel
+    mask = instrument != NO_INSTRUMENT
+    candidates = np.flatnonzero(mask)
+    if candidates.size == 0:
+        return mask
+    # 按通道分组（组内保持开始时间顺序），与同通道上一个带音色的音符比较
+    order = candidates[np.argsort(channel[candidates], kind='stable')]
+    grouped_channel = channel[order]
+    grouped_program = instrument[order]
+    same_channel = grouped_channel[1:] == grouped_channel[:-1]
+    same_program = grouped_program[1:] == grouped_program[:-1]
+    redundant = np.zeros(order.size, dtype=bool)
+    redundant[1:] = same_channel & same_program
+    if channel_programs is not None:
+        first = np.ones(order.size, dtype=bool)
+        first[1:] = ~same_channel
+        redundant[first] = channel_programs[grouped_channel[first]] == grouped_program[first]
+        last = np.ones(order.size, dtype=bool)
+        last[:-1] = ~same_channel
+        channel_programs[grouped_channel[last]] = grouped_program[last]
+    mask[order[redundant]] = False
+    return mask
+
+
+def pair_note_events(key, is_on, tick):
+    """按键（轨道、通道、音高）先进先出地配对开/关事件
+
+    返回 (开始事件下标, 结束事件下标)；没有对应开始的结束事件被丢弃，
+    没有结束的开始事件对应的结束下标为 -1。
+    """
+    count = key.shape[0]
+    order = np.lexsort((np.arange(count), tick, key))
+    key = key[order]
+    step = np.where(is_on[order], 1, -1)
+    group_start = np.ones(count, dtype=bool)
+    group_start[1:] = key[1:] != key[:-1]
+    group = np.cumsum(group_start) - 1
+    first = np.flatnonzero(group_start)
+    sizes = np.diff(np.append(first, count))
+
+    # 组内发声数量；多余的结束事件会让它低于0，减去组内前缀最小值即截断在0
+    depth = np.cumsum(step)
+    depth -= np.repeat(depth[first] - step[first], sizes)
+    shift = np.int64(count + 1)
+    floor = np.minimum.accumulate(depth - group * shift) + group * shift
+    clipped = depth - np.minimum(floor, 0)
+    previous = np.zeros(count, dtype=np.int64)
+    previous[1:] = clipped[:-1]
+    previous[group_start] = 0
+    valid_off = (step < 0) & (clipped < previous)
+
+    # 截断后每组中第 k 个结束事件总在第 k 个开始事件之后，二者配对
+    on = step > 0
+    on_group = group[on]
+    off_group = group[valid_off]
+    off_rank = np.arange(off_group.size) - np.searchsorted(off_group, off_group)
+    ends = np.full(on_group.size, -1, dtype=np.int64)
+    ends[np.searchsorted(on_group, off_group) + off_rank] = order[valid_off]
+    return order[on], ends
+
+
+def build_event_stream(notes, channel_programs=None):
+    """由音符表构建合并后的开/关事件流，按tick排序并正确处理同时发生的事件
+
+    同一tick开始的同音高音符中，时长为0的音符先开始并关闭，其余音符不会被它的关闭截断：
+
+    >>> from note_table import NoteTable
+    >>> notes = NoteTable.from_columns(note=60, velocity=100, start=[0, 0], end=[480, 0])
+    >>> stream = build_event_stream(notes)
+    >>> [(int(tick), hex(status)) for tick, status in zip(stream.tick, stream.status)]
+    [(0, '0x90'), (0, '0x80'), (0, '0x90'), (480, '0x80')]
+    """
+    count = len(notes)
+    pitch = notes.note.astype(np.uint8)
+    velocity = notes.velocity.astype(np.uint8)
+    channel = notes.channel.astype(np.uint8)
+    pc_mask = program_change_mask(notes, channel_programs)
+    pc_index = np.flatnonzero(pc_mask)
+    note_index = np.arange(count)
+
+    # 三类事件：音色切换、音符开始、音符结束
+    start = notes.start
+    end = np.maximum(notes.end, start)
+    zero_length = end == start
+    tick = np.concatenate([start[pc_index], start, end])
+    on_rank = np.where(zero_length, _RANK_ZERO, _RANK_ON)
+    rank = np.concatenate([on_rank[pc_index], on_rank, np.where(zero_length, _RANK_ZERO, _RANK_OFF)])
+    owner = np.concatenate([pc_index, note_index, note_index])
+    # 音色切换紧贴在对应音符开始之前，时长为0的音符的结束紧跟在它的开始之后
+    sub = np.concatenate([np.zeros(pc_index.size, dtype=np.int8), np.ones(count, dtype=np.int8),
+                          np.full(count, 2, dtype=np.int8)])
+    status = np.concatenate([PROGRAM_CHANGE | channel[pc_index], NOTE_ON | channel,
+                             NOTE_OFF | channel]).astype(np.uint8)
+    data1 = np.concatenate([notes.instrument[pc_index].astype(np.uint8), pitch, pitch])
+    data2 = np.concatenate([np.zeros(pc_index.size, dtype=np.uint8), velocity,
+                            np.zeros(count, dtype=np.uint8)])
+    length = np.concatenate([np.full(pc_index.size, 2, dtype=np.uint8),
+                             np.full(2 * count, 3, dtype=np.uint8)])
+
+    order = np.lexsort((sub, owner, rank, tick))
+    return EventStream(tick[order], status[order], data1[order], data2[order], length[order])
+
+
+def slice_stream(stream, lo, hi):
+    """截取事件流的下标区间"""
+    return EventStream(*(field[lo:hi] for field in stream))
+
+
+class ChunkedEventStream:
+    """把分块生成的音符表拼接成连续的事件流
+
+    每个分块的音符开始时间都不早于上一个分块给出的边界tick，
+    跨越边界的音符结束事件会暂存，并与后续分块的事件合并排序。
+    """
+
+    def __init__(self):
+        self.channel_programs = np.full(16, -1, dtype=np.int16)
+        self._pending = None  # 尚未到期的音符结束事件
+
+    def feed(self, notes, frontier):
+        """加入一个分块，返回所有不晚于 frontier 的事件（之后的分块不会早于 frontier）"""
+        stream = build_event_stream(notes, self.channel_programs)
+        if self._pending is not None and self._pending.tick.size:
+            pending = self._pending
+            merged = EventStream(*(np.concatenate([a, b]) for a, b in zip(pending, stream)))
+            # 稳定排序：同一tick先发出之前分块暂存的结束事件，分块内原有的先后顺序保持不变
+            source = np.concatenate([np.full(pending.tick.size, _RANK_OFF), np.full(stream.tick.size, _RANK_ON)])
+            order = np.lexsort((source, merged.tick))
+            stream = EventStream(*(field[order] for field in merged))
+        cut = int(np.searchsorted(stream.tick, frontier, side='right'))
+        self._pending = slice_stream(stream, cut, None)
+        return slice_stream(stream, 0, cut)
+
+    def finish(self):
+        """返回剩余的全部事件"""
+        pending = self._pending
+        self._pending = None
+        if pending is None:
+            return EventStream(*(np.empty(0, dtype=dtype) for dtype in
+                                 (np.int64, np.uint8, np.uint8, np.uint8, np.uint8)))
+        return pending
+
+
+def encode_events(stream, start_tick=0):
+    """把事件流编码为MTrk块的数据部分（不含结束标记），全部为向量化运算"""
+    if stream.tick.size == 0:
+        return b''
+    ticks = stream.tick.astype(np.int64)
+    delta = np.diff(ticks, prepend=np.int64(start_tick)).astype(np.uint32)
+
+    # 可变长度数值的字节数（1~4）
+    var_len = (1 + (delta >= 0x80).astype(np.int64) + (delta >= 0x4000)
+               + (delta >= 0x200000))
+    msg_len = stream.length.astype(np.int64)
+    offsets = np.concatenate([[0], np.cumsum(var_len + msg_len)])
+    out = np.zeros(int(offsets[-1]), dtype=np.uint8)
+    base = offsets[:-1]
+
+    for k in range(4):
+        sel = var_len > k
+        shift = 7 * (var_len[sel] - 1 - k)
+        byte = (delta[sel] >> shift.astype(np.uint32)) & 0x7F
+        byte |= np.where(k < var_len[sel] - 1, 0x80, 0).astype(np.uint32)
+        out[base[sel] + k] = byte
+
+    msg_base = base + var_len
+    out[msg_base] = stream.status
+    out[msg_base + 1] = stream.data1
+    three = msg_len == 3
+    out[msg_base[three] + 2] = stream.data2[three]
+    return out.tobytes()
+
+
+def encode_var_len(value):
+    """编码单个可变长度数值"""
+    data = [value & 0x7F]
+    value >>= 7
+    while value:
+        data.append((value & 0x7F) | 0x80)
+        value >>= 7
+    return bytes(reversed(data))
+
+
+def tempo_meta(bpm):
+    """速度元事件（增量时间为0）"""
+    microseconds = int(round(60000000 / bpm))
+    return b'\x00\xff\x51\x03' + microseconds.to_bytes(3, 'big')
+
+
+def time_signature_meta(numerator, denominator):
+    """拍号元事件（增量时间为0）"""
+    return b'\x00\xff\x58\x04' + bytes([numerator, denominator.bit_length() - 1, 24, 8])
+
+
+def track_name_meta(name):
+    """音轨名称元事件（增量时间为0）"""
+    data = name.encode('utf-8')
+    return b'\x00\xff\x03' + encode_var_len(len(data)) + data
+
+
+END_OF_TRACK = b'\x00\xff\x2f\x00'
+
+
+def track_chunk(data):
+    """把事件数据包装成MTrk块"""
+    return b'MTrk' + struct.pack('>I', len(data)) + data
+
+
+def header_chunk(file_type, track_count, ticks_per_beat):
+    """MThd文件头"""
+    return b'MThd' + struct.pack('>IHHH', 6, file_type, track_count, ticks_per_beat)
+
+
+class MidiFileData:
+    """已序列化的MIDI文件内容"""
+
+    def __init__(self, data):
+        self.data = data
+
+    def save(self, filename):
+        """写入文件"""
+        with open(filename, 'wb') as f:
+            f.write(self.data)
+
+
+class MidiStreamWriter:
+    """边生成边写出的单轨MIDI文件，内存占用与乐曲长度无关"""
+
+    def __init__(self, filename, tempo, time_signature, ticks_per_beat):
+        self._file = open(filename, 'wb')
+        self._file.write(header_chunk(0, 1, ticks_per_beat))
+        self._file.write(b'MTrk\x00\x00\x00\x00')  # 长度在关闭时回填
+        self._length_pos = self._file.tell() - 4
+        self._length = 0
+        self._last_tick = 0
+        self._events = ChunkedEventStream()
+        self._write(tempo_meta(tempo) + time_signature_meta(*time_signature))
+
+    def _write(self, data):
+        self._file.write(data)
+        self._length += len(data)
+
+    def _write_events(self, stream):
+        if stream.tick.size:
+            self._write(encode_events(stream, self._last_tick))
+            self._last_tick = int(stream.tick[-1])
+
+    def write_chunk(self, notes, frontier):
+        """写入一个分块，frontier 为之后分块音符开始时间的下界"""
+        self._write_events(self._events.feed(notes, frontier))
+
+    def close(self):
+        """写出剩余事件和结束标记，并回填音轨长度"""
+        if self._file.closed:
+            return
+        self._write_events(self._events.finish())
+        self._write(END_OF_TRACK)
+        self._file.seek(self._length_pos)
+        self._file.write(struct.pack('>I', self._length))
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def serialize_notes(notes, tempo, time_signature, ticks_per_beat, multitrack=False, track_names=None):
+    """把音符表直接序列化为MIDI文件
+
+    默认写出单轨（类型0）文件；multitrack 为真时写出类型1文件：
+    第一轨只含速度和拍号，之后每种乐器一轨，track_names 为 音色→轨道名 的映射。
+    """
+    conductor = tempo_meta(tempo) + time_signature_meta(*time_signature)
+    if not multitrack:
+        body = conductor + encode_events(build_event_stream(notes)) + END_OF_TRACK
+        return MidiFileData(header_chunk(0, 1, ticks_per_beat) + track_chunk(body))
+
+    chunks = [track_chunk(conductor + END_OF_TRACK)]
+    instrument = notes.instrument
+    # 按乐器首次出现的顺序分轨
+    programs, first = np.unique(instrument, return_index=True)
+    for program in programs[np.argsort(first)].tolist():
+        part = notes.take(np.flatnonzero(instrument == program))
+        name = (track_names or {}).get(program)
+        body = (track_name_meta(name) if name else b'') + encode_events(build_event_stream(part))
+        chunks.append(track_chunk(body + END_OF_TRACK))
+    return MidiFileData(header_chunk(1, len(chunks), ticks_per_beat) + b''.join(chunks))
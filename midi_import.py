@@ -0,0 +1,228 @@
+"""MIDI文件导入：直接解析字节，把各音轨的音符开/关配对后装入音符表"""
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+from midi_events import NOTE_OFF, NOTE_ON, PROGRAM_CHANGE, pair_note_events
+from note_table import NO_INSTRUMENT, NoteTable
+
+# 导入结果：音符表、速度（BPM）、拍号、原文件的每拍tick数、音轨数
+ImportedMidi = namedtuple('ImportedMidi', 'notes tempo time_signature ticks_per_beat track_count')
+
+# 每种状态字节之后的数据字节数（通道消息）
+_DATA_LENGTH = np.zeros(256, dtype=np.int32)
+_DATA_LENGTH[0x80:0xF0] = 2
+_DATA_LENGTH[0xC0:0xE0] = 1
+
+# 事件边界查找表中的“结束”位置
+_END = np.iinfo(np.int32).max
+META = 0xFF
+END_OF_TRACK_TYPE = 0x2F
+
+
+class MidiImportError(ValueError):
+    """文件不是有效的标准MIDI文件"""
+
+
+def _var_len(raw, pos):
+    """批量读取位于 pos 处的可变长度数值，返回 (数值, 字节数)"""
+    value = np.zeros(pos.shape, dtype=np.int64)
+    size = np.zeros(pos.shape, dtype=np.int64)
+    more = np.ones(pos.shape, dtype=bool)
+    for k in range(4):
+        byte = raw[pos + k].astype(np.int64)
+        value = np.where(more, (value << 7) | (byte & 0x7F), value)
+        size += more
+        more &= byte >= 0x80
+    return value, size
+
+
+def _next_event_table(raw, size):
+    """为每个字节位置计算“假设一个事件从这里开始”时下一个事件的位置
+
+    状态编号为 位置*2+c，c 表示当前的运行状态（running status）是否只带1个数据字节；
+    返回长度为 2*size 的 int32 数组，值为下一个事件的状态编号。
+    """
+    # 增量时间的字节数（最多4字节）
+    more = raw >= 0x80
+    first = more[:size]
+    second = first & more[1:size + 1]
+    third = second & more[2:size + 2]
+    status_pos = np.arange(1, size + 1, dtype=np.int32)
+    status_pos += first
+    status_pos += second
+    status_pos += third
+    status = raw[status_pos]
+
+    # 通道消息：显式状态字节决定数据长度，否则沿用运行状态
+    data_length = _DATA_LENGTH[status]
+    explicit_next = (status_pos + 1 + data_length) * 2 + (data_length == 1)
+    running = status < 0x80
+    table = np.empty((size, 2), dtype=np.int32)
+    table[:, 0] = np.where(running, (status_pos + 2) * 2, explicit_next)
+    table[:, 1] = np.where(running, (status_pos + 1) * 2 + 1, explicit_next)
+
+    # 元事件（FF 类型 长度 数据）和系统独占消息（F0/F7 长度 数据）只需处理少数位置
+    special = np.flatnonzero(status >= 0xF0)
+    special_pos = status_pos[special].astype(np.int64)
+    meta = status[special] == META
+    length_pos = special_pos + np.where(meta, 2, 1)
+    length, length_size = _var_len(raw, length_pos)
+    skip_next = np.minimum((length_pos + length_size + length) * 2, _END - 1)
+    table[special, 0] = skip_next
+    table[special, 1] = skip_next + 1
+    table[special[meta & (raw[special_pos + 1] == END_OF_TRACK_TYPE)]] = _END
+    return table.ravel()
+
+
+def _scan_track(table, start, end):
+    """沿事件边界表走完一个MTrk块，返回各事件的起始位置"""
+    table = memoryview(table)
+    limit = end * 2
+    state = start * 2
+    states = []
+    append = states.append
+    while state < limit:
+        append(state)
+        state = table[state]
+    return np.array(states, dtype=np.int64) >> 1
+
+
+def load_midi_bytes(data, ticks_per_beat, progress=None):
+    """解析标准MIDI文件的字节内容，音符时间换算为 ticks_per_beat 精度
+
+    文件损坏或格式不合法时抛出 MidiImportError。progress 为可选回调 progress(已完成比例)，
+    每扫描完一轨及每个批量处理阶段后调用一次；它抛出的异常会中止导入。
+    """
+    if data[:4] != b'MThd' or len(data) < 14:
+        raise MidiImportError("不是标准MIDI文件")
+    try:
+        return _parse_midi(data, ticks_per_beat, progress or (lambda fraction: None))
+    except MidiImportError:
+        raise
+    except (ArithmeticError, IndexError, ValueError, struct.error) as e:
+        raise MidiImportError(f"MIDI文件已损坏: {e}") from e
+
+
+def _parse_midi(data, ticks_per_beat, progress):
+    """load_midi_bytes 的解析过程（文件头的魔数和长度已检查）"""
+    header_length, file_type, track_count, division = struct.unpack('>IHHH', data[4:14])
+    if division & 0x8000:
+        raise MidiImportError("不支持SMPTE时间格式的MIDI文件")
+    if division == 0:
+        raise MidiImportError("MIDI文件的每拍tick数为0")
+
+    # 逐个找出MTrk块
+    chunks = []
+    pos = 8 + header_length
+    while pos + 8 <= len(data) and len(chunks) < track_count:
+        chunk_type = data[pos:pos + 4]
+        length = struct.unpack('>I', data[pos + 4:pos + 8])[0]
+        pos += 8
+        if chunk_type == b'MTrk':
+            chunks.append((pos, min(pos + length, len(data))))
+        pos += length
+
+    # 末尾补零，保证越界读取安全；事件边界只在Python中逐个跳转，其余均为批量运算
+    raw = np.zeros(len(data) + 16, dtype=np.uint8)
+    raw[:len(data)] = np.frombuffer(data, dtype=np.uint8)
+    table = _next_event_table(raw, len(data))
+    progress(0.1)
+    # 逐轨扫描是唯一的逐事件循环，占导入的大部分时间
+    starts = []
+    for start, end in chunks:
+        starts.append(_scan_track(table, start, end))
+        progress(0.1 + 0.6 * len(starts) / len(chunks))
+    event_pos = np.concatenate(starts) if starts else np.zeros(0, dtype=np.int64)
+
+    # 增量时间累加为各轨的绝对tick
+    delta, delta_size = _var_len(raw, event_pos)
+    tick = np.cumsum(delta)
+    sizes = np.array([part.size for part in starts], dtype=np.int64)
+    track_of = np.repeat(np.arange(len(starts)), sizes)
+    # 没有事件的音轨不占位置，只按有事件的音轨计算各轨起点
+    sizes = sizes[sizes > 0]
+    first = np.cumsum(sizes) - sizes
+    tick -= np.repeat(tick[first] - delta[first], sizes)
+    status_pos = event_pos + delta_size
+    status_byte = raw[status_pos]
+
+    # 速度和拍号元事件（数量很少，逐个读取）
+    meta = np.flatnonzero(status_byte == META)
+    tempos, signatures = [], []
+    for index in meta[np.isin(raw[status_pos[meta] + 1], (0x51, 0x58))].tolist():
+        at = int(status_pos[index])
+        if data[at + 1] == 0x51 and data[at + 2] == 3:
+            tempos.append((int(tick[index]), int.from_bytes(data[at + 3:at + 6], 'big')))
+        elif data[at + 1] == 0x58 and data[at + 2] >= 2:
+            signatures.append((int(tick[index]), data[at + 3], 1 << data[at + 4]))
+
+    # 运行状态：通道消息沿用本轨最近一个显式状态字节
+    explicit = (status_byte >= 0x80) & (status_byte < 0xF0)
+    channel_message = explicit | (status_byte < 0x80)
+    last = np.where(explicit, np.arange(event_pos.size), -1)
+    last = np.maximum.accumulate(last) if last.size else last
+    valid = channel_message & (last >= 0)
+    valid[valid] = track_of[last[valid]] == track_of[valid]
+    keep = np.flatnonzero(valid)
+    status = status_byte[last[keep]]
+    data_pos = status_pos[keep] + explicit[keep]
+    tick = tick[keep]
+    tracks = track_of[keep]
+    data1 = raw[data_pos]
+    data2 = raw[data_pos + 1]
+    kind = status & 0xF0
+    channel = (status & 0x0F).astype(np.int64)
+    wanted = (kind == NOTE_ON) | (kind == NOTE_OFF) | (kind == PROGRAM_CHANGE)
+    tick, tracks, data1, data2, kind, channel = (
+        column[wanted] for column in (tick, tracks, data1, data2, kind, channel))
+
+    progress(0.8)
+
+    # 音色切换：按 (通道, tick) 排序，供音符查找开始时所用的音色
+    program = kind == PROGRAM_CHANGE
+    program_key = channel[program] * (int(tick.max(initial=0)) + 1) + tick[program]
+    program_order = np.argsort(program_key, kind='stable')
+    program_key = program_key[program_order]
+    program_value = data1[program][program_order].astype(np.int16)
+
+    # 音符开/关：力度为0的开音符视为关
+    note = ~program
+    note_index = np.flatnonzero(note)
+    is_on = (kind[note] == NOTE_ON) & (data2[note] > 0)
+    key = (tracks[note] * 16 + channel[note]) * 128 + data1[note]
+    ons, ends = pair_note_events(key, is_on, tick[note])
+    ons = note_index[ons]
+    last_tick = int(tick.max(initial=0))
+    end_tick = np.where(ends >= 0, tick[note_index[np.maximum(ends, 0)]], last_tick)
+
+    lookup = channel[ons] * (last_tick + 1) + tick[ons]
+    found = np.searchsorted(program_key, lookup, side='right') - 1
+    has_program = found >= 0
+    has_program[has_program] = program_key[found[has_program]] // (last_tick + 1) == channel[ons][has_program]
+    instrument = np.full(ons.size, NO_INSTRUMENT, dtype=np.int16)
+    instrument[has_program] = program_value[found[has_program]]
+
+    def scale(ticks):
+        return (ticks * ticks_per_beat + division // 2) // division
+
+    start = scale(tick[ons])
+    notes = NoteTable.from_columns(note=data1[ons], velocity=data2[ons], start=start,
+                                   end=np.maximum(scale(end_tick), start + 1),
+                                   instrument=instrument, channel=channel[ons])
+
+    # 只取乐曲开头的速度和拍号
+    tempo = 120
+    if tempos:
+        tempo = round(60000000 / min(tempos, key=lambda item: item[0])[1])
+    time_signature = (4, 4)
+    if signatures:
+        time_signature = min(signatures, key=lambda item: item[0])[1:]
+    return ImportedMidi(notes, tempo, time_signature, division, len(starts))
+
+
+def load_midi(filename, ticks_per_beat, progress=None):
+    """读取MIDI文件，返回 ImportedMidi（progress 同 load_midi_bytes）"""
+    with open(filename, 'rb') as f:
+        return load_midi_bytes(f.read(), ticks_per_beat, progress)
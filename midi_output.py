@@ -0,0 +1,133 @@
+"""多端口MIDI输出：按通道把消息路由到不同端口，每个端口由独立的发送线程成批发送"""
+import queue
+import threading
+import time
+
+from instrumentation import instruments, MESSAGES, SEND
+
+CONTROL_CHANGE = 0xB0
+ALL_SOUND_OFF = 120
+ALL_NOTES_OFF = 123
+CHANNEL_COUNT = 16
+
+
+class MidiOutputError(OSError):
+    """端口发送失败（例如设备已断开），之后不再向该端口发送"""
+
+
+class PortSender:
+    """一个输出端口及其发送线程：同一时刻的消息作为一批入队，由线程连续发出"""
+
+    def __init__(self, midi_out, name):
+        self.midi_out = midi_out
+        self.name = name  # 端口名称（虚拟端口为 None）
+        self._queue = queue.SimpleQueue()
+        self.error = None  # 发送线程因异常退出时记录的 MidiOutputError
+        self._thread = threading.Thread(target=self._run, name=f"midi-send-{name}", daemon=True)
+        self._thread.start()
+
+    @property
+    def alive(self):
+        return self.error is None
+
+    def send_batch(self, messages):
+        """把一批消息入队；端口已发送失败时抛出记录的 MidiOutputError"""
+        if self.error is not None:
+            raise self.error
+        self._queue.put(messages)
+
+    def discard_pending(self):
+        """丢弃尚未发出的批次（停止播放时使用）"""
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def _run(self):
+        send = self.midi_out.send_message
+        clock = time.perf_counter
+        while True:
+            batch = self._queue.get()
+            if batch is None:
+                return
+            metric = instruments.metric(SEND)
+            started = clock()
+            try:
+                for message in batch:
+                    send(message)
+            except Exception as e:
+                # 记录错误并结束线程，下一次入队时交给调用方（播放线程）处理
+                self.error = MidiOutputError(f"MIDI端口 {self.name or '（虚拟端口）'} 发送失败: {e}")
+                self.error.__cause__ = e
+                self.discard_pending()
+                return
+            if metric is not None:
+                metric.add(clock() - started)
+                instruments.increment(MESSAGES, len(batch))
+
+    def close(self, timeout=1.0):
+        """发完已入队的消息后关闭端口"""
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self.midi_out.close_port()
+
+
+class OutputManager:
+    """管理一个或多个输出端口，按通道路由消息（未指定的通道发往第一个端口）"""
+
+    def __init__(self, outputs, channel_routes=None):
+        """outputs 为 [(rtmidi.MidiOut, 端口名称)]，channel_routes 为 {通道: 端口名称}"""
+        self.senders = [PortSender(midi_out, name) for midi_out, name in outputs]
+        index = {sender.name: i for i, sender in enumerate(self.senders)}
+        self.routes = [0] * CHANNEL_COUNT
+        for channel, name in (channel_routes or {}).items():
+            self.routes[channel] = index.get(name, 0)
+
+    @property
+    def port_names(self):
+        return [sender.name for sender in self.senders]
+
+    def dispatch(self, messages):
+        """把同一时刻的一组消息按端口分批，每个端口入队一次
+
+        目标端口已发送失败时抛出 MidiOutputError。
+        """
+        if not messages:
+            return
+        senders = self.senders
+        if len(senders) == 1:
+            senders[0].send_batch(messages)
+            return
+        routes = self.routes
+        batches = [[] for _ in senders]
+        for message in messages:
+            batches[routes[message[0] & 0x0F]].append(message)
+        for sender, batch in zip(senders, batches):
+            if batch:
+                sender.send_batch(batch)
+
+    def send_message(self, message):
+        """发送单条消息"""
+        self.dispatch([message])
+
+    def panic(self, channels):
+        """停止发声：丢弃未发出的消息，在各通道上发送“全部音符关闭”和“全部声音关闭”控制器
+
+        用于停止和出错后的清理，跳过已发送失败的端口而不抛出异常。
+        """
+        for sender in self.senders:
+            sender.discard_pending()
+        messages = []
+        for channel in sorted(set(channels)):
+            messages.append([CONTROL_CHANGE | channel, ALL_NOTES_OFF, 0])
+            messages.append([CONTROL_CHANGE | channel, ALL_SOUND_OFF, 0])
+        routes = self.routes
+        for i, sender in enumerate(self.senders):
+            batch = [message for message in messages if routes[message[0] & 0x0F] == i]
+            if batch and sender.alive:
+                sender.send_batch(batch)
+
+    def close(self):
+        for sender in self.senders:
+            sender.close()
@@ -0,0 +1,134 @@
+"""MIDI输出端口：在后台线程中查找并打开端口，记住上次使用的端口和路由供下次启动使用"""
+import json
+import os
+import threading
+
+from midi_output import OutputManager
+
+VIRTUAL_PORT_NAME = "MIDI作曲工具输出"
+# 记录所选端口和路由的配置文件
+SETTINGS_FILE = os.path.join(os.path.expanduser("~"), ".midi_composer.json")
+
+
+def load_settings(filename=SETTINGS_FILE):
+    """读取配置（文件不存在或已损坏时返回空字典）"""
+    try:
+        with open(filename, encoding="utf-8") as f:
+            settings = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return settings if isinstance(settings, dict) else {}
+
+
+def update_settings(changes, filename=SETTINGS_FILE):
+    """合并并保存配置项，内容未变时不写文件"""
+    settings = load_settings(filename)
+    if all(settings.get(key) == value for key, value in changes.items()):
+        return
+    settings.update(changes)
+    try:
+        with open(filename, "w", encoding="utf-8") as f:
+            json.dump(settings, f, ensure_ascii=False, indent=2)
+    except OSError:
+        pass
+
+
+def load_cached_port(filename=SETTINGS_FILE):
+    """读取上次使用的输出端口名称（没有记录时返回 None）"""
+    return load_settings(filename).get("output_port")
+
+
+def save_cached_port(name, filename=SETTINGS_FILE):
+    """记住本次使用的输出端口名称"""
+    update_settings({"output_port": name}, filename)
+
+
+def load_port_routes(filename=SETTINGS_FILE):
+    """读取乐器到输出端口的路由 {乐器名称: 端口名称}"""
+    routes = load_settings(filename).get("output_routes")
+    return routes if isinstance(routes, dict) else {}
+
+
+def save_port_routes(routes, filename=SETTINGS_FILE):
+    """记住乐器到输出端口的路由"""
+    update_settings({"output_routes": routes}, filename)
+
+
+def list_output_ports():
+    """当前可用的输出端口名称"""
+    import rtmidi
+    return rtmidi.MidiOut().get_ports()
+
+
+def open_outputs(preferred=None, extra=()):
+    """打开MIDI输出，返回 [(rtmidi.MidiOut, 端口名称)]，第一项为默认端口
+
+    默认端口优先使用名为 preferred 的端口，其次是第一个可用端口；extra 中存在的端口也一并打开。
+    没有设备时只创建一个虚拟端口（名称为 None）。
+    """
+    import rtmidi  # 首次打开端口时才加载
+    midi_out = rtmidi.MidiOut()
+    ports = midi_out.get_ports()
+    if not ports:
+        # 如果没有可用的MIDI设备，打开虚拟端口
+        midi_out.open_virtual_port(VIRTUAL_PORT_NAME)
+        print("已创建虚拟MIDI输出端口")
+        return [(midi_out, None)]
+
+    names = [preferred if preferred in ports else ports[0]]
+    names += [name for name in dict.fromkeys(extra) if name in ports and name not in names]
+    outputs = []
+    for name in names:
+        if outputs:
+            midi_out = rtmidi.MidiOut()
+        midi_out.open_port(ports.index(name))
+        print(f"已连接到MIDI输出设备: {name}")
+        outputs.append((midi_out, name))
+    return outputs
+
+
+class PortDiscovery:
+    """在后台线程中打开MIDI输出，启动时不必等待设备枚举
+
+    channel_routes 为 {通道: 端口名称}，结果是按此路由的 OutputManager。
+    previous 为要被取代的输出（OutputManager，或仍可能在查找中的 PortDiscovery），
+    在后台线程中等它就绪并关闭后再打开新端口，界面线程无需等待。
+    """
+
+    def __init__(self, preferred=None, channel_routes=None, settings_file=SETTINGS_FILE, previous=None):
+        self.preferred = preferred
+        self.channel_routes = dict(channel_routes or {})
+        self.settings_file = settings_file
+        self._previous = previous
+        self._done = threading.Event()
+        self._result = None
+        threading.Thread(target=self._discover, name="midi-ports", daemon=True).start()
+
+    def _discover(self):
+        try:
+            self._close_previous()
+            outputs = open_outputs(self.preferred, self.channel_routes.values())
+            self._result = OutputManager(outputs, self.channel_routes)
+            if outputs[0][1] is not None:
+                save_cached_port(outputs[0][1], self.settings_file)
+        except Exception as e:
+            print(f"MIDI初始化错误: {e}")
+        finally:
+            self._done.set()
+
+    def _close_previous(self):
+        # 先释放旧端口：同一端口不能被打开两次
+        previous, self._previous = self._previous, None
+        if isinstance(previous, PortDiscovery):
+            previous = previous.result()
+        if previous is not None:
+            previous.close()
+
+    @property
+    def ready(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """等待查找结束，返回 OutputManager（失败时为 None）"""
+        self._done.wait(timeout)
+        return self._result
@@ -0,0 +1,74 @@
+"""乐理查找表：每种音阶只构建一次的音级掩码、音阶内移调表、各级三和弦配置和音域对齐表
+
+生成器只对这些小数组做索引，不再逐个音符计算音阶关系。
+"""
+import numpy as np
+
+PITCH_COUNT = 128
+MAX_SHIFT = 14  # 音阶内移调表覆盖上下各两个八度（七声音阶）
+
+_tables = {}
+
+
+def _read_only(array):
+    array.flags.writeable = False
+    return array
+
+
+class ScaleTables:
+    """一种音阶的全部查找表（共享且只读，通过 scale_tables 取得）"""
+
+    def __init__(self, pitch_classes):
+        self.pitch_classes = _read_only(np.array(pitch_classes, dtype=np.int64))  # 第一个为主音
+        self.mask = np.zeros(12, dtype=bool)  # 音级掩码
+        self.mask[self.pitch_classes] = True
+        _read_only(self.mask)
+
+        # 音阶内的全部音高，以及任意音高对应的最近音阶音（距离相同时取较低的音）的序号
+        every = np.arange(PITCH_COUNT)
+        self.pitches = _read_only(every[self.mask[every % 12]])
+        nearest = np.argmin(np.abs(every[:, None] - self.pitches), axis=1)
+        self.snap = _read_only(self.pitches[nearest])
+
+        # 音阶级数（主音为0，不在音阶内的音按对齐后的音计）
+        degree_of = np.full(12, -1, dtype=np.int64)
+        degree_of[self.pitch_classes] = np.arange(self.pitch_classes.size)
+        self.degree = _read_only(degree_of[self.snap % 12])
+
+        # 音阶内移调：shift[音高, 级数 + MAX_SHIFT]，超出MIDI范围时停在两端
+        steps = np.arange(-MAX_SHIFT, MAX_SHIFT + 1)
+        self.shift = _read_only(self.pitches[np.clip(nearest[:, None] + steps, 0, self.pitches.size - 1)])
+
+        # 各级的三和弦（根音、三音、五音的音级）
+        size = self.pitch_classes.size
+        self.triads = _read_only(self.pitch_classes[(np.arange(size)[:, None] + [0, 2, 4]) % size])
+
+        # 和弦配置：旋律音作为所在三和弦（根音比它低四级）的五音，在其下方依次配低八度、根音、三音；
+        # 低于MIDI范围的音停在最低的音阶音
+        chord = self.triads[(self.degree - 4) % size]
+        fifth = self.snap[:, None]
+        below = fifth - (fifth - chord[:, :2]) % 12
+        self.voicing = _read_only(self.snap[np.maximum(np.column_stack([fifth - 12, below]), 0)])
+        self._clamps = {}
+
+    def transpose(self, pitch, steps):
+        """把音高（可为数组）在音阶内移动 steps 级（|steps| ≤ MAX_SHIFT）"""
+        return self.shift[pitch, np.asarray(steps) + MAX_SHIFT]
+
+    def clamp(self, low, high):
+        """128项查找表：把任意音高映射到 [low, high] 内最近的音阶音（距离相同时取较低的音）"""
+        table = self._clamps.get((low, high))
+        if table is None:
+            candidates = self.pitches[(self.pitches >= low) & (self.pitches <= high)]
+            nearest = np.argmin(np.abs(np.arange(PITCH_COUNT)[:, None] - candidates), axis=1)
+            table = self._clamps[(low, high)] = _read_only(candidates[nearest])
+        return table
+
+
+def scale_tables(pitch_classes):
+    """取得（并缓存）音阶的查找表，pitch_classes 为从主音开始的音级序列"""
+    key = tuple(pitch_classes)
+    tables = _tables.get(key)
+    if tables is None:
+        tables = _tables[key] = ScaleTables(key)
+    return tables
@@ -0,0 +1,293 @@
+import numpy as np
+
+# 音符表的列定义：全部使用固定宽度的小端类型
+NOTE_FIELDS = (
+    ('note', '<i2'),        # MIDI音高
+    ('velocity', '<u1'),    # 力度
+    ('start', '<i8'),       # 开始时间（tick）
+    ('end', '<i8'),         # 结束时间（tick）
+    ('instrument', '<i2'),  # 乐器音色，-1 表示不切换音色
+    ('channel', '<u1'),     # MIDI通道
+)
+NOTE_DTYPE = np.dtype(list(NOTE_FIELDS))
+COLUMN_NAMES = tuple(name for name, _ in NOTE_FIELDS)
+
+NO_INSTRUMENT = -1
+
+
+class NoteTable:
+    """按列存储音符的表格，始终按开始时间排序"""
+
+    def __init__(self, capacity=0):
+        self._columns = {name: np.empty(capacity, dtype=dtype) for name, dtype in NOTE_FIELDS}
+        self._size = 0
+        self._sorted = True
+        self.version = 0
+        self._cache = {}
+
+    @classmethod
+    def from_columns(cls, **columns):
+        """由各列数组直接构建音符表"""
+        table = cls()
+        table.extend(**columns)
+        return table
+
+    @classmethod
+    def from_sorted_arrays(cls, columns, cache=None):
+        """直接采用已按开始时间排序的各列数组而不复制（可以是 numpy.memmap）
+
+        cache 可预先提供聚合值（如 end_tick），避免为计算它们读取整列。
+        """
+        table = cls()
+        table._columns = {name: columns[name] for name in COLUMN_NAMES}
+        table._size = len(columns['start'])
+        table._cache.update(cache or {})
+        return table
+
+    def __len__(self):
+        return self._size
+
+    def __bool__(self):
+        return self._size > 0
+
+    def __getitem__(self, name):
+        return self.column(name)
+
+    def column(self, name):
+        """返回某一列（已按开始时间排序）的只读视图"""
+        self._ensure_sorted()
+        view = self._columns[name][:self._size]
+        view.flags.writeable = False
+        return view
+
+    @property
+    def note(self):
+        return self.column('note')
+
+    @property
+    def velocity(self):
+        return self.column('velocity')
+
+    @property
+    def start(self):
+        return self.column('start')
+
+    @property
+    def end(self):
+        return self.column('end')
+
+    @property
+    def instrument(self):
+        return self.column('instrument')
+
+    @property
+    def channel(self):
+        return self.column('channel')
+
+    def clear(self):
+        """清空所有音符"""
+        self._size = 0
+        self._sorted = True
+        self._touch()
+
+    def append(self, note, velocity, start, end, instrument=NO_INSTRUMENT, channel=0):
+        """追加单个音符"""
+        self._reserve(self._size + 1)
+        i = self._size
+        columns = self._columns
+        columns['note'][i] = note
+        columns['velocity'][i] = velocity
+        columns['start'][i] = start
+        columns['end'][i] = end
+        columns['instrument'][i] = instrument
+        columns['channel'][i] = channel
+        if i and start < columns['start'][i - 1]:
+            self._sorted = False
+        self._size = i + 1
+        self._touch()
+
+    def extend(self, note, velocity, start, end, instrument=NO_INSTRUMENT, channel=0):
+        """批量追加音符，参数可以是数组或标量"""
+        start = np.asarray(start, dtype=np.int64)
+        count = start.shape[0] if start.ndim else 1
+        if count == 0:
+            return
+        self._reserve(self._size + count)
+        lo, hi = self._size, self._size + count
+        values = {'note': note, 'velocity': velocity, 'start': start, 'end': end,
+                  'instrument': instrument, 'channel': channel}
+        for name, value in values.items():
+            self._columns[name][lo:hi] = value
+        new_start = self._columns['start'][lo:hi]
+        if (lo and new_start[0] < self._columns['start'][lo - 1]) or np.any(new_start[1:] < new_start[:-1]):
+            self._sorted = False
+        self._size = hi
+        self._touch()
+
+    def set_column(self, name, values):
+        """整体替换某一列的值（按当前排序顺序）"""
+        self._ensure_sorted()
+        self._columns[name][:self._size] = values
+        if name == 'start':
+            self._sorted = False
+        self._touch()
+
+    def concat(self, other):
+        """追加另一张音符表中的所有音符"""
+        self.extend(**other.columns())
+
+    def columns(self):
+        """以字典形式返回所有列"""
+        return {name: self.column(name) for name in COLUMN_NAMES}
+
+    def slice(self, lo, hi):
+        """按下标区间截取，返回新的音符表"""
+        self._ensure_sorted()
+        lo, hi, _ = slice(lo, hi).indices(self._size)
+        table = NoteTable()
+        table.extend(**{name: self._columns[name][lo:hi] for name in COLUMN_NAMES})
+        return table
+
+    def range_bounds(self, start_tick, end_tick):
+        """返回可能与 [start_tick, end_tick) 重叠的音符下标区间
+
+        音符按开始时间排序，结束时间的前缀最大值单调不减，两次二分查找即可定位（O(log n)）。
+        """
+        lo = np.searchsorted(self.end_index, start_tick, side='right')
+        hi = np.searchsorted(self.start, end_tick, side='left')
+        return int(lo), int(max(lo, hi))
+
+    def query_range(self, start_tick, end_tick):
+        """返回与 [start_tick, end_tick) 重叠的音符下标（升序）
+
+        按时值分层的区间索引中，每层只需在开始时间上二分查找，个别很长的音符不会拖慢查询。
+        """
+        parts = []
+        for max_duration, indices, starts in self.interval_index:
+            lo = np.searchsorted(starts, start_tick - max_duration, side='right')
+            hi = np.searchsorted(starts, end_tick, side='left')
+            if hi > lo:
+                parts.append(indices[lo:hi])
+        if not parts:
+            return np.zeros(0, dtype=np.int64)
+        candidates = np.concatenate(parts) if len(parts) > 1 else parts[0]
+        hits = candidates[self.end[candidates] > start_tick]
+        if len(parts) > 1:
+            hits.sort()
+        return hits
+
+    def iter_chunks(self, chunk_size, start_tick=None):
+        """按开始时间顺序分块，逐块产出 (音符表, 边界tick)，之后分块的音符不早于边界
+
+        指定 start_tick 时从该处开始：之前开始、此时仍在发声的音符改为从 start_tick 处开始。
+        """
+        self._ensure_sorted()
+        starts = self._columns['start']
+        first = 0
+        if start_tick is not None:
+            first = int(np.searchsorted(starts[:self._size], start_tick, side='left'))
+            sounding = self.query_range(start_tick, start_tick + 1)
+            sounding = sounding[sounding < first]
+            if sounding.size:
+                held = self.take(sounding)
+                held.set_column('start', np.full(len(held), start_tick))
+                yield held, start_tick - 1
+        for lo in range(first, self._size, chunk_size):
+            hi = min(lo + chunk_size, self._size)
+            frontier = int(starts[hi]) - 1 if hi < self._size else self.end_tick
+            yield self.slice(lo, hi), frontier
+
+    def take(self, indices):
+        """按下标数组挑选音符，返回新的音符表"""
+        self._ensure_sorted()
+        table = NoteTable()
+        table.extend(**{name: self._columns[name][:self._size][indices] for name in COLUMN_NAMES})
+        return table
+
+    def to_records(self):
+        """导出为结构化数组"""
+        records = np.empty(len(self), dtype=NOTE_DTYPE)
+        for name in COLUMN_NAMES:
+            records[name] = self.column(name)
+        return records
+
+    @property
+    def end_tick(self):
+        """乐曲结束的tick（所有音符结束时间的最大值）"""
+        return self._cached('end_tick', lambda: int(self.end.max()) if self._size else 0)
+
+    @property
+    def max_duration(self):
+        """最长音符的时值（tick）"""
+        return self._cached('max_duration', lambda: int((self.end - self.start).max()) if self._size else 0)
+
+    @property
+    def end_index(self):
+        """区间索引：按开始时间排序后结束时间的前缀最大值"""
+        return self._cached('end_index', lambda: np.maximum.accumulate(self.end) if self._size else self.end)
+
+    @property
+    def interval_index(self):
+        """按时值的2的幂分层的区间索引：[(该层最长时值, 音符下标, 开始时间), ...]"""
+        return self._cached('interval_index', self._build_interval_index)
+
+    @property
+    def typical_duration(self):
+        """典型音符时值（均匀抽样后的中位数，不必读取整列）"""
+        def compute():
+            if not self._size:
+                return 1
+            step = max(1, self._size // 4096)
+            return max(1, int(np.median(self.end[::step] - self.start[::step])))
+        return self._cached('typical_duration', compute)
+
+    @property
+    def note_range(self):
+        """返回 (最低音, 最高音)"""
+        return self._cached('note_range', lambda: (int(self.note.min()), int(self.note.max())) if self._size else (0, 0))
+
+    def build_indexes(self):
+        """预先计算绘制和区间查询用到的聚合值与索引（可在后台线程中调用，之后界面线程直接取缓存）"""
+        self._ensure_sorted()
+        for name in ('end_tick', 'max_duration', 'note_range', 'typical_duration', 'interval_index'):
+            getattr(self, name)
+
+    def _build_interval_index(self):
+        if not self._size:
+            return []
+        duration = np.maximum(self.end - self.start, 1)
+        tier = np.log2(duration).astype(np.uint8)
+        order = np.argsort(tier, kind='stable')  # 层内保持开始时间顺序
+        bounds = np.flatnonzero(np.diff(tier[order])) + 1
+        index = []
+        for indices in np.split(order, bounds):
+            index.append((int(duration[indices].max()), indices, self.start[indices]))
+        return index
+
+    def _cached(self, key, compute):
+        if key not in self._cache:
+            self._cache[key] = compute()
+        return self._cache[key]
+
+    def _touch(self):
+        self.version += 1
+        self._cache.clear()
+
+    def _reserve(self, size):
+        capacity = self._columns['start'].shape[0]
+        if size <= capacity:
+            return
+        new_capacity = max(size, capacity * 2, 64)
+        for name, dtype in NOTE_FIELDS:
+            grown = np.empty(new_capacity, dtype=dtype)
+            grown[:self._size] = self._columns[name][:self._size]
+            self._columns[name] = grown
+
+    def _ensure_sorted(self):
+        if self._sorted:
+            return
+        order = np.argsort(self._columns['start'][:self._size], kind='stable')
+        for name in COLUMN_NAMES:
+            column = self._columns[name]
+            column[:self._size] = column[:self._size][order]
+        self._sorted = True
@@ -0,0 +1,230 @@
+"""预编译的演奏缓冲区：把音符表编译成紧凑的原始MIDI字节和绝对时间戳"""
+import numpy as np
+
+from midi_events import (NOTE_OFF, NOTE_ON, PROGRAM_CHANGE, ChunkedEventStream, build_event_stream,
+                         pair_note_events)
+
+
+class CompiledPerformance:
+    """按时间排序的原始MIDI消息，所有消息首尾相连存放在一个字节串中"""
+
+    def __init__(self, ticks, times, buffer, offsets, stream=None, seconds_per_tick=None):
+        self.ticks = ticks  # 每条消息的tick
+        self.times = times  # 每条消息的绝对时间（秒）
+        self.buffer = buffer  # 全部消息字节
+        self.offsets = offsets  # 第 i 条消息位于 buffer[offsets[i]:offsets[i + 1]]
+        self.stream = stream  # 编译所用的事件流（定位时恢复状态用）
+        self.seconds_per_tick = seconds_per_tick
+        self._offset_list = None
+        self._state_index = None
+
+    def __len__(self):
+        return self.ticks.shape[0]
+
+    def index_at(self, tick):
+        """二分查找第一条不早于 tick 的消息"""
+        return int(np.searchsorted(self.ticks, tick, side='left'))
+
+    def time_at(self, tick):
+        """tick 对应的绝对时间（秒）"""
+        if len(self):
+            return float(self.times[0] + (tick - self.ticks[0]) * self.seconds_per_tick)
+        return tick * self.seconds_per_tick
+
+    def _build_state_index(self):
+        # 开音符与其对应关音符的消息下标（按开音符下标排序），以及各通道音色切换的位置
+        stream = self.stream
+        kind = stream.status & 0xF0
+        channel = (stream.status & 0x0F).astype(np.int64)
+        note = np.flatnonzero((kind == NOTE_ON) | (kind == NOTE_OFF))
+        is_on = (kind[note] == NOTE_ON) & (stream.data2[note] > 0)
+        ons, ends = pair_note_events(channel[note] * 128 + stream.data1[note], is_on, stream.tick[note])
+        on_index = note[ons]
+        off_index = np.where(ends >= 0, note[np.maximum(ends, 0)], len(self))
+        order = np.argsort(on_index, kind='stable')
+        on_index, off_index = on_index[order], off_index[order]
+        programs = np.flatnonzero(kind == PROGRAM_CHANGE)
+        self._state_index = (on_index, off_index, np.maximum.accumulate(off_index) if off_index.size else off_index,
+                             [programs[channel[programs] == c] for c in range(16)])
+
+    def active_notes(self, index):
+        """在第 index 条消息之前已开始、尚未结束的音符所对应的开音符下标"""
+        if self._state_index is None:
+            self._build_state_index()
+        on_index, off_index, off_prefix_max, _ = self._state_index
+        # 按开音符排序后，关音符下标的前缀最大值单调不减，两次二分查找即可圈定候选
+        lo = np.searchsorted(off_prefix_max, index, side='left')
+        hi = np.searchsorted(on_index, index, side='left')
+        candidates = np.arange(lo, max(lo, hi))
+        return on_index[candidates[off_index[candidates] >= index]]
+
+    def state_messages(self, index):
+        """从第 index 条消息开始播放前需要发送的消息：各通道当前音色和仍在发声的音符"""
+        if self._state_index is None:
+            self._build_state_index()
+        messages = []
+        for positions in self._state_index[3]:
+            before = int(np.searchsorted(positions, index)) - 1
+            if before >= 0:
+                messages += self.messages(int(positions[before]), int(positions[before]) + 1)
+        for i in self.active_notes(index).tolist():
+            messages += self.messages(i, i + 1)
+        return messages
+
+    def release_messages(self, index):
+        """在第 index 条消息处截断时，关闭仍在发声的音符的消息"""
+        stream = self.stream
+        active = self.active_notes(index)
+        status = NOTE_OFF | (stream.status[active] & 0x0F)
+        return [bytes((s, n, 0)) for s, n in zip(status.tolist(), stream.data1[active].tolist())]
+
+    def messages(self, lo, hi):
+        """返回下标区间 [lo, hi) 内的消息字节列表"""
+        if self._offset_list is None:
+            self._offset_list = self.offsets.tolist()
+        offsets = self._offset_list
+        buffer = self.buffer
+        return [buffer[offsets[i]:offsets[i + 1]] for i in range(lo, hi)]
+
+
+def compile_events(stream, tempo, ticks_per_beat, start_tick=0, start_time=0.0):
+    """把事件流编译为演奏缓冲区
+
+    事件时间以 start_tick 处对应 start_time 秒为基准换算，便于分段改变速度。
+    """
+    count = stream.tick.shape[0]
+    length = stream.length.astype(np.int64)
+    offsets = np.zeros(count + 1, dtype=np.int64)
+    np.cumsum(length, out=offsets[1:])
+
+    # 按消息长度把状态字节和数据字节散列到连续缓冲区中
+    packed = np.empty(int(offsets[-1]), dtype=np.uint8)
+    base = offsets[:-1]
+    packed[base] = stream.status
+    packed[base + 1] = stream.data1
+    three = length == 3
+    packed[base[three] + 2] = stream.data2[three]
+
+    seconds_per_tick = 60.0 / (tempo * ticks_per_beat)
+    ticks = stream.tick.astype(np.int64)
+    times = start_time + (ticks - start_tick) * seconds_per_tick
+    return CompiledPerformance(ticks, times, packed.tobytes(), offsets, stream, seconds_per_tick)
+
+
+def compile_performance(notes, tempo, ticks_per_beat):
+    """把音符表编译为演奏缓冲区（冗余的音色切换已在事件流中去除）"""
+    return compile_events(build_event_stream(notes), tempo, ticks_per_beat)
+
+
+def compile_chunks(chunks, tempo, ticks_per_beat, start_tick=0):
+    """把逐块生成的 (音符表, 边界tick) 依次编译为演奏缓冲区
+
+    跨越分块边界的音符关闭事件会顺延到后续缓冲区中，各缓冲区时间以 start_tick 处为0秒。
+    """
+    events = ChunkedEventStream()
+    for notes, frontier in chunks:
+        yield compile_events(events.feed(notes, frontier), tempo, ticks_per_beat, start_tick)
+    yield compile_events(events.finish(), tempo, ticks_per_beat, start_tick)
+
+
+class PlaybackSegment:
+    """一段待播放的消息：开头恢复状态的消息、缓冲区中 [lo, hi) 的消息、结尾关闭音符的消息
+
+    origin 为段起点在缓冲区时间轴上的时间，offset 为段起点在播放时间轴上的时间，
+    结尾消息排在段起点之后 length 秒处。
+    """
+
+    def __init__(self, performance, lo, hi, origin, offset, prefix=(), suffix=(), length=0.0):
+        self.performance = performance
+        self.lo = lo
+        self.prefix = list(prefix)
+        self.suffix = list(suffix)
+        self.times = np.concatenate([np.full(len(self.prefix), offset),
+                                     performance.times[lo:hi] - origin + offset,
+                                     np.full(len(self.suffix), offset + length)])
+        self._body_end = len(self.prefix) + (hi - lo)
+
+    def messages(self, lo, hi):
+        """返回本段下标区间 [lo, hi) 内的消息字节列表"""
+        head = len(self.prefix)
+        result = self.prefix[lo:min(hi, head)]
+        body_lo, body_hi = max(lo, head), min(hi, self._body_end)
+        if body_hi > body_lo:
+            result += self.performance.messages(self.lo + body_lo - head, self.lo + body_hi - head)
+        if hi > self._body_end:
+            result += self.suffix[max(lo, self._body_end) - self._body_end:hi - self._body_end]
+        return result
+
+
+class PlaybackPlan:
+    """从任意位置开始播放演奏缓冲区，可选 A–B 循环
+
+    起点由二分查找确定，并补发该处的音色与仍在发声的音符，无需从头重放；
+    循环的每一遍紧接上一遍排在同一时间轴上，回绕处不留空隙。
+    """
+
+    def __init__(self, performance, start_tick=0, loop=None):
+        self.performance = performance
+        self.start_tick = start_tick
+        self.loop = loop if loop and loop[1] > loop[0] else None
+        if self.loop and not self.loop[0] <= start_tick < self.loop[1]:
+            self.start_tick = self.loop[0]
+
+    def segments(self):
+        """依次产出 PlaybackSegment（循环时无限产出）"""
+        performance = self.performance
+        start = self.start_tick
+        lo = performance.index_at(start)
+        if self.loop is None:
+            yield PlaybackSegment(performance, lo, len(performance), performance.time_at(start), 0.0,
+                                  performance.state_messages(lo))
+            return
+
+        loop_start, loop_end = self.loop
+        loop_lo, loop_hi = performance.index_at(loop_start), performance.index_at(loop_end)
+        if loop_lo == loop_hi and not performance.active_notes(loop_lo).size:
+            return  # 循环区间内没有任何声音
+        release = performance.release_messages(loop_hi)
+        restore = performance.state_messages(lo)
+        loop_restore = performance.state_messages(loop_lo)
+        offset = 0.0
+        while True:
+            # 每一遍在B点关闭仍在发声的音符，下一遍紧接着从A点恢复状态
+            length = (loop_end - start) * performance.seconds_per_tick
+            yield PlaybackSegment(performance, lo, loop_hi, performance.time_at(start), offset,
+                                  restore, release, length)
+            offset += length
+            start, lo, restore = loop_start, loop_lo, loop_restore
+
+    def tick_at(self, elapsed):
+        """播放开始 elapsed 秒后所在的tick"""
+        ticks = elapsed / self.performance.seconds_per_tick
+        if self.loop is None or self.start_tick + ticks < self.loop[1]:
+            return self.start_tick + ticks
+        loop_start, loop_end = self.loop
+        return loop_start + (self.start_tick + ticks - loop_end) % (loop_end - loop_start)
+
+
+class PerformanceCache:
+    """缓存最近一次编译结果，仅在音符或速度变化时重新编译"""
+
+    def __init__(self, ticks_per_beat):
+        self.ticks_per_beat = ticks_per_beat
+        self._notes = None
+        self._key = None
+        self._performance = None
+
+    def get(self, notes, tempo):
+        """返回与当前音符表和速度对应的演奏缓冲区"""
+        key = (notes.version, tempo)
+        if notes is not self._notes or key != self._key:
+            self._performance = compile_performance(notes, tempo, self.ticks_per_beat)
+            self._notes = notes
+            self._key = key
+        return self._performance
+
+    def invalidate(self):
+        """丢弃缓存"""
+        self._notes = None
+        self._key = None
+        self._performance = None
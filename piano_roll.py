@@ -0,0 +1,355 @@
+"""增量式钢琴卷帘渲染：复用画布图元、缩放而非重建、只绘制可见区域"""
+import tkinter as tk
+
+import numpy as np
+
+# 细节层级：逐个音符绘制 / 密度热力图
+LOD_NOTES = "notes"
+LOD_HEATMAP = "heatmap"
+
+
+class PianoRoll:
+    """在可水平滚动和缩放的画布上显示音符表"""
+
+    MARGIN_X = 50
+    MARGIN_Y = 20
+    DEFAULT_VISIBLE_BARS = 32  # 初次显示时最多铺满的小节数
+    RESIZE_DELAY = 60  # 窗口尺寸变化后延迟重排的毫秒数
+    MAX_PIXELS_PER_TICK = 1.0
+    # 细节层级阈值，按典型音符（时值中位数）在屏幕上的像素宽度判断
+    HEATMAP_BELOW_PX = 1.0  # 低于该宽度时改为显示密度热力图
+    OUTLINE_FROM_PX = 4.0  # 达到该宽度才绘制音符边框
+    LABEL_FROM_PX = 24.0  # 达到该宽度才显示音名
+
+    def __init__(self, parent, ticks_per_bar, octave_range, note_name):
+        self.frame = tk.Frame(parent, bg="white")
+        self.frame.pack(fill=tk.BOTH, expand=True)
+        self.canvas = tk.Canvas(self.frame, bg="white", highlightthickness=1,
+                                highlightbackground="#cccccc")
+        self.xscroll = tk.Scrollbar(self.frame, orient=tk.HORIZONTAL, command=self._on_xscroll)
+        self.canvas.configure(xscrollcommand=self.xscroll.set)
+        self.xscroll.pack(side=tk.BOTTOM, fill=tk.X)
+        self.canvas.pack(fill=tk.BOTH, expand=True)
+
+        self.canvas.bind('<Configure>', self._on_configure)
+        self.canvas.bind('<MouseWheel>', self._on_wheel)
+        self.canvas.bind('<Control-MouseWheel>', self._on_zoom_wheel)
+        self.canvas.bind('<Button-4>', lambda e: self._scroll_units(-1))
+        self.canvas.bind('<Button-5>', lambda e: self._scroll_units(1))
+        self.canvas.bind('<Control-Button-4>', lambda e: self.zoom(1.25, e.x))
+        self.canvas.bind('<Control-Button-5>', lambda e: self.zoom(0.8, e.x))
+
+        self._init_state(ticks_per_bar, octave_range, note_name)
+
+    def _init_state(self, ticks_per_bar, octave_range, note_name):
+        """初始化与界面组件无关的显示状态（self.canvas 须已创建）"""
+        self.ticks_per_bar = ticks_per_bar
+        self.octave_range = octave_range
+        self.note_name = note_name
+        self.notes = None
+        self._resize_job = None
+        self._refresh_job = None
+        self._playhead = None
+        self._reset_items(0)
+
+    # ---- 坐标换算 ----
+
+    def tick_to_x(self, tick):
+        """tick 对应的画布（世界）横坐标"""
+        return self.MARGIN_X + tick * self._px_per_tick
+
+    def x_to_tick(self, x):
+        """画布（世界）横坐标对应的 tick"""
+        return (x - self.MARGIN_X) / self._px_per_tick
+
+    def note_to_y(self, note):
+        """音高对应的纵坐标"""
+        return self.MARGIN_Y + (self._max_note - note) * self._y_scale
+
+    def visible_ticks(self):
+        """当前视口覆盖的 tick 区间"""
+        left = self.canvas.canvasx(0)
+        right = left + self._view_width
+        return self.x_to_tick(left), self.x_to_tick(right)
+
+    @property
+    def view_height(self):
+        return self._view_height
+
+    # ---- 数据与布局 ----
+
+    def set_notes(self, notes):
+        """显示新的音符表（丢弃旧图元并按当前窗口尺寸重新布局）"""
+        self.canvas.delete("all")
+        self._playhead = None
+        self.notes = notes
+        self._reset_items(len(notes) if notes else 0)
+        if not notes:
+            return
+        self._layout()
+        self._update_scrollregion()
+        self.canvas.xview_moveto(0)
+        self.refresh()
+
+    def _reset_items(self, count):
+        # 每个音符的矩形和文字图元ID，0 表示尚未创建
+        self._rect_ids = np.zeros(count, dtype=np.int64)
+        self._text_ids = np.zeros(count, dtype=np.int64)
+        self._view_width = max(self.canvas.winfo_width(), 1)
+        self._view_height = max(self.canvas.winfo_height(), 1)
+        self._px_per_tick = 1.0
+        self._y_scale = 1.0
+        self._max_note = 0
+        self._note_height = 10
+        self._typical_duration = 1
+        self._lod = LOD_NOTES
+        self._labels_on = True
+        self._outlines_on = True
+        self._heatmap_photo = None
+
+    def _layout(self):
+        notes = self.notes
+        self._view_width = max(self.canvas.winfo_width(), 2 * self.MARGIN_X + 1)
+        self._view_height = max(self.canvas.winfo_height(), 2 * self.MARGIN_Y + 1)
+        min_note, self._max_note = notes.note_range
+        note_range = self._max_note - min_note + 1
+        shown = min(max(notes.end_tick, 1), self.DEFAULT_VISIBLE_BARS * self.ticks_per_bar)
+        self._px_per_tick = (self._view_width - 2 * self.MARGIN_X) / shown
+        self._y_scale = (self._view_height - 2 * self.MARGIN_Y) / note_range
+        self._note_height = 10
+        self._typical_duration = notes.typical_duration
+        self._lod = LOD_NOTES
+        self._labels_on = self._outlines_on = True
+        self._apply_detail_level()
+
+    def _content_width(self):
+        return 2 * self.MARGIN_X + self.notes.end_tick * self._px_per_tick
+
+    def _fit_px_per_tick(self):
+        return (self._view_width - 2 * self.MARGIN_X) / max(self.notes.end_tick, 1)
+
+    def _update_scrollregion(self):
+        width = max(self._content_width(), self._view_width)
+        self.canvas.configure(scrollregion=(0, 0, width, self._view_height))
+
+    # ---- 增量绘制 ----
+
+    def refresh(self):
+        """按当前细节层级补画视口内容并重绘刻度"""
+        self._refresh_job = None
+        if not self.notes:
+            return
+        start_tick, end_tick = self.visible_ticks()
+        self._apply_detail_level()
+        if self._lod == LOD_HEATMAP:
+            self._draw_heatmap(start_tick, end_tick)
+        else:
+            indices = self.notes.query_range(start_tick, end_tick)
+            self._create_items(indices[self._rect_ids[indices] == 0])
+            if self._labels_on:
+                self._create_labels(indices[self._text_ids[indices] == 0])
+        self._draw_grid(start_tick, end_tick)
+
+    def _apply_detail_level(self):
+        """根据缩放程度切换细节层级，只在跨越阈值时批量修改已有图元"""
+        note_px = self._typical_duration * self._px_per_tick
+        canvas = self.canvas
+        if note_px < self.HEATMAP_BELOW_PX:
+            if self._lod != LOD_HEATMAP:
+                self._lod = LOD_HEATMAP
+                canvas.itemconfigure("note", state="hidden")
+            return
+
+        restored = self._lod == LOD_HEATMAP
+        if restored:
+            self._lod = LOD_NOTES
+            canvas.delete("heatmap")
+            self._heatmap_photo = None
+            canvas.itemconfigure("rect", state="normal")
+        outlines_on = note_px >= self.OUTLINE_FROM_PX
+        if outlines_on != self._outlines_on:
+            self._outlines_on = outlines_on
+            canvas.itemconfigure("rect", outline="#000000" if outlines_on else "")
+        labels_on = note_px >= self.LABEL_FROM_PX
+        if restored or labels_on != self._labels_on:
+            self._labels_on = labels_on
+            canvas.itemconfigure("label", state="normal" if labels_on else "hidden")
+
+    def _create_items(self, indices):
+        if indices.size == 0:
+            return
+        notes = self.notes
+        canvas = self.canvas
+        x1s = self.tick_to_x(notes.start[indices])
+        x2s = self.tick_to_x(notes.end[indices])
+        ys = self.note_to_y(notes.note[indices])
+        intensities = (155 * (notes.velocity[indices] / 127)).astype(int) + 100
+        half = self._note_height / 2
+        outline = "#000000" if self._outlines_on else ""
+        rect_ids = []
+        for x1, x2, y, intensity in zip(x1s.tolist(), x2s.tolist(), ys.tolist(), intensities.tolist()):
+            # 根据音符力度调整颜色
+            color = f"#{intensity:02x}{intensity//2:02x}ff"
+            rect_ids.append(canvas.create_rectangle(x1, y - half, x2, y + half, fill=color,
+                                                    outline=outline, tags=("note", "rect")))
+        self._rect_ids[indices] = rect_ids
+
+    def _create_labels(self, indices):
+        if indices.size == 0:
+            return
+        notes = self.notes
+        canvas = self.canvas
+        xs = self.tick_to_x((notes.start[indices] + notes.end[indices]) / 2)
+        pitches = notes.note[indices]
+        ys = self.note_to_y(pitches)
+        text_ids = []
+        for x, y, pitch in zip(xs.tolist(), ys.tolist(), pitches.tolist()):
+            text_ids.append(canvas.create_text(x, y, text=self.note_name(pitch), fill="#000000",
+                                               font=("Arial", 8), tags=("note", "label")))
+        self._text_ids[indices] = text_ids
+
+    def _draw_heatmap(self, start_tick, end_tick):
+        """用 (tick, 音高) 二维直方图把视口内的音符画成一张图片"""
+        from PIL import Image, ImageTk  # 只有缩小到热力图时才需要，启动时不加载
+        canvas = self.canvas
+        canvas.delete("heatmap")
+        notes = self.notes
+        min_note, max_note = notes.note_range
+        # 左端不早于第0拍；列数与图片宽度都按实际覆盖的 tick 区间换算，与网格和音符对齐
+        start_tick = max(start_tick, 0)
+        if end_tick <= start_tick:
+            return
+        width = max(1, int(round((end_tick - start_tick) * self._px_per_tick)))
+        # 音符窄于一个像素，按开始时间落入的像素列统计即可
+        lo = np.searchsorted(notes.start, start_tick, side='left')
+        hi = np.searchsorted(notes.start, end_tick, side='left')
+        counts, _, _ = np.histogram2d(
+            notes.start[lo:hi], notes.note[lo:hi],
+            bins=(width, max_note - min_note + 1),
+            range=((start_tick, end_tick), (min_note - 0.5, max_note + 0.5)))
+        # 行方向：高音在上
+        density = counts.T[::-1]
+        level = np.log1p(density) / max(np.log1p(density.max()), 1e-9)
+        rgb = np.empty(density.shape + (3,), dtype=np.uint8)
+        rgb[..., 0] = 255 - (level * 200).astype(np.uint8)
+        rgb[..., 1] = 255 - (level * 230).astype(np.uint8)
+        rgb[..., 2] = 255
+        plot_height = max(1, int(round(self._y_scale * (max_note - min_note + 1))))
+        image = Image.fromarray(rgb, "RGB").resize((width, plot_height), Image.Resampling.NEAREST)
+        self._heatmap_photo = ImageTk.PhotoImage(image)
+        top = self.note_to_y(max_note) - self._y_scale / 2
+        canvas.create_image(self.tick_to_x(start_tick), top, image=self._heatmap_photo,
+                            anchor=tk.NW, tags=("heatmap",))
+
+    def _draw_grid(self, start_tick, end_tick):
+        """绘制视口内的小节线、小节号和左侧的八度标记"""
+        canvas = self.canvas
+        canvas.delete("grid")
+        top = self.MARGIN_Y
+        bottom = self._view_height - self.MARGIN_Y
+        bar_px = self.ticks_per_bar * self._px_per_tick
+        # 小节过密时只画每隔 step 小节的线
+        step = max(1, int(np.ceil(30 / bar_px))) if bar_px > 0 else 1
+        first = max(0, int(start_tick // self.ticks_per_bar))
+        first -= first % step
+        last = min(int(end_tick // self.ticks_per_bar) + 1, self.notes.end_tick // self.ticks_per_bar)
+        for bar in range(first, last + 1, step):
+            x = self.tick_to_x(bar * self.ticks_per_bar)
+            canvas.create_line(x, top, x, bottom, fill="#dddddd", tags=("grid",))
+            canvas.create_text(x, bottom + 10, text=f"{bar+1}", fill="#666666", tags=("grid",))
+        left = canvas.canvasx(0)
+        for octave in range(self.octave_range[0], self.octave_range[1] + 1):
+            y = self.note_to_y(60 + (octave - 3) * 12)
+            canvas.create_text(left + self.MARGIN_X - 20, y, text=f"C{octave}", fill="#666666",
+                               tags=("grid",))
+        canvas.tag_lower("grid")
+
+    def _schedule_refresh(self):
+        if self._refresh_job is None:
+            self._refresh_job = self.canvas.after_idle(self.refresh)
+
+    # ---- 播放指示器 ----
+
+    def show_playhead(self, tick, follow=True):
+        """把播放指示器移动到 tick 处（复用同一条线），follow 为真时自动翻页跟随"""
+        canvas = self.canvas
+        x = self.tick_to_x(tick)
+        top = self.MARGIN_Y
+        bottom = self._view_height - self.MARGIN_Y
+        if self._playhead is None:
+            self._playhead = canvas.create_line(x, top, x, bottom, fill="#ff0000", width=2,
+                                                dash=(4, 4), tags=("playhead",))
+        else:
+            canvas.coords(self._playhead, x, top, x, bottom)
+            canvas.itemconfigure(self._playhead, state="normal")
+        canvas.tag_raise(self._playhead)
+        if follow:
+            left = canvas.canvasx(0)
+            if x < left or x > left + self._view_width - self.MARGIN_X:
+                canvas.xview_moveto(max(0.0, x - self.MARGIN_X) / max(self._content_width(), self._view_width))
+                self._schedule_refresh()
+
+    def hide_playhead(self):
+        """隐藏播放指示器"""
+        if self._playhead is not None:
+            self.canvas.itemconfigure(self._playhead, state="hidden")
+
+    # ---- 尺寸变化、滚动与缩放 ----
+
+    def _on_configure(self, event):
+        # 拖动窗口时会连续触发，延迟到尺寸稳定后再重排
+        if self._resize_job is not None:
+            self.canvas.after_cancel(self._resize_job)
+        self._resize_job = self.canvas.after(self.RESIZE_DELAY, self._apply_resize)
+
+    def _apply_resize(self):
+        self._resize_job = None
+        width = max(self.canvas.winfo_width(), 2 * self.MARGIN_X + 1)
+        height = max(self.canvas.winfo_height(), 2 * self.MARGIN_Y + 1)
+        if not self.notes:
+            self._view_width, self._view_height = width, height
+            return
+        if (width, height) == (self._view_width, self._view_height):
+            return
+        sx = (width - 2 * self.MARGIN_X) / (self._view_width - 2 * self.MARGIN_X)
+        sy = (height - 2 * self.MARGIN_Y) / (self._view_height - 2 * self.MARGIN_Y)
+        # 已有图元整体缩放，无需重建
+        self.canvas.scale("note", self.MARGIN_X, self.MARGIN_Y, sx, sy)
+        self._px_per_tick *= sx
+        self._y_scale *= sy
+        self._note_height *= sy
+        self._view_width, self._view_height = width, height
+        self._update_scrollregion()
+        self.refresh()
+
+    def _on_xscroll(self, *args):
+        self.canvas.xview(*args)
+        self._schedule_refresh()
+
+    def _scroll_units(self, units):
+        self.canvas.xview_scroll(units, "units")
+        self._schedule_refresh()
+
+    def _on_wheel(self, event):
+        self._scroll_units(-1 if event.delta > 0 else 1)
+
+    def _on_zoom_wheel(self, event):
+        self.zoom(1.25 if event.delta > 0 else 0.8, event.x)
+
+    def zoom(self, factor, anchor=None):
+        """以视口内横坐标 anchor 为中心水平缩放"""
+        if not self.notes:
+            return
+        if anchor is None:
+            anchor = self._view_width / 2
+        new_px = min(max(self._px_per_tick * factor, self._fit_px_per_tick()), self.MAX_PIXELS_PER_TICK)
+        factor = new_px / self._px_per_tick
+        if factor == 1:
+            return
+        anchor_tick = self.x_to_tick(self.canvas.canvasx(anchor))
+        self.canvas.scale("note", self.MARGIN_X, 0, factor, 1)
+        self._px_per_tick = new_px
+        self._update_scrollregion()
+        left = self.tick_to_x(anchor_tick) - anchor
+        self.canvas.xview_moveto(max(0.0, left) / max(self._content_width(), self._view_width))
+        self.refresh()
@@ -0,0 +1,110 @@
+"""基于绝对单调时钟的高精度播放调度器"""
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+# 延迟统计样本的环形缓冲区容量（流式播放时只保留最近的样本）
+LATENESS_SAMPLES = 1 << 16
+
+# 延迟统计（单位：秒）：事件组数、平均延迟、最大延迟、99分位延迟、抖动（标准差）
+TimingStats = namedtuple('TimingStats', 'count mean_lateness max_lateness p99_lateness jitter')
+
+
+class PlaybackScheduler:
+    """按绝对时间点派发事件：先休眠、临近目标时忙等，同一时刻的事件合并为一次唤醒"""
+
+    def __init__(self, spin_threshold=0.002, max_sleep=0.05, clock=time.perf_counter,
+                 max_samples=LATENESS_SAMPLES, probe=None):
+        self.spin_threshold = spin_threshold  # 距目标不足该时长时改为忙等
+        self.max_sleep = max_sleep  # 单次休眠上限，保证能及时响应停止
+        self.clock = clock
+        self.probe = probe  # 可选的性能监测指标，每组事件的延迟同时记入其中
+        self._stop = threading.Event()
+        self._origin = None
+        self._lateness = np.empty(max_samples)
+        self._lateness_count = 0
+
+    def stop(self):
+        """请求停止当前播放（在播放开始之前调用同样有效）"""
+        self._stop.set()
+
+    @property
+    def stopped(self):
+        return self._stop.is_set()
+
+    def elapsed(self):
+        """距播放开始经过的秒数（未开始时为0）"""
+        if self._origin is None:
+            return 0.0
+        return max(0.0, self.clock() - self._origin)
+
+    def wait_until(self, target):
+        """等待到绝对时间点 target，返回是否未被停止"""
+        clock = self.clock
+        while True:
+            remaining = target - clock()
+            if remaining <= self.spin_threshold:
+                break
+            if self._stop.wait(min(remaining - self.spin_threshold, self.max_sleep)):
+                return False
+        while clock() < target:
+            pass
+        return not self._stop.is_set()
+
+    def run(self, event_times, dispatch, lead=0.05):
+        """按时间播放事件
+
+        event_times 为已排序的事件时间（秒，相对于乐曲开头）；
+        dispatch(lo, hi) 负责发送下标区间 [lo, hi) 内同一时刻的全部事件。
+        返回是否完整播放（未被停止）。
+        """
+        return self.run_stream([(event_times, dispatch)], lead)
+
+    def run_stream(self, chunks, lead=0.05):
+        """按时间播放逐块到达的事件
+
+        chunks 依次产出 (event_times, dispatch)，各块时间共用同一个起点且前后衔接，
+        可以是边生成边产出的迭代器：取下一块时的等待不会推迟时钟原点。
+        返回是否完整播放（未被停止）。每个调度器只用于一次播放：开始前已请求停止时立即返回。
+        """
+        self._lateness_count = 0
+        self._origin = None
+        clock = self.clock
+        samples = self._lateness
+        capacity = samples.size
+        probe = self.probe
+        count = 0
+        for event_times, dispatch in chunks:
+            if self._stop.is_set():
+                return False
+            event_times = np.asarray(event_times, dtype=np.float64)
+            if event_times.size == 0:
+                continue
+            if self._origin is None:
+                self._origin = clock() + lead
+            origin = self._origin
+
+            # 同一时刻的事件归为一组
+            bounds = np.concatenate([[0], np.flatnonzero(np.diff(event_times)) + 1, [event_times.size]])
+            targets = (origin + event_times[bounds[:-1]]).tolist()
+            for target, lo, hi in zip(targets, bounds[:-1].tolist(), bounds[1:].tolist()):
+                if not self.wait_until(target):
+                    return False
+                lateness = clock() - target
+                samples[count % capacity] = lateness
+                if probe is not None:
+                    probe.add(lateness)
+                count += 1
+                self._lateness_count = count
+                dispatch(lo, hi)
+        return not self._stop.is_set()
+
+    def stats(self):
+        """返回最近一次播放的延迟与抖动统计"""
+        samples = self._lateness[:min(self._lateness_count, self._lateness.size)]
+        if samples.size == 0:
+            return TimingStats(0, 0.0, 0.0, 0.0, 0.0)
+        return TimingStats(int(samples.size), float(samples.mean()), float(samples.max()),
+                           float(np.percentile(samples, 99)), float(samples.std()))
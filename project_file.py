@@ -0,0 +1,122 @@
+"""工程文件：文件头 + 按列存放的定宽小端数组，可直接用 numpy.memmap 按需映射"""
+import json
+import os
+from collections import namedtuple
+
+import numpy as np
+
+from note_table import COLUMN_NAMES, NOTE_FIELDS, NoteTable
+
+MAGIC = b'MIDIPRJ1'
+FORMAT_VERSION = 1
+HEADER_SIZE = 4096  # 文件头（魔数 + JSON元数据，空格补齐）固定占一页
+ALIGNMENT = 64  # 每列数据的起始偏移按此对齐
+
+# 区间索引的两列：各层音符的下标与开始时间
+INDEX_FIELDS = (('index_order', '<i8'), ('index_start', '<i8'))
+
+# 打开工程的结果：音符表、速度、拍号、每拍tick数、音阶、生成模式、随机种子
+Project = namedtuple('Project', 'notes tempo time_signature ticks_per_beat scale mode seed')
+
+
+class ProjectFormatError(ValueError):
+    """文件不是有效的工程文件"""
+
+
+def _aligned(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def save_project(filename, notes, tempo, time_signature, ticks_per_beat, scale=None, mode=None, seed=None,
+                 progress=None):
+    """把音符表和乐曲参数保存为工程文件
+
+    progress 为可选回调 progress(已完成比例)，每写完一列调用一次；它抛出的异常会中止保存，
+    原有文件保持不变。
+    """
+    count = len(notes)
+    tiers = notes.interval_index
+    arrays = [(name, dtype, notes.column(name)) for name, dtype in NOTE_FIELDS]
+    if tiers:
+        arrays.append(('index_order', '<i8', np.concatenate([indices for _, indices, _ in tiers])))
+        arrays.append(('index_start', '<i8', np.concatenate([starts for _, _, starts in tiers])))
+    else:
+        arrays += [(name, dtype, np.zeros(0, dtype=dtype)) for name, dtype in INDEX_FIELDS]
+
+    columns = {}
+    offset = HEADER_SIZE
+    for name, dtype, _ in arrays:
+        columns[name] = {'dtype': dtype, 'offset': offset}
+        offset = _aligned(offset + count * np.dtype(dtype).itemsize)
+
+    bounds = np.cumsum([0] + [indices.size for _, indices, _ in tiers]).tolist()
+    meta = {
+        'version': FORMAT_VERSION,
+        'count': count,
+        'tempo': tempo,
+        'time_signature': list(time_signature),
+        'ticks_per_beat': ticks_per_beat,
+        'scale': scale,
+        'mode': mode,
+        'seed': seed,
+        # 预先计算的聚合值，打开时无需读取整列
+        'end_tick': notes.end_tick,
+        'max_duration': notes.max_duration,
+        'note_range': list(notes.note_range),
+        'typical_duration': notes.typical_duration,
+        'index': [[max_duration, lo, hi] for (max_duration, _, _), lo, hi in zip(tiers, bounds, bounds[1:])],
+        'columns': columns,
+    }
+    header = MAGIC + json.dumps(meta, ensure_ascii=False).encode('utf-8')
+    if len(header) > HEADER_SIZE:
+        raise ProjectFormatError("工程文件头过长")
+
+    # 先写入同目录下的临时文件再替换：音符表可能正映射着目标文件本身，直接截断会让读取它的列时崩溃
+    temp_name = filename + '.tmp'
+    try:
+        with open(temp_name, 'wb') as f:
+            f.write(header.ljust(HEADER_SIZE, b' '))
+            for done, (name, dtype, values) in enumerate(arrays, 1):
+                f.seek(columns[name]['offset'])
+                f.write(np.ascontiguousarray(values, dtype=dtype).tobytes())
+                if progress is not None:
+                    progress(done / len(arrays))
+            f.truncate(offset)
+        os.replace(temp_name, filename)
+    except BaseException:
+        os.remove(temp_name)
+        raise
+
+
+def open_project(filename):
+    """打开工程文件：各列以写时复制方式映射，只有实际访问到的部分才会从磁盘读入"""
+    with open(filename, 'rb') as f:
+        header = f.read(HEADER_SIZE)
+    if not header.startswith(MAGIC):
+        raise ProjectFormatError("不是工程文件")
+    try:
+        meta = json.loads(header[len(MAGIC):].decode('utf-8'))
+    except ValueError:
+        raise ProjectFormatError("工程文件头已损坏")
+    if meta.get('version') != FORMAT_VERSION:
+        raise ProjectFormatError(f"不支持的工程文件版本: {meta.get('version')}")
+
+    count = meta['count']
+    if count:
+        columns = {name: np.memmap(filename, dtype=spec['dtype'], mode='c', offset=spec['offset'],
+                                   shape=(count,))
+                   for name, spec in meta['columns'].items()}
+        index_order, index_start = columns['index_order'], columns['index_start']
+        cache = {
+            'end_tick': meta['end_tick'],
+            'max_duration': meta['max_duration'],
+            'note_range': tuple(meta['note_range']),
+            'typical_duration': meta['typical_duration'],
+            'interval_index': [(max_duration, index_order[lo:hi], index_start[lo:hi])
+                               for max_duration, lo, hi in meta['index']],
+        }
+        notes = NoteTable.from_sorted_arrays({name: columns[name] for name in COLUMN_NAMES}, cache)
+    else:
+        notes = NoteTable()
+    return Project(notes, meta['tempo'], tuple(meta['time_signature']), meta['ticks_per_beat'],
+                   meta.get('scale'), meta.get('mode'), meta.get('seed'))
@@ -0,0 +1,133 @@
+"""无界面的批量渲染命令行工具：直接把生成的乐曲写成 .mid 文件"""
+import argparse
+import csv
+import os
+import sys
+
+from audio_render import SAMPLE_RATE
+from batch_render import iter_jobs, new_master_seed, render_batch
+from composer_engine import SCALE_MAP, MODE_CORPUS, MODE_RACHMANINOFF, MODE_RANDOM
+
+# 命令行中可使用的模式别名
+MODE_ALIASES = {
+    "rachmaninoff": MODE_RACHMANINOFF,
+    "random": MODE_RANDOM,
+    "corpus": MODE_CORPUS,
+    MODE_RACHMANINOFF: MODE_RACHMANINOFF,
+    MODE_RANDOM: MODE_RANDOM,
+    MODE_CORPUS: MODE_CORPUS,
+}
+ALL = "all"
+
+
+def build_parser():
+    """创建命令行参数解析器"""
+    parser = argparse.ArgumentParser(description="无界面批量生成MIDI文件")
+    parser.add_argument("-n", "--count", type=int, default=1,
+                        help="每种 模式×音阶 组合生成的乐曲数量")
+    parser.add_argument("--tempo", type=int, default=120, help="速度 (BPM)")
+    parser.add_argument("--bars", type=int, default=4, help="小节数")
+    parser.add_argument("--scale", default="C大调", choices=list(SCALE_MAP.keys()) + [ALL],
+                        help="音阶，all 表示所有音阶")
+    parser.add_argument("--mode", default="rachmaninoff", choices=list(MODE_ALIASES.keys()) + [ALL],
+                        help="生成模式，all 表示所有模式（指定 --model 时才包括语料模式）")
+    parser.add_argument("--model", default=None,
+                        help="语料模式使用的模型文件（由 markov_model.py 训练）")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="主随机种子，每首乐曲的种子由它派生；省略则随机选取并打印")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="并行进程数，0 表示使用全部CPU核心")
+    parser.add_argument("--multitrack", action="store_true",
+                        help="写出每种乐器一轨的类型1 MIDI文件")
+    parser.add_argument("--chunk-bars", type=int, default=None,
+                        help="按该小节数分块流式生成并增量写出，适合超长乐曲（不能与 --multitrack 同用）")
+    parser.add_argument("--wav", action="store_true",
+                        help="同时为每首乐曲渲染同名的 .wav 音频预览（不能与 --chunk-bars 同用）")
+    parser.add_argument("--sample-rate", type=int, default=SAMPLE_RATE, help="音频预览的采样率")
+    parser.add_argument("--index", default=None,
+                        help="去重索引文件（SQLite），跳过与其中已有乐曲重复的乐曲并登记新乐曲（不能与 --chunk-bars 同用）")
+    parser.add_argument("--dedup", default="exact", choices=["exact", "shape"],
+                        help="去重方式：exact 内容完全相同；shape 移调或整体快慢不同也算重复")
+    parser.add_argument("-o", "--output-dir", default=".", help="输出目录")
+    parser.add_argument("--prefix", default="piece", help="输出文件名前缀")
+    parser.add_argument("--manifest", default="manifest.csv",
+                        help="输出目录中记录每个文件参数的清单文件名，留空则不写")
+    return parser
+
+
+def print_progress(done, total, elapsed):
+    """在标准错误输出上显示进度"""
+    step = max(1, total // 100)
+    if done % step and done != total:
+        return
+    rate = done / elapsed if elapsed > 0 else 0.0
+    print(f"\r已完成 {done}/{total} ({done * 100 // total}%)，{rate:.1f} 首/秒",
+          end="\n" if done == total else "", file=sys.stderr, flush=True)
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.count < 1 or args.bars < 1 or args.jobs < 0:
+        print("乐曲数量和小节数必须为正整数，进程数不能为负", file=sys.stderr)
+        return 2
+    if args.chunk_bars is not None and (args.chunk_bars < 1 or args.multitrack):
+        print("分块小节数必须为正整数，且不能与 --multitrack 同时使用", file=sys.stderr)
+        return 2
+    if args.wav and (args.chunk_bars is not None or args.sample_rate < 1):
+        print("音频预览不能与 --chunk-bars 同时使用，采样率必须为正整数", file=sys.stderr)
+        return 2
+    if args.index and args.chunk_bars is not None:
+        print("去重索引不能与 --chunk-bars 同时使用", file=sys.stderr)
+        return 2
+
+    modes = [MODE_RACHMANINOFF, MODE_RANDOM] if args.mode == ALL else [MODE_ALIASES[args.mode]]
+    if args.mode == ALL and args.model:
+        modes.append(MODE_CORPUS)
+    if MODE_CORPUS in modes and not (args.model and os.path.isfile(args.model)):
+        print("语料模式需要用 --model 指定已训练的模型文件", file=sys.stderr)
+        return 2
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    scales = list(SCALE_MAP.keys()) if args.scale == ALL else [args.scale]
+    master_seed = new_master_seed() if args.seed is None else args.seed
+    print(f"主随机种子: {master_seed}", file=sys.stderr)
+
+    jobs = iter_jobs(args.output_dir, modes, scales, args.count, args.bars, args.tempo,
+                     master_seed, args.prefix, args.multitrack, args.chunk_bars, args.wav,
+                     args.sample_rate, args.model, args.index, args.dedup)
+    total = len(modes) * len(scales) * args.count
+    # 任务参数按序号记录，清单按完成顺序流式写出
+    params = {}
+
+    def remember(job_iter):
+        for job in job_iter:
+            params[job.index] = job
+            yield job
+
+    duplicates = 0
+    manifest = None
+    if args.manifest:
+        manifest = open(os.path.join(args.output_dir, args.manifest), "w", newline="", encoding="utf-8")
+    try:
+        writer = csv.writer(manifest) if manifest else None
+        if writer:
+            writer.writerow(["index", "filename", "mode", "scale", "bars", "tempo", "seed", "notes", "audio"])
+        for result in render_batch(remember(jobs), total, args.jobs or None, print_progress):
+            job = params.pop(result.index)
+            if result.duplicate:
+                duplicates += 1
+                continue
+            if writer:
+                writer.writerow([job.index, os.path.basename(job.filename), job.mode, job.scale,
+                                 job.bars, job.tempo, job.seed, result.note_count,
+                                 os.path.basename(job.wav_filename) if job.wav_filename else ""])
+    finally:
+        if manifest:
+            manifest.close()
+    if args.index:
+        print(f"跳过重复的乐曲 {duplicates} 首", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+"""后台预取：在独立线程中提前生成数据，经有界队列交给消费者"""
+import queue
+import threading
+
+
+class End:
+    """后台迭代结束的标记，携带可能发生的异常"""
+
+    def __init__(self, error=None):
+        self.error = error
+
+
+def put_until_stopped(items, item, stopped, poll=0.1):
+    """把 item 放入有界队列 items；队列已满时阻塞（背压），每 poll 秒检查一次 stopped
+
+    stopped 为 threading.Event，放入成功返回 True，在放入前被停止则返回 False，
+    避免生产线程在消费者已退出后永久阻塞。
+    """
+    while not stopped.is_set():
+        try:
+            items.put(item, timeout=poll)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+class Prefetcher:
+    """在后台线程中迭代 source，最多提前缓存 depth 项
+
+    消费者直接迭代本对象；close() 可提前结束后台线程。
+    后台迭代中抛出的异常会在消费者一侧重新抛出。
+    """
+
+    def __init__(self, source, depth=4):
+        self._queue = queue.Queue(maxsize=max(1, depth))
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._produce, args=(source,), daemon=True)
+        self._thread.start()
+
+    def _put(self, item):
+        return put_until_stopped(self._queue, item, self._closed)
+
+    def _produce(self, source):
+        try:
+            for item in source:
+                if not self._put(item):
+                    return
+        except BaseException as error:  # 交给消费者处理
+            self._put(End(error))
+            return
+        self._put(End())
+
+    def __iter__(self):
+        while True:
+            item = self._queue.get()
+            if isinstance(item, End):
+                if item.error is not None:
+                    raise item.error
+                return
+            yield item
+
+    def close(self):
+        """停止后台线程并丢弃已缓存的数据"""
+        self._closed.set()
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def prefetch(source, depth=4):
+    """在后台线程中预取 source 的元素"""
+    return Prefetcher(source, depth)
@@ -0,0 +1,113 @@
+"""后台任务：耗时操作在工作线程中执行，进度和结果经线程安全队列交回界面线程
+
+工作线程不直接操作Tk组件，只把回调放入队列；界面线程用 after 定时取出执行。
+"""
+import queue
+import threading
+import time
+
+
+class TaskCancelled(Exception):
+    """任务已被取消"""
+
+
+class Task:
+    """后台任务的句柄：工作函数用它报告进度和检查是否已取消，界面线程可随时取消"""
+
+    PROGRESS_INTERVAL = 0.05  # 两次进度回报之间的最短间隔（秒），避免淹没界面线程
+
+    def __init__(self, runner, name, on_progress=None):
+        self.name = name
+        self._runner = runner
+        self._on_progress = on_progress
+        self._cancelled = threading.Event()
+        self._last_report = 0.0
+
+    def cancel(self):
+        """请求取消（工作函数在下一次检查或报告进度时停止）"""
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def check(self):
+        """已取消时抛出 TaskCancelled"""
+        if self._cancelled.is_set():
+            raise TaskCancelled(self.name)
+
+    def progress(self, fraction, message=None):
+        """报告进度（0~1），同时检查是否已取消"""
+        self.check()
+        if self._on_progress is None:
+            return
+        now = time.perf_counter()
+        if fraction < 1.0 and now - self._last_report < self.PROGRESS_INTERVAL:
+            return
+        self._last_report = now
+        self._runner.post(self._report, fraction, message)
+
+    def _report(self, fraction, message):
+        if not self.cancelled:
+            self._on_progress(fraction, message)
+
+
+class TaskRunner:
+    """在工作线程中运行任务，并在界面线程中派发它们的回调"""
+
+    POLL_INTERVAL = 30  # 检查队列的间隔（毫秒）
+
+    def __init__(self, root, poll_interval=POLL_INTERVAL):
+        self.root = root
+        self.poll_interval = poll_interval
+        self._queue = queue.SimpleQueue()
+        self._job = root.after(poll_interval, self._drain)
+
+    def post(self, callback, *args):
+        """把回调交给界面线程执行（可在任何线程中调用）"""
+        self._queue.put((callback, args))
+
+    def submit(self, name, work, on_done=None, on_error=None, on_progress=None, on_cancel=None):
+        """在新线程中执行 work(task)，返回 Task
+
+        结果和异常分别交给 on_done(result)、on_error(error)，取消时调用 on_cancel()；
+        这些回调以及 on_progress(fraction, message) 都在界面线程中执行。任务取消后不再派发结果。
+        """
+        task = Task(self, name, on_progress)
+
+        def finish(callback, *args):
+            if task.cancelled:
+                if on_cancel is not None:
+                    on_cancel()
+            elif callback is not None:
+                callback(*args)
+
+        def run():
+            try:
+                result = work(task)
+            except TaskCancelled:
+                self.post(finish, None)
+            except Exception as error:
+                self.post(finish, on_error, error)
+            else:
+                self.post(finish, on_done, result)
+
+        threading.Thread(target=run, name=name, daemon=True).start()
+        return task
+
+    def _drain(self):
+        try:
+            while True:
+                try:
+                    callback, args = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                callback(*args)
+        finally:
+            self._job = self.root.after(self.poll_interval, self._drain)
+
+    def close(self):
+        """停止派发（窗口关闭时调用）"""
+        if self._job is not None:
+            self.root.after_cancel(self._job)
+            self._job = None